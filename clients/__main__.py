@@ -0,0 +1,31 @@
+"""
+Run TTI applications described in a registry file in one process, see
+clients.base.registry for the format.
+
+    python -m clients registry.json [application ...]
+"""
+# standard library
+import argparse
+# project
+from clients.base import registry
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    argument_parser = argparse.ArgumentParser(
+        prog='python -m clients', description=__doc__.strip().split('\n')[0])
+    argument_parser.add_argument('registry', help='JSON or YAML registry')
+    argument_parser.add_argument(
+        'applications', nargs='*',
+        help='applications to run, defaults to all enabled applications')
+    args = argument_parser.parse_args(argv)
+    applications = registry.load_registry(args.registry)
+    multiplexer = registry.create_multiplexer(
+        applications, only=args.applications)
+    multiplexer.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@ Implement AGO workflow. AGO code has been copied from marshalling yard
 """
 import os
 from datetime import datetime, timedelta
+import tempfile
+import threading
+import time
 from urllib.parse import urlparse, urlunparse
 import requests
 # TODO: switch to a higher level abstraction such as flask_oauth?
@@ -10,27 +13,126 @@ from oauthlib.oauth2 import (
     LegacyApplicationClient, BackendApplicationClient, WebApplicationClient)
 from requests_oauthlib import OAuth2Session
 import simplejson as json
+# project
+from clients.base import metrics, sessions
 
 
 CLIENT_ID = os.environ.get('AGO_CLIENT_ID', 'dN9MvQLsOn6w1Set')
 CLIENT_SECRET = os.environ.get('AGO_CLIENT_SECRET', None)
 AGO_INSTANCE_URL = 'https://services.arcgis.com/F7DSX1DSNSiWmOqh/'
 TOKEN_URL = 'https://www.arcgis.com/sharing/rest/oauth2/token/'
+# share tokens between processes by pointing this to a writable file
+TOKEN_FILE = os.environ.get('AGO_TOKEN_FILE')
+# AGO error codes for invalid or missing tokens
+INVALID_TOKEN_CODES = (498, 499)
 
 
 class TokenStore():
     """
-    In this class tokens could be stored and recycled. Currently unused.
+    Store and recycle tokens until shortly before they expire. Tokens are
+    kept in memory for all instances of the same name within a process and,
+    if path is given, in a JSON file shared by several processes.
     """
+    # name -> (token, expiration timestamp), shared within the process
+    tokens = {}
+    lock = threading.Lock()
+    # seconds before expiration at which a token is renewed
+    refresh_margin = 300
 
-    def __init__(self, name):
-        pass
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path
 
     def retrieve_token(self):
-        return
+        """
+        Return a token that is valid for at least refresh_margin seconds
+
+        Returns:
+            str or None
+        """
+        with self.lock:
+            entry = self.tokens.get(self.name)
+            if not self.is_valid(entry) and self.path:
+                entry = self.read_file().get(self.name)
+                if self.is_valid(entry):
+                    self.tokens[self.name] = tuple(entry)
+            if self.is_valid(entry):
+                return entry[0]
+        return None
 
     def store_token(self, token, unused, expires):
-        pass
+        """
+        Store a token
+
+        Args:
+            token(str): The token
+            unused: Placeholder for a refresh token
+            expires(int): Lifetime of the token in seconds
+        Returns:
+            None
+        """
+        if not token:
+            return
+        entry = (token, time.time() + int(expires or 0))
+        with self.lock:
+            self.tokens[self.name] = entry
+            if self.path:
+                data = self.read_file()
+                data[self.name] = entry
+                self.write_file(data)
+
+    def invalidate(self):
+        """
+        Drop a token that has been rejected by the server
+        """
+        with self.lock:
+            self.tokens.pop(self.name, None)
+            if self.path:
+                data = self.read_file()
+                if data.pop(self.name, None):
+                    self.write_file(data)
+
+    def is_valid(self, entry):
+        """
+        Check whether a stored entry can still be used
+
+        Args:
+            entry(tuple): token and expiration timestamp
+        Returns:
+            boolean
+        """
+        return bool(entry) and entry[1] - self.refresh_margin > time.time()
+
+    def read_file(self):
+        """
+        Read all tokens from the shared file
+
+        Returns:
+            dict
+        """
+        try:
+            with open(self.path) as filehandle:
+                return json.load(filehandle)
+        except (OSError, ValueError):
+            return {}
+
+    def write_file(self, data):
+        """
+        Replace the shared file atomically so that other processes never see
+        a partial file.
+
+        Args:
+            data(dict): All tokens
+        Returns:
+            None
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as filehandle:
+            json.dump(data, filehandle)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.path)
 
 
 class TokenAuth(requests.auth.AuthBase):
@@ -58,8 +160,7 @@ class TokenAuth(requests.auth.AuthBase):
             resp = self.renew_access_token(url, key, secret, pwd, user)
             token = resp.get('access_token')
             self.store.store_token(token, None, resp.get('expires_in'))
-            return {'token': token}
-        return token
+        return {'token': token}
 
 
 class ArcgisAuth(TokenAuth):
@@ -71,7 +172,7 @@ class ArcgisAuth(TokenAuth):
         self.token_url = TOKEN_URL
         self.client_id = CLIENT_ID
         self.secret = CLIENT_SECRET
-        self.store = TokenStore('ago')
+        self.store = TokenStore('ago', path=TOKEN_FILE)
         print('DEBUG', self.client_id, self.secret)
 
     def add_token_to_url(self, url, token):
@@ -92,10 +193,48 @@ class ArcgisAuth(TokenAuth):
         data = {
             'client_id': key, 'client_secret': secret,
             'grant_type': 'client_credentials'}
-        res = requests.post(url, data)
+        res = sessions.post(url, data)
         return json.loads(res.content)
 
 
+def is_invalid_token(res):
+    """
+    Check whether AGO rejected the token of a request. AGO reports this in
+    the body of a response with status 200.
+
+    Args:
+        res(requests.Response)
+    Returns:
+        boolean
+    """
+    try:
+        error = json.loads(res.content).get('error') or {}
+    except (ValueError, AttributeError):
+        return False
+    return error.get('code') in INVALID_TOKEN_CODES
+
+
+def get_outcome(res, number):
+    """
+    Classify the response to an addFeatures request
+
+    Args:
+        res(dict): decoded response
+        number(int): number of posted records
+    Returns:
+        str: 'success', 'partial' if some records failed, 'invalid_token'
+            or 'failed'
+    """
+    results = res.get('addResults')
+    if results is None or len(results) != number:
+        if (res.get('error') or {}).get('code') in INVALID_TOKEN_CODES:
+            return 'invalid_token'
+        return 'failed'
+    if all(item.get('success') for item in results):
+        return 'success'
+    return 'partial'
+
+
 class FeatureService():
     auth_class = ArcgisAuth
 
@@ -103,14 +242,51 @@ class FeatureService():
         self.feature = feature
         self.layer = layer
 
+    def post(self, url, data):
+        """
+        Post to the feature service and retry once with a fresh token if the
+        cached token has been rejected.
+
+        Args:
+            url(str)
+            data(dict): form data
+        Returns:
+            requests.Response
+        """
+        auth = self.auth_class()
+        res = sessions.post(url, data=data, auth=auth)
+        if is_invalid_token(res):
+            auth.store.invalidate()
+            res = sessions.post(url, data=data, auth=auth)
+        return res
+
     def post_records(self, records):
+        """
+        Add features
+
+        Args:
+            records (list of dict): Features to add
+        Returns:
+            dict: The decoded response, addResults holds a result for each
+                record in the order of records
+        """
         url = '{}/{}/addFeatures/'.format(self.feature, self.layer)
         data = {
             'f': 'json',
             'features': format(json.dumps(records))}
         print(data)
-        res = requests.post(url, data=data, auth=self.auth_class())
+        try:
+            res = self.post(url, data)
+        except requests.RequestException:
+            metrics.AGO_REQUESTS.inc('exception')
+            raise
         print(res.content)
+        try:
+            ret = json.loads(res.content)
+        except json.JSONDecodeError:
+            ret = {}
+        metrics.AGO_REQUESTS.inc(get_outcome(ret, len(records)))
+        return ret
 
     def delete_records(self, sql_query='', objectIds=None):
         """
@@ -127,5 +303,5 @@ class FeatureService():
             data['objectIds'] = ','.join([str(item) for item in objectIds])
         if sql_query:
             data['where'] = sql_query
-        res = requests.post(url, data=data, auth=self.auth_class())
+        res = self.post(url, data)
         print(res.content)
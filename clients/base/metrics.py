@@ -0,0 +1,410 @@
+"""
+Lightweight metrics of the ingest pipeline.
+
+Counters and histograms are kept in memory per label combination, gauges
+are read from functions when rendered, and all are exposed in the Prometheus text format, either by a local HTTP endpoint
+or by a file rewritten periodically (e.g. for the node exporter's
+textfile collector). Set
+
+    METRICS_PORT=9100          serve http://127.0.0.1:9100/metrics (plus
+                               the MQTT partition index)
+    METRICS_FILE=/path/to/file dump every METRICS_INTERVAL seconds (60)
+
+and the MQTT clients start the exporters, see start_exporters. Recording
+a value is a dictionary lookup and an addition under a lock.
+"""
+# standard library
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import inspect
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    """
+    Escape a label value for the text format
+    """
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace(
+        '"', '\\"')
+
+
+def format_labels(names, values, extra=''):
+    """
+    Format labels as {name="value",...}
+
+    Args:
+        names(tuple)
+        values(tuple)
+        extra(str): an already formatted label such as le="0.1"
+    Returns:
+        str
+    """
+    items = ['{}="{}"'.format(name, escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+class Counter():
+    """
+    A monotonically increasing count per label combination
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """
+        Increase the count
+
+        Args:
+            labels: label values in the order of self.labels
+            amount(number)
+        Returns:
+            None
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        """
+        Returns the count of a label combination
+        """
+        return self.values.get(labels, 0)
+
+    def clear(self):
+        """
+        Drop all values
+        """
+        with self.lock:
+            self.values.clear()
+
+    def render(self):
+        """
+        Returns:
+            list of str: lines in the text format
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        return [
+            '{}{} {}'.format(self.name, format_labels(self.labels, key), value)
+            for key, value in values]
+
+
+class Histogram(Counter):
+    """
+    Counts of observations per bucket, their sum and count per label
+    combination
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """
+        Record an observation, e.g. a duration in seconds
+
+        Args:
+            value(number)
+            labels: label values in the order of self.labels
+        Returns:
+            None
+        """
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                # bucket counts (the last one is +Inf), sum
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][idx] += 1
+            entry[1] += value
+
+    def get(self, *labels):
+        """
+        Returns the number of observations of a label combination
+        """
+        entry = self.values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def time(self, *labels):
+        """
+        Context manager observing the duration of a block
+        """
+        return Timer(self, labels)
+
+    def render(self):
+        with self.lock:
+            values = sorted(
+                (key, (list(value[0]), value[1]))
+                for key, value in self.values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.labels, key, 'le="{}"'.format(bound)),
+                    cumulative))
+            labels = format_labels(self.labels, key)
+            lines.append('{}_sum{} {}'.format(self.name, labels, total))
+            lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class Gauge(Counter):
+    """
+    A current value per label combination, read from functions when the
+    metrics are rendered. Values of several functions with the same labels
+    are added up. Bound methods are referenced weakly so that tracking
+    does not keep their objects alive.
+    """
+    kind = 'gauge'
+
+    def track(self, func, *labels):
+        """
+        Read the value of a label combination from func
+
+        Args:
+            func(callable): returns a number
+            labels: label values in the order of self.labels
+        Returns:
+            None
+        """
+        if inspect.ismethod(func):
+            ref = weakref.WeakMethod(func)
+        else:
+            def ref(func=func):
+                return func
+        with self.lock:
+            self.values.setdefault(labels, []).append(ref)
+
+    def get(self, *labels):
+        """
+        Returns the current value of a label combination
+        """
+        with self.lock:
+            refs = list(self.values.get(labels, ()))
+        funcs = [ref() for ref in refs]
+        return sum(func() for func in funcs if func is not None)
+
+    def render(self):
+        with self.lock:
+            keys = sorted(self.values)
+        return [
+            '{}{} {}'.format(
+                self.name, format_labels(self.labels, key), self.get(*key))
+            for key in keys]
+
+
+class Timer():
+    """
+    Observe the duration of a with block in a histogram
+    """
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry():
+    """
+    A collection of metrics rendered together
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """
+        Add a metric, metrics with the same name are only added once
+
+        Args:
+            metric(Counter or Histogram)
+        Returns:
+            the registered metric
+        """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def clear(self):
+        """
+        Drop the values of all metrics, e.g. between tests
+        """
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def render(self):
+        """
+        Returns:
+            str: all metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {} {}'.format(
+                metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        Write all metrics into a file, atomically
+
+        Args:
+            path(str)
+        Returns:
+            None
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as filehandle:
+            filehandle.write(self.render())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+MESSAGES_RECEIVED = REGISTRY.counter(
+    'tti_messages_received_total', 'MQTT messages received',
+    ('topic', 'device'))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'tti_queue_depth', 'Messages waiting to be processed', ('topic',))
+MESSAGES_DROPPED = REGISTRY.gauge(
+    'tti_messages_dropped', 'Messages dropped because the queue was full',
+    ('topic',))
+PARSE_FAILURES = REGISTRY.counter(
+    'tti_parse_failures_total', 'Messages a parser failed on', ('parser',))
+PARSE_SECONDS = REGISTRY.histogram(
+    'tti_parse_seconds', 'Time to parse a message', ('parser',))
+ROWS_WRITTEN = REGISTRY.counter(
+    'tti_rows_written_total', 'Rows passed to a writer', ('writer',))
+WRITE_SECONDS = REGISTRY.histogram(
+    'tti_write_seconds', 'Time to write a batch of rows', ('writer',))
+AGO_REQUESTS = REGISTRY.counter(
+    'tti_ago_requests_total', 'addFeatures requests by outcome', ('outcome',))
+HTTP_SECONDS = REGISTRY.histogram(
+    'tti_http_request_seconds', 'Duration of HTTP requests',
+    ('method', 'host'))
+
+
+class Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serve metrics over HTTP in a background thread
+
+    Args:
+        port(int): 0 picks a free port
+        host(str)
+    Returns:
+        ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def dump_periodically(path, interval):
+    """
+    Dump metrics into a file every interval seconds in a background thread
+
+    Args:
+        path(str)
+        interval(float)
+    Returns:
+        threading.Event: set it to stop dumping
+    """
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            REGISTRY.dump(path)
+
+    threading.Thread(target=run, daemon=True).start()
+    return stopped
+
+
+EXPORTERS = {}
+EXPORTERS_LOCK = threading.Lock()
+
+
+def start_exporters(partition=None):
+    """
+    Start the exporters configured by METRICS_PORT and METRICS_FILE once
+    per process. Partitioned clients (see mqtt.BaseMQTTClient) run as
+    several processes on one host, each serves on METRICS_PORT plus its
+    partition index. An exporter that can not be started is reported but
+    does not stop the client.
+
+    Args:
+        partition(int): defaults to the MQTT_PARTITION environment variable
+    """
+    if partition is None:
+        partition = int(os.environ.get('MQTT_PARTITION', 0))
+    with EXPORTERS_LOCK:
+        port = os.environ.get('METRICS_PORT')
+        if port and 'server' not in EXPORTERS:
+            try:
+                EXPORTERS['server'] = serve(int(port) + partition)
+            except OSError as err:
+                print('Metrics not served on port', int(port) + partition, err)
+                EXPORTERS['server'] = None
+        path = os.environ.get('METRICS_FILE')
+        if path and 'file' not in EXPORTERS:
+            EXPORTERS['file'] = dump_periodically(
+                path, float(os.environ.get('METRICS_INTERVAL', 60)))
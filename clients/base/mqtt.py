@@ -4,30 +4,93 @@ A base client for TTI interaction via MQTT (subscribe)
 """
 # standard library
 import os
+import queue
+import random
+import threading
+import time
+import traceback
+import zlib
 # third party
 import paho.mqtt.client as mqtt
+# project
+from clients.base import metrics
 
 
-MQTT_RCS = [
-    'Connection accepted',
-    'Connection refused, unacceptable protocol version',
-    'Connection refused, identifier rejected',
-    'Connection refused, server unavailable',
-    'Connection refused, bad user name or password',
-    'Connection refused, not authorized']
+def get_device(msg):
+    """
+    The device id in the topic of an uplink (v3/<app>/devices/<dev_id>/up)
+
+    Args:
+        msg(paho.mqtt message object): The message
+    Returns:
+        str or None
+    """
+    parts = (getattr(msg, 'topic', None) or '').split('/')
+    return parts[3] if len(parts) > 3 else None
 
 
 class BaseMQTTClient():
     """
     A generic class to parse MQTT coming from TTI
+
+    By default messages are processed inside the network loop. Set workers
+    to a positive number to only enqueue messages in the network loop and
+    process them in worker threads, the callback must be thread-safe for
+    more than one worker. The queue holds up to queue_size messages, when
+    it is full the backpressure policy applies:
+
+    'block': wait for a free slot (stalls the network loop)
+    'drop_oldest': discard the oldest queued message
+    'drop_newest': discard the incoming message
+
+    Several processes can share an application by setting partitions (the
+    number of processes) and partition (the index of this process), by
+    default from the MQTT_PARTITIONS and MQTT_PARTITION environment
+    variables. With shared_subscription the broker distributes messages
+    within a $share group, otherwise every process receives all messages
+    and keeps the devices whose hashed dev_id falls into its partition.
+
+    Lost connections are re-established with exponential backoff between
+    reconnect_min_delay and reconnect_max_delay seconds, randomized so that
+    many clients do not reconnect at the same time. The topic is subscribed
+    again on every successful connect.
+
+    With persistent_session the client subscribes with QoS 1 and a stable
+    client id on a session that the broker keeps while the client is
+    offline. Messages are acknowledged only after the callback returned and
+    sync_callback (e.g. the flush method of a writer) has stored them
+    durably, so the broker redelivers messages that were lost in a crash.
+    While sync_callback raises (e.g. BaseAGOWriter.sync with records that
+    did not reach AGO) no message is acknowledged.
+    Messages may then be delivered more than once. Messages the callback
+    fails on are acknowledged as well since they would fail again. At most
+    max_inflight messages are unacknowledged, further messages are not
+    read until acknowledgements have been sent. Requires paho-mqtt 2.
     """
     host = ''
+    port = 1883
     topic = ''
     username = ''
     pw_env_var = 'MQTT_PW'
+    partitions = int(os.environ.get('MQTT_PARTITIONS', 1))
+    partition = int(os.environ.get('MQTT_PARTITION', 0))
+    shared_subscription = False
+    workers = 0
+    queue_size = 1000
+    backpressure = 'drop_oldest'
+    keepalive = 10
+    reconnect_min_delay = 1
+    reconnect_max_delay = 120
+    persistent_session = False
+    # defaults to <username>-<partition> for persistent sessions
+    client_id = ''
+    max_inflight = 100
+    # seconds between acknowledgements of processed messages
+    commit_interval = 1
 
     def __init__(
-            self, password=None, callback=None, connect_callback=None
+            self, password=None, callback=None, connect_callback=None,
+            sync_callback=None
     ):
         """
         Connect to MQTT by inializing the class.
@@ -36,9 +99,28 @@ class BaseMQTTClient():
             password(str): MQTT password, optional can be taken from ENV
             callbace(func): A callback function .on_message
             connect_callback(func): A callback function for .on_connect
+            sync_callback(func): Called before processed messages are
+                acknowledged in a persistent session, raises if they have
+                not been stored
         """
         self.process_callback = callback or self.noop
         self.connect_callback = connect_callback or self.noop
+        self.sync_callback = sync_callback or self.noop
+        # message ids received but not acknowledged and processed but not
+        # acknowledged yet
+        self.inflight = set()
+        self.processed = []
+        self.inflight_lock = threading.Lock()
+        self.last_commit = time.monotonic()
+        self.sync_failed = False
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.dropped = 0
+        metrics.QUEUE_DEPTH.track(self.queue_depth, self.topic)
+        metrics.MESSAGES_DROPPED.track(self.dropped_messages, self.topic)
+        self.threads = []
+        # failed reconnects since the last successful connect
+        self.reconnect_attempts = 0
+        self.stopped = threading.Event()
         password = password or os.environ.get(self.pw_env_var)
         self.client = self.connect(password=password)
 
@@ -52,15 +134,100 @@ class BaseMQTTClient():
         Returns:
             Instance of mqtt.Client
         """
-        client = mqtt.Client()
+        if self.persistent_session:
+            client = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION2,
+                client_id=self.get_client_id(), clean_session=False,
+                manual_ack=True)
+        else:
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         client.on_connect = self.on_connect
         client.on_message = self.on_message
         client.on_disconnect = self.on_disconnect
         client.username_pw_set(self.username, password=password)
-        client.connect(self.host, 1883, 10)
-        client.subscribe(self.topic)
+        try:
+            client.connect(self.host, self.port, self.keepalive)
+        except OSError as err:
+            # retried by the reconnect loop
+            print('Connection failed', self.host, err)
         return client
 
+    def get_client_id(self):
+        """
+        A client id that stays the same across restarts so that the broker
+        resumes the session, unique per partition
+
+        Returns:
+            str
+        """
+        return self.client_id or '{}-{}'.format(
+            self.username.replace('@', '-'), self.partition)
+
+    def get_reconnect_delay(self):
+        """
+        Seconds to wait before the next reconnect, doubling with every
+        failed attempt up to reconnect_max_delay. Half of the delay is
+        random.
+
+        Returns:
+            float
+        """
+        delay = min(
+            self.reconnect_max_delay,
+            self.reconnect_min_delay * 2 ** min(self.reconnect_attempts, 32))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reconnect(self):
+        """
+        Reconnect with backoff until connected or stopped
+
+        Returns:
+            boolean: True if the connection has been re-established
+        """
+        while not self.stopped.is_set():
+            delay = self.get_reconnect_delay()
+            print('Reconnecting in {:.1f} seconds'.format(delay))
+            if self.stopped.wait(delay):
+                break
+            try:
+                self.client.reconnect()
+                return True
+            except OSError as err:
+                self.reconnect_attempts += 1
+                print('Reconnect failed', self.host, err)
+        return False
+
+    def get_subscription_topic(self):
+        """
+        The topic to subscribe to, a shared subscription if enabled
+
+        Returns:
+            str
+        """
+        if self.shared_subscription and self.partitions > 1:
+            return '$share/{}/{}'.format(
+                self.username.replace('@', '-') or 'tti', self.topic)
+        return self.topic
+
+    def owns(self, msg):
+        """
+        Check whether a message belongs to the partition of this process.
+        Devices are assigned by a stable hash of the device id taken from
+        the topic (v3/<app>/devices/<dev_id>/up).
+
+        Args:
+            msg(paho.mqtt message object): The message
+        Returns:
+            boolean
+        """
+        if self.partitions <= 1 or self.shared_subscription:
+            return True
+        device = get_device(msg)
+        if device is None:
+            return True
+        return zlib.crc32(
+            device.encode('utf-8')) % self.partitions == self.partition
+
     def noop(self, *args, **kwargs):
         """
         An empty function as a placeholder
@@ -70,24 +237,204 @@ class BaseMQTTClient():
         """
         Start the polling loop
         """
-        self.client.loop_forever()
+        metrics.start_exporters(partition=self.partition)
+        self.start_workers()
+        self.stopped.clear()
+        try:
+            while not self.stopped.is_set():
+                self.commit()
+                if not self.accepting():
+                    # keep the connection alive without reading messages
+                    self.client.loop_write()
+                    self.client.loop_misc()
+                    time.sleep(0.01)
+                elif self.client.loop(timeout=1.0) != mqtt.MQTT_ERR_SUCCESS:
+                    self.reconnect()
+        finally:
+            self.stop_workers()
+            self.commit(force=True)
+
+    def stop(self):
+        """
+        Disconnect and leave the polling loop
+        """
+        self.stopped.set()
+        self.client.disconnect()
+
+    def accepting(self):
+        """
+        Check whether further messages can be received without exceeding
+        max_inflight unacknowledged messages
+
+        Returns:
+            boolean
+        """
+        if not self.persistent_session:
+            return True
+        with self.inflight_lock:
+            return len(self.inflight) < self.max_inflight
+
+    def commit(self, force=False):
+        """
+        Make processed messages durable through sync_callback and
+        acknowledge them. Runs in the network loop, at most every
+        commit_interval seconds unless forced or no more messages are
+        accepted.
+
+        Args:
+            force(boolean)
+        Returns:
+            int: number of acknowledged messages
+        """
+        if not self.persistent_session or not self.processed:
+            return 0
+        # a failed sync is retried after commit_interval even if no more
+        # messages are accepted
+        if not force and (self.accepting() or self.sync_failed) and (
+                time.monotonic() - self.last_commit < self.commit_interval):
+            return 0
+        with self.inflight_lock:
+            processed, self.processed = self.processed, []
+        try:
+            self.sync_callback()
+        except Exception:
+            traceback.print_exc()
+            with self.inflight_lock:
+                self.processed = processed + self.processed
+            self.sync_failed = True
+            self.last_commit = time.monotonic()
+            return 0
+        self.sync_failed = False
+        for msg in processed:
+            self.client.ack(msg.mid, msg.qos)
+        with self.inflight_lock:
+            self.inflight.difference_update(msg.mid for msg in processed)
+        self.last_commit = time.monotonic()
+        return len(processed)
+
+    def start_workers(self):
+        """
+        Start worker threads processing queued messages
+        """
+        for _ in range(len(self.threads), self.workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop_workers(self):
+        """
+        Process all queued messages and stop worker threads
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def work(self):
+        """
+        Worker loop, None stops the worker
+        """
+        while True:
+            msg = self.queue.get()
+            if msg is None:
+                return
+            self.process(msg)
+
+    def process(self, msg):
+        """
+        Call the process callback, errors are printed so that a single bad
+        message does not stop a worker.
+        """
+        try:
+            self.process_callback(msg)
+        except Exception:
+            traceback.print_exc()
+        if self.persistent_session:
+            with self.inflight_lock:
+                self.processed.append(msg)
+
+    def enqueue(self, msg):
+        """
+        Add a message to the processing queue applying the backpressure
+        policy
+
+        Args:
+            msg(paho.mqtt message object): The message
+        Returns:
+            None
+        """
+        # unacknowledged messages must not be dropped
+        if self.backpressure == 'block' or self.persistent_session:
+            self.queue.put(msg)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(msg)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.backpressure == 'drop_newest':
+                    return
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def queue_depth(self):
+        """
+        Returns the number of messages waiting to be processed
+        """
+        return self.queue.qsize()
+
+    def dropped_messages(self):
+        """
+        Returns the number of messages dropped because the queue was full
+        """
+        return self.dropped
 
     def on_message(self, client, data, msg):
         """
         Wrap the message callback function, the footprint is determined
         by the paho.mqtt package
         """
+        if self.persistent_session:
+            with self.inflight_lock:
+                self.inflight.add(msg.mid)
+        if not self.owns(msg):
+            if self.persistent_session:
+                # acknowledge without processing
+                with self.inflight_lock:
+                    self.processed.append(msg)
+            return
         print('message received from', self.topic)
-        self.process_callback(msg)
+        metrics.MESSAGES_RECEIVED.inc(self.topic, get_device(msg))
+        if self.workers > 0:
+            self.enqueue(msg)
+        elif self.persistent_session:
+            self.process(msg)
+        else:
+            self.process_callback(msg)
 
-    def on_connect(self, client, data, flags, rc):
+    def on_connect(self, client, data, flags, reason_code, properties):
         """
         Wrap the connect callback function, the footprint is determined
-        by the paho.mqtt package
+        by the paho.mqtt package (callback API version 2)
         """
-        print('MQTT response code: {}, {}'.format(rc, MQTT_RCS[rc]))
+        print('MQTT response code: {}, {}'.format(
+            reason_code.value, reason_code))
+        if not reason_code.is_failure:
+            self.reconnect_attempts = 0
+            client.subscribe(
+                self.get_subscription_topic(),
+                qos=1 if self.persistent_session else 0)
+        else:
+            self.reconnect_attempts += 1
         self.connect_callback()
 
-    def on_disconnect(self, client, data, rc):
+    def on_disconnect(self, client, data, flags, reason_code, properties):
+        """
+        Report a lost connection, reconnecting is left to the polling loop
+        """
         print('Connection lost, MQTT response code: {}, {}'.format(
-            rc, MQTT_RCS[rc]))
+            reason_code.value, reason_code))
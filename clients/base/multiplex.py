@@ -0,0 +1,177 @@
+# pylint:disable=E0401
+"""
+Run several TTI applications in a single process.
+
+All MQTT connections are served by one select loop, parsers are shared
+between writers using the same parser class and HTTP requests go through
+the shared session pool (see clients.base.sessions).
+
+Applications are described in a registry file, see
+clients.base.registry, and run with
+
+    python -m clients registry.json
+"""
+# standard library
+import importlib
+import os
+import select
+import time
+# project
+from clients.base import metrics
+
+
+def import_string(path):
+    """
+    Import a class (or any attribute) from a dotted path
+
+    Args:
+        path(str): e.g. clients.base.parsers.BaseParser
+    Returns:
+        object
+    """
+    module_name, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), name)
+
+
+def get_write_method(writer):
+    """
+    The default method receiving messages for a writer
+    """
+    return 'add_to_ago' if hasattr(writer, 'add_to_ago') else 'add_to_csv'
+
+
+class Multiplexer():
+    """
+    Serve several (client, writer, parser) combinations in one process
+    """
+    # seconds to wait for network activity in the select loop
+    timeout = 1
+
+    def __init__(self, applications=None):
+        """
+        Args:
+            applications(list of dict): entries with the keys client, writer
+                and optionally parser, method and pw_env_var
+        """
+        self.parsers = {}
+        self.clients = []
+        self.writers = []
+        self.next_reconnect = {}
+        self.running = False
+        for entry in applications or []:
+            self.add(**entry)
+
+    def get_parser(self, parser_class):
+        """
+        Return the parser instance shared by all writers using parser_class
+        """
+        if parser_class not in self.parsers:
+            self.parsers[parser_class] = parser_class()
+        return self.parsers[parser_class]
+
+    def add(self, client, writer, parser=None, method=None, pw_env_var=None):
+        """
+        Add an application
+
+        Args:
+            client(str or class): MQTT client class
+            writer(str or class): writer class
+            parser(str or class): parser class, defaults to the parser class
+                of the writer
+            method(str): writer method receiving messages
+            pw_env_var(str): environment variable holding the MQTT password
+        Returns:
+            client instance
+        """
+        client_class = import_string(client) if isinstance(
+            client, str) else client
+        writer_class = import_string(writer) if isinstance(
+            writer, str) else writer
+        if isinstance(parser, str):
+            parser = import_string(parser)
+        writer_instance = writer_class()
+        writer_instance.parser = self.get_parser(
+            parser or writer_instance.parser_class)
+        callback = getattr(
+            writer_instance, method or get_write_method(writer_instance))
+        password = os.environ.get(pw_env_var) if pw_env_var else None
+        client_instance = client_class(
+            password=password, callback=callback,
+            sync_callback=getattr(
+                writer_instance, 'sync',
+                getattr(writer_instance, 'flush', None)))
+        self.writers.append(writer_instance)
+        self.clients.append(client_instance)
+        return client_instance
+
+    def loop_once(self, timeout=None):
+        """
+        Serve network traffic of all clients once
+
+        Args:
+            timeout(float): seconds to wait for network activity
+        Returns:
+            None
+        """
+        sockets = {}
+        paused = set()
+        for client in self.clients:
+            client.commit()
+            sock = client.client.socket()
+            if sock is None:
+                self.reconnect(client)
+            else:
+                sockets[sock] = client.client
+                if not client.accepting():
+                    paused.add(sock)
+        readable, writable = [], []
+        if sockets:
+            readable, writable, _ = select.select(
+                [sock for sock in sockets if sock not in paused],
+                [sock for sock, item in sockets.items() if item.want_write()],
+                [], self.timeout if timeout is None else timeout)
+        else:
+            time.sleep(self.timeout if timeout is None else timeout)
+        for sock in readable:
+            sockets[sock].loop_read()
+        for sock in writable:
+            sockets[sock].loop_write()
+        for client in self.clients:
+            client.client.loop_misc()
+
+    def reconnect(self, client):
+        """
+        Try to reconnect a disconnected client, the delay between attempts
+        grows with the backoff of the client
+        """
+        now = time.monotonic()
+        if now < self.next_reconnect.get(id(client), now):
+            return
+        try:
+            client.client.reconnect()
+        except OSError as err:
+            client.reconnect_attempts += 1
+            print('Reconnect failed', client.topic, err)
+        self.next_reconnect[id(client)] = now + client.get_reconnect_delay()
+
+    def run(self):
+        """
+        Serve all applications until stopped
+        """
+        self.running = True
+        metrics.start_exporters()
+        for client in self.clients:
+            client.start_workers()
+        try:
+            while self.running:
+                self.loop_once()
+        finally:
+            for client in self.clients:
+                client.stop_workers()
+                client.commit(force=True)
+
+    def stop(self):
+        """
+        Stop the loop after the current iteration
+        """
+        self.running = False
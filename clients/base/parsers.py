@@ -1,15 +1,28 @@
-    # pylint:disable=E0401,R0201,W0613
+    # pylint:disable=E0401,R0201,W0603,W0613
 """
 Base classes to parse LoRaWAN data
 
 The TBS12S device did get a base class because of common
 use at TNC
+
+Set PARSER_PROFILE=stages (or cprofile) to time parsing stages in a
+running process, see enable_profiling.
 """
 # standard library
 import base64
+import cProfile
 from datetime import datetime
+import functools
+import io
 import json
+import os
+import pstats
 import re
+import signal
+import struct
+import sys
+import threading
+import time
 # third party
 import pytz
 
@@ -21,22 +34,584 @@ TIME_PATTERN = '%Y-%m-%dT%H:%M:%S'
 TBS12S_MESSAGE_PATTERN = re.compile(
     r'^(?P<prefix>[A-Z]+)(?P<time>\d{2}:\d{2}:\d{2}:\d{2}:\d{2}:00)'
     r'(?P<data>[RS0-9]*)[ ]*(?P<measurements>.*)$')
+# fields of TBS12S messages per prefix as
+# name, group of TBS12S_MESSAGE_PATTERN, start, end, conversion
+TBS12S_SCHEMAS = {
+    'PS': (
+        ('sensor_id', 'data', 0, 1, str),
+        ('sub_sensor_id', 'data', 1, 2, str),
+        ('nb_values', 'data', 2, 4, int)),
+    'C': (
+        ('board_id', 'data', 0, 8, str),
+        ('fw_version', 'data', 8, 16, str),
+        ('power_supply', 'data', 16, 17, str),
+        ('sensor_nb', 'data', 17, 18, int),
+        ('status', 'data', 18, 19, str),
+        ('dev_rssi', 'measurements', None, None, int)),
+    'PB': (
+        ('battery_voltage', 'measurements', None, None, float),)}
+
+
+def unpack_int24(number):
+    """
+    Create an unpack_from function for number big-endian signed 3 byte
+    integers, which struct does not support
+
+    Args:
+        number(int)
+    Returns:
+        func
+    """
+    def unpack_from(buffer, offset=0):
+        return tuple(
+            int.from_bytes(
+                buffer[offset + idx:offset + idx + 3], 'big', signed=True)
+            for idx in range(0, 3 * number, 3))
+    return unpack_from
+
+
+def compile_lpp_type(name, fmt, scales):
+    """
+    Args:
+        name(str or tuple): type name as used by pycayennelpp or field
+            names
+        fmt(str): struct format of the values, 't' for signed 3 byte
+            integers
+        scales(tuple): divisors of the values
+    Returns:
+        tuple: name, size, unpack_from function, scales
+    """
+    if 't' in fmt:
+        return name, 3 * len(fmt), unpack_int24(len(fmt)), scales
+    packer = struct.Struct('>' + fmt)
+    return name, packer.size, packer.unpack_from, scales
+
+
+# Cayenne LPP type -> name, size, unpack_from function, scales
+LPP_TYPES = {
+    type_id: compile_lpp_type(*item) for type_id, item in {
+        0: ('Digital Input', 'B', (1,)),
+        1: ('Digital Output', 'B', (1,)),
+        2: ('Analog Input', 'h', (100,)),
+        3: ('Analog Output', 'h', (100,)),
+        100: ('Generic Sensor', 'I', (1,)),
+        101: ('Illuminance', 'H', (1,)),
+        102: ('Presence', 'B', (1,)),
+        103: ('Temperature', 'h', (10,)),
+        104: ('Humidity', 'B', (2,)),
+        113: ('Accelerometer', 'hhh', (1000, 1000, 1000)),
+        115: ('Barometer', 'H', (10,)),
+        116: ('Voltage', 'H', (100,)),
+        117: ('Current', 'H', (1000,)),
+        118: ('Frequency', 'I', (1,)),
+        120: ('Percentage', 'B', (1,)),
+        121: ('Altitude', 'h', (1,)),
+        122: ('Load', 't', (1000,)),
+        125: ('Concentration', 'H', (1,)),
+        128: ('Power', 'H', (1,)),
+        130: ('Distance', 'I', (1000,)),
+        131: ('Energy', 'I', (1000,)),
+        132: ('Direction', 'H', (1,)),
+        133: ('Time', 'I', (1,)),
+        134: ('Gyrometer', 'hhh', (100, 100, 100)),
+        135: ('Colour', 'BBB', (1, 1, 1)),
+        136: ('Location', 'ttt', (10000, 10000, 100)),
+        142: ('Switch', 'B', (1,))}.items()}
+# (type, channel) -> field name, e.g. (103, 1) -> Temperature_1
+LPP_FIELD_NAMES = {
+    (type_id, channel): '{}_{}'.format(item[0].replace(' ', '_'), channel)
+    for type_id, item in LPP_TYPES.items() for channel in range(0, 256)}
+
+
+def decode_lpp(payload):
+    """
+    Decode a Cayenne LPP payload
+
+    Args:
+        payload(bytes)
+    Returns:
+        list of tuple: channel, type and values of each data item
+    """
+    ret = []
+    pos = 0
+    end = len(payload)
+    while pos < end:
+        entry = LPP_TYPES.get(payload[pos + 1]) if pos + 1 < end else None
+        if entry is None or pos + 2 + entry[1] > end:
+            raise ValueError('Invalid Cayenne LPP payload {!r}'.format(payload))
+        values = entry[2](payload, pos + 2)
+        ret.append((payload[pos], payload[pos + 1], tuple(
+            value / scale for value, scale in zip(values, entry[3]))))
+        pos += 2 + entry[1]
+    return ret
+
+
+def lpp_to_dict(payload):
+    """
+    Decode a Cayenne LPP payload into fields such as Temperature_1. Only
+    the first value of multi-dimensional types (e.g. Location) is kept.
+
+    Args:
+        payload(bytes)
+    Returns:
+        dict
+    """
+    ret = {}
+    pos = 0
+    end = len(payload)
+    types = LPP_TYPES
+    while pos < end:
+        type_id = payload[pos + 1] if pos + 1 < end else None
+        entry = types.get(type_id)
+        if entry is None or pos + 2 + entry[1] > end:
+            raise ValueError('Invalid Cayenne LPP payload {!r}'.format(payload))
+        ret[LPP_FIELD_NAMES[(type_id, payload[pos])]] = (
+            entry[2](payload, pos + 2)[0] / entry[3][0])
+        pos += 2 + entry[1]
+    return ret
+
+
+# Tektelic asset tracker data items by their channel and type bytes
+# (channel << 8 | type) -> field names, size, unpack_from function, scales
+TEKTELIC_LAYOUTS = {
+    key: compile_lpp_type(*item) for key, item in {
+        0x00ff: (('battery_voltage',), 'h', (100,)),
+        0x00d3: (('battery_lifetime',), 'B', (1,)),
+        0x0067: (('temperature',), 'h', (10,)),
+        0x0071: (
+            ('acceleration_x', 'acceleration_y', 'acceleration_z'), 'hhh',
+            (1000, 1000, 1000)),
+        # same layout as the Cayenne LPP GPS type (136)
+        0x0088: (
+            ('lat', 'lon', 'altitude'), 'ttt', (10000, 10000, 100))}.items()}
+
+
+def decode_tektelic(payload, layouts=TEKTELIC_LAYOUTS):
+    """
+    Decode a Tektelic asset tracker payload, a sequence of data items made
+    of a channel byte, a type byte and a fixed size value. Battery voltage
+    is in V, temperature in degree Celsius, acceleration in g and the GNSS
+    position in degrees and m. The size of an item depends on its type,
+    decoding stops at the first item not in layouts (or truncated) and
+    returns the fields decoded so far.
+
+    Args:
+        payload(bytes)
+        layouts(dict): see TEKTELIC_LAYOUTS
+    Returns:
+        dict: e.g. lat, lon, altitude, battery_voltage
+    """
+    ret = {}
+    pos = 0
+    end = len(payload)
+    while pos < end:
+        entry = layouts.get(
+            payload[pos] << 8 | payload[pos + 1]) if pos + 1 < end else None
+        if entry is None or pos + 2 + entry[1] > end:
+            break
+        for name, value, scale in zip(
+                entry[0], entry[2](payload, pos + 2), entry[3]):
+            ret[name] = value / scale
+        pos += 2 + entry[1]
+    return ret
+
+
+@functools.lru_cache(maxsize=4096)
+def get_utc_offset(hour, local_tz=LOCAL_TZ):
+    """
+    UTC offset of a timezone during a UTC hour. Timezone lookups are cached
+    per hour since offsets change on full hours only.
+
+    Args:
+        hour(str): UTC hour as YYYY-MM-DDTHH
+        local_tz(pytz.timezone)
+    Returns:
+        timedelta
+    """
+    time = datetime(
+        int(hour[0:4]), int(hour[5:7]), int(hour[8:10]), int(hour[11:13]),
+        tzinfo=pytz.UTC)
+    return time.astimezone(local_tz).utcoffset()
+
+
+def parse_utc(timestring):
+    """
+    Parse an ISO-8601 UTC timestamp as sent by TTI, e.g.
+    2021-01-04T23:46:05.124510287Z. Fractions of a second are kept up to
+    microseconds.
+
+    Args:
+        timestring(str)
+    Returns:
+        datetime (naive)
+    """
+    time = datetime.fromisoformat(timestring[0:19])
+    if timestring[19:20] == '.':
+        fraction = timestring[20:26].rstrip('Z')
+        if fraction.isdigit():
+            time = time.replace(microsecond=int(fraction.ljust(6, '0')))
+    return time
+
+
+def get_local_datetime(timestring, local_tz=LOCAL_TZ):
+    """
+    Convert an ISO-8601 UTC timestamp to local time
+
+    Args:
+        timestring(str)
+        local_tz(pytz.timezone)
+    Returns:
+        datetime (naive)
+    """
+    return parse_utc(timestring) + get_utc_offset(timestring[0:13], local_tz)
 
 
 def get_local_time(timestring, local_tz=LOCAL_TZ, timepattern=TIME_PATTERN):
     """
-    Convert time to local time
+    Convert time to local time, fractions of a second are cut off
     """
     if timestring:
-        # cut off the fractions of a second because of Python bug
-        timestr = timestring.split('.')[0]
-        time = datetime.strptime(timestr, timepattern)
-        time = time.replace(tzinfo=pytz.UTC)
-        time = time.astimezone(local_tz)
-        return time.strftime(timepattern)
+        if timepattern != TIME_PATTERN:
+            timestr = timestring.split('.')[0]
+            time = datetime.strptime(timestr, timepattern)
+            time = time.replace(tzinfo=pytz.UTC)
+            time = time.astimezone(local_tz)
+            return time.strftime(timepattern)
+        return get_local_datetime(timestring, local_tz).isoformat(
+            timespec='seconds')
     return ''
 
 
+@functools.lru_cache(maxsize=4096)
+def convert_device_time(timestring):
+    """
+    Convert TBS12S device time (yy:mm:dd:HH:MM:SS) into
+    YYYY-mm-dd HH:MM:SS. Years follow the strptime convention for %y.
+
+    Args:
+        timestring(str)
+    Returns:
+        str
+    """
+    year = int(timestring[0:2])
+    year += 2000 if year < 69 else 1900
+    return datetime(
+        year, int(timestring[3:5]), int(timestring[6:8]),
+        int(timestring[9:11]), int(timestring[12:14]),
+        int(timestring[15:17])).isoformat(sep=' ')
+
+
+def compile_tbs12s_decoder(schemas, pattern=TBS12S_MESSAGE_PATTERN):
+    """
+    Compile the declared fields of TBS12S messages into a decoder. The
+    decoder matches a message once and converts the fields of its prefix
+    with precomputed group indexes and slices.
+
+    Args:
+        schemas(dict): prefix -> fields, see TBS12S_SCHEMAS
+        pattern(re.Pattern): with prefix, time, data and measurements
+            groups
+    Returns:
+        func: decodes a payload (bytes) into a dict, empty if the payload
+            does not match
+    """
+    compiled = {
+        prefix: tuple(
+            (name, pattern.groupindex[group] - 1, slice(start, end), convert)
+            for name, group, start, end, convert in fields)
+        for prefix, fields in schemas.items()}
+    match = pattern.match
+
+    def decode(byte_string):
+        res = match(byte_string.decode('utf-8'))
+        if not res:
+            return {}
+        groups = res.groups()
+        ret = {
+            'prefix': groups[0],
+            'device_time': convert_device_time(groups[1]),
+            'measurements': groups[3]}
+        for name, index, part, convert in compiled.get(groups[0], ()):
+            ret[name] = convert(groups[index][part])
+        return ret
+    return decode
+
+
+decode_tbs12s = compile_tbs12s_decoder(TBS12S_SCHEMAS)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_sdi12_schema(fields):
+    """
+    Compile the measurement fields of a SDI-12 sensor into a decoder of
+    the measurements of PS messages (space separated values preformatted
+    by the TBS12S). Values beyond the declared fields are ignored.
+
+    Args:
+        fields(tuple): field names in the order the sensor reports values
+    Returns:
+        func: decodes measurements (str) into a dict
+    """
+    size = len(fields)
+
+    def decode(measurements):
+        values = measurements.split(' ')
+        if len(values) < size:
+            raise ValueError('Expected {} values in {!r}'.format(
+                size, measurements))
+        return dict(zip(fields, map(float, values[0:size])))
+    return decode
+
+
+def to_columns(rows):
+    """
+    Convert a list of dictionaries into a dictionary of lists. Fields
+    missing in a row are filled with None.
+
+    Args:
+        rows(list of dict)
+    Returns:
+        dict
+    """
+    fields = {}
+    for row in rows:
+        for key in row:
+            fields[key] = None
+    return {key: [row.get(key) for row in rows] for key in fields}
+
+
+def from_columns(columns):
+    """
+    Convert a dictionary of lists into a list of dictionaries, the inverse
+    of to_columns. Fields with None are kept so that rows match the output
+    of .parse for the same message.
+
+    Args:
+        columns(dict)
+    Returns:
+        list of dict
+    """
+    keys = list(columns)
+    return [
+        dict(zip(keys, values))
+        for values in zip(*columns.values())]
+
+
+class StageProfiler():
+    """
+    Time the stages of BaseParser.parse per parser class. Optionally all
+    calls within parse are profiled with cProfile, one profile per thread.
+    """
+    stages = (
+        'message_to_dict', 'get_lorawan_metadata', 'get_payload',
+        'get_device_data', 'sensor_condition', 'get_sensor_data')
+
+    def __init__(self, cprofile=False):
+        self.cprofile = cprofile
+        self.started = time.time()
+        # (parser class name, stage) -> [calls, total seconds, max seconds]
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = []
+
+    def record(self, name, stage, duration):
+        """
+        Add a duration to the statistics of a stage
+        """
+        with self.lock:
+            entry = self.timings.get((name, stage))
+            if entry is None:
+                entry = self.timings[(name, stage)] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+
+    def get_profile(self):
+        """
+        Returns the cProfile.Profile of the current thread
+        """
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+        return profile
+
+    def parse(self, parser, msg):
+        """
+        The steps of BaseParser.parse, timed one by one
+
+        Args:
+            parser(BaseParser)
+            msg: Message object
+        Returns:
+            dict
+        """
+        profile = self.get_profile() if self.cprofile else None
+        if profile is not None:
+            profile.enable()
+        try:
+            return self.run_stages(parser, msg)
+        finally:
+            if profile is not None:
+                profile.disable()
+
+    def run_stages(self, parser, msg):
+        """
+        Run the parser's own parse_message on a TimedParser so that every
+        stage method is timed where the parser calls it
+        """
+        start = time.perf_counter()
+        ret = type(parser).parse_message(TimedParser(parser, self), msg)
+        self.record(
+            type(parser).__name__, 'parse', time.perf_counter() - start)
+        return ret
+
+    def time_stage(self, name, stage, method):
+        """
+        Wrap a method so that its calls are recorded as a stage
+
+        Args:
+            name(str): parser class name
+            stage(str)
+            method(func)
+        Returns:
+            func
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(name, stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self, limit=25):
+        """
+        A table of the timings per parser class and stage and, in cProfile
+        mode, the functions with the highest cumulative time
+
+        Args:
+            limit(int): number of cProfile entries
+        Returns:
+            str
+        """
+        with self.lock:
+            timings = sorted(self.timings.items())
+            profiles = list(self.profiles)
+        lines = [
+            'Parser profile since {}'.format(
+                datetime.fromtimestamp(self.started).isoformat(
+                    sep=' ', timespec='seconds')),
+            '{:<28} {:<22} {:>9} {:>11} {:>9} {:>9}'.format(
+                'parser', 'stage', 'calls', 'total ms', 'mean us', 'max us')]
+        for (name, stage), (calls, total, maximum) in timings:
+            lines.append(
+                '{:<28} {:<22} {:>9} {:>11.1f} {:>9.1f} {:>9.1f}'.format(
+                    name, stage, calls, total * 1e3, total / calls * 1e6,
+                    maximum * 1e6))
+        ret = '\n'.join(lines) + '\n'
+        if profiles:
+            stream = io.StringIO()
+            stats = pstats.Stats(profiles[0], stream=stream)
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.sort_stats('cumulative').print_stats(limit)
+            ret += stream.getvalue()
+        return ret
+
+    def dump(self, *args):
+        """
+        Write the summary to stdout
+        """
+        sys.stdout.write(self.summary())
+        sys.stdout.flush()
+
+    def dump_in_background(self, *args):
+        """
+        A signal handler writing the summary from a new thread, the
+        interrupted thread may hold self.lock
+
+        Returns:
+            threading.Thread
+        """
+        thread = threading.Thread(target=self.dump, daemon=True)
+        thread.start()
+        return thread
+
+
+class TimedParser():
+    """
+    Stands in for a parser while it is profiled. Methods of the parser's
+    class are bound to the proxy, so calls of stage methods from within
+    other methods are timed as well. Everything else is taken from the
+    parser.
+    """
+
+    def __init__(self, parser, profiler):
+        self.parser = parser
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        parser = self.parser
+        if name in vars(parser):
+            return getattr(parser, name)
+        for klass in type(parser).__mro__:
+            if name in vars(klass):
+                attr = vars(klass)[name]
+                break
+        else:
+            return getattr(parser, name)
+        if not hasattr(attr, '__get__'):
+            return attr
+        method = attr.__get__(self, type(parser))
+        if name in self.profiler.stages:
+            return self.profiler.time_stage(
+                type(parser).__name__, name, method)
+        return method
+
+
+# set by enable_profiling, BaseParser.parse is timed per stage if set
+PROFILER = None
+
+
+def enable_profiling(cprofile=False, signum=signal.SIGUSR1):
+    """
+    Time the stages of BaseParser.parse and print a summary when the
+    process receives signum, e.g.
+
+        kill -USR1 <pid>
+
+    The signal handler can only be installed from the main thread.
+
+    Args:
+        cprofile(boolean): profile parsing with cProfile as well
+        signum(int): the signal, None to not install a handler
+    Returns:
+        StageProfiler
+    """
+    global PROFILER
+    PROFILER = StageProfiler(cprofile=cprofile)
+    if signum is not None and (
+            threading.current_thread() is threading.main_thread()):
+        signal.signal(signum, PROFILER.dump_in_background)
+    return PROFILER
+
+
+def disable_profiling():
+    """
+    Stop timing parser stages
+    """
+    global PROFILER
+    PROFILER = None
+
+
+# PARSER_PROFILE=stages or PARSER_PROFILE=cprofile
+if os.environ.get('PARSER_PROFILE'):
+    enable_profiling(cprofile=os.environ['PARSER_PROFILE'] == 'cprofile')
+
+
 class BaseParser():
     """
     A base class parsing MQTT messages from TTI. Subclass and re-implement
@@ -55,6 +630,21 @@ class BaseParser():
         """
         return json.loads(byte_string.decode('utf-8'))
 
+    def message_to_dict(self, msg):
+        """
+        Convert a message to a dictionary. Messages that already carry the
+        decoded record (see storage.DecodedMessage) are not decoded again.
+
+        Args:
+            msg: Message object with a payload or dic attribute
+        Returns:
+            dict
+        """
+        dic = getattr(msg, 'dic', None)
+        if dic is None:
+            dic = self.bytes_to_dict(msg.payload)
+        return dic
+
     def get_payload(self, dic):
         """
         Extract and decode LoRaWAN payload field.
@@ -80,15 +670,73 @@ class BaseParser():
         Returns:
             dict
         """
+        if PROFILER is not None:
+            return PROFILER.parse(self, msg)
+        return self.parse_message(msg)
+
+    def parse_message(self, msg):
+        """
+        The steps of .parse without profiling
+
+        Args:
+            msg(paho.mqtt message object): The message
+        Returns:
+            dict
+        """
+        ret = self.parse_device(self.message_to_dict(msg))
+        if self.sensor_condition(ret):
+            ret.update(self.get_sensor_data(ret))
+        return ret
+
+    def parse_device(self, dic):
+        """
+        The first two steps of parsing, LoRaWAN metadata and device data
+
+        Args:
+            dic(dict): Message in dict format
+        Returns:
+            dict
+        """
         ret = {}
-        dic = self.bytes_to_dict(msg.payload)
         ret.update(self.get_lorawan_metadata(dic))
         payload = self.get_payload(dic)
         ret.update(self.get_device_data(payload))
-        if self.sensor_condition(ret):
-            ret.update(self.get_sensor_data(ret))
         return ret
 
+    def parse_many(self, messages):
+        """
+        Parse a batch of messages (e.g. a page from the storage API) into
+        columns, see .parse_rows
+
+        Args:
+            messages(list): Message objects with a payload attribute
+        Returns:
+            dict: columns, a list of values for every field
+        """
+        return to_columns(self.parse_rows(messages))
+
+    def parse_rows(self, messages):
+        """
+        Parse a batch of messages into one dictionary per message, the same
+        as .parse for every message. Metadata and device data are parsed
+        message by message, sensor data of all messages meeting
+        .sensor_condition is passed to .get_sensor_data_many at once so that
+        parsers can decode it together. This is not faster than .parse by
+        itself, batches save on writing (see
+        writers.BaseCSVWriter.add_many_to_csv).
+
+        Args:
+            messages(list): Message objects with a payload attribute
+        Returns:
+            list of dict
+        """
+        rows = [
+            self.parse_device(self.message_to_dict(msg)) for msg in messages]
+        selected = [row for row in rows if self.sensor_condition(row)]
+        for row, data in zip(selected, self.get_sensor_data_many(selected)):
+            row.update(data)
+        return rows
+
     def get_lorawan_metadata(self, dic):
         """
         Parse out the metadata from LoRaWAN network server
@@ -152,44 +800,83 @@ class BaseParser():
         """
         return {}
 
+    def get_sensor_data_many(self, dics):
+        """
+        Parse out sensor data for a batch, override for vectorized parsing
+
+        Args:
+            dics(list of dict)
+        Returns:
+            list of dict
+        """
+        return [self.get_sensor_data(dic) for dic in dics]
+
+
+class CayenneLPPParser(BaseParser):
+    """
+    A parser for devices sending Cayenne LPP payloads
+    """
+
+    def get_sensor_data(self, dic):
+        """
+        Decode the Cayenne LPP payload already decoded from base64 by
+        .get_payload
+
+        Args:
+            dic(dict): A device data dictionary
+        Returns:
+            dict
+        """
+        return lpp_to_dict(dic['device'])
+
+    def get_sensor_data_many(self, dics):
+        """
+        Decode the payloads of a batch
+
+        Args:
+            dics(list of dict)
+        Returns:
+            list of dict
+        """
+        decode = lpp_to_dict
+        return [decode(dic['device']) for dic in dics]
+
 
 class TBS12SParser(BaseParser):
     """
-    A parser for TBS12S devices
+    A parser for TBS12S devices. Set sensor_fields to the names of the
+    values the attached SDI-12 sensor reports to parse its measurements,
+    see compile_sdi12_schema.
     """
+    sensor_fields = ()
+
+    def __init__(self):
+        self.decode_sensor = compile_sdi12_schema(
+            tuple(self.sensor_fields)) if self.sensor_fields else None
 
     def get_device_data(self, byte_string):
         """
-        Parse out TBS12S data
+        Parse out TBS12S data, see TBS12S_SCHEMAS
 
         Args:
             byte_string(bytes)
         Returns:
             dict
         """
-        res = TBS12S_MESSAGE_PATTERN.match(byte_string.decode('utf-8'))
-        if not res:
+        return decode_tbs12s(byte_string)
+
+    def get_sensor_data(self, dic):
+        """
+        Parse SDI-12 measurements (preformatted by TBS12S)
+
+        Args:
+            dic(dict): A device data dictionary
+        Returns:
+            dict
+        """
+        if self.decode_sensor is None:
             return {}
-        ret = {
-            'prefix': res['prefix'],
-            'device_time': datetime.strftime(
-                datetime.strptime(res['time'],
-            '%y:%m:%d:%H:%M:%S'), '%Y-%m-%d %H:%M:%S'),
-            'measurements': res['measurements']}
-        if ret.get('prefix') == 'PS':
-            ret['sensor_id'] = res['data'][0]
-            ret['sub_sensor_id'] = res['data'][1]
-            ret['nb_values'] = int(res['data'][2:4])
-        if ret.get('prefix') == 'C':
-            ret['board_id'] = res['data'][0:8]
-            ret['fw_version'] = res['data'][8:16]
-            ret['power_supply'] = res['data'][16]
-            ret['sensor_nb'] = int(res['data'][17])
-            ret['status'] = res['data'][18]
-            ret['dev_rssi'] = int(res['measurements'])
-        if ret.get('prefix') == 'PB':
-            ret['battery_voltage'] = float(res['measurements'])
-        return ret
+        return self.decode_sensor(dic.get('measurements', ''))
 
     def sensor_condition(self, dic):
         """
@@ -204,33 +891,39 @@ class TBS12SParser(BaseParser):
 
 
 class TektelicTrackerParser(BaseParser):
+    """
+    A parser for Tektelic asset trackers, see decode_tektelic
+    """
 
     def convert_bytestring_to_hexrepresentation(self, bytes_string):
         """
         This might be helpful for debugging (unused for the actual parsing)
         """
-        ret = ''
-        for item in list(bytes_string):
-            hx = hex(item)[2:]
-            ret += (hx if len(hx) == 2 else "0" + hx) + ' '
-        return ret[:-1]
+        return bytes(bytes_string).hex(' ')
 
     def get_device_data(self, byte_string):
-        return {'device': self.convert_bytestring_to_hexrepresentation(
-            byte_string)}
+        """
+        Decode the tracker payload, the raw payload is kept as hex string
+        in the device field
+
+        Args:
+            byte_string(bytes)
+        Returns:
+            dict
+        """
+        ret = decode_tektelic(byte_string)
+        ret['device'] = self.convert_bytestring_to_hexrepresentation(
+            byte_string)
+        return ret
 
 
 class FeatherTrackerParser(BaseParser):
 
     def get_time(self, received):
-        utc = pytz.timezone('UTC')
-        pst = pytz.timezone('America/Los_Angeles')
         try:
-            received = received.split('.')[0]
-            rec_time = datetime.strptime(received, '%Y-%m-%dT%H:%M:%S')
-            rec_time = utc.localize(rec_time)
-            return rec_time.astimezone(pst).strftime('%Y-%m-%d %H:%M:%S')
-        except (AttributeError, ValueError):
+            return get_local_datetime(received).isoformat(
+                sep=' ', timespec='seconds')
+        except (AttributeError, TypeError, ValueError):
             return None
 
     def parse(self, msg):
@@ -238,7 +931,7 @@ class FeatherTrackerParser(BaseParser):
         Since we have very different devices in this application, we rely
         on payload formatters.
         """
-        dic = self.bytes_to_dict(msg.payload)
+        dic = self.message_to_dict(msg)
         payload = dic.get('uplink_message', {}).get('decoded_payload', {})
         ret = self.get_lorawan_metadata(dic)
         ret.update({
@@ -250,3 +943,9 @@ class FeatherTrackerParser(BaseParser):
         if ret['lon'] == 1000 or ret['lat'] == 1000:
             ret['valid_fix'] = False
         return ret
+
+    def parse_rows(self, messages):
+        """
+        Parse a batch of messages message by message
+        """
+        return [self.parse(msg) for msg in messages]
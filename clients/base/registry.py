@@ -0,0 +1,154 @@
+# pylint:disable=E0401
+"""
+A declarative registry of TTI applications.
+
+Instead of a Python module per application, applications are described in
+a JSON or YAML file (YAML requires PyYAML) such as
+
+    applications:
+      sci-chi-climate:
+        parser: clients.tti_sci_chi.TBS12S_CV50_Parser
+        header: [received_at, dev_id, air_temp]
+        output: ~/lora_data/tti_sci_chi.csv
+        options:
+          max_lines: 60000
+      sci-wells:
+        parser: clients.base.parsers.TBS12SParser
+        sensor_fields: [w_pressure, w_temperature, w_level]
+      laird-rs-191:
+        enabled: false
+        parser: clients.tti_rs191.RS191_Parser
+
+Keys of an application (all optional):
+
+    client: MQTT client class, clients.base.mqtt.BaseMQTTClient
+    host: MQTT host, nam1.cloud.thethings.industries
+    tenant: TTI tenant, tnc
+    username: MQTT username, <application>@<tenant>
+    topic: MQTT topic, v3/<username>/devices/+/up
+    pw_env_var: environment variable holding the API key, MQTT_PW
+    writer: writer class, clients.base.writers.BaseCSVWriter
+    parser: parser class, clients.base.parsers.BaseParser
+    sensor_fields: names of the values of a SDI-12 sensor attached to a
+        TBS12S (see parsers.TBS12SParser)
+    method: writer method receiving messages
+    output: output file of CSV writers, ~ and $VARIABLES are expanded
+    header: CSV header
+    options: further writer class attributes such as max_lines
+    enabled: set to false to skip the application
+
+Classes are only imported for enabled applications.
+"""
+# standard library
+import json
+import os
+# project
+from clients.base.multiplex import Multiplexer, import_string
+
+
+DEFAULT_HOST = 'nam1.cloud.thethings.industries'
+DEFAULT_TENANT = 'tnc'
+DEFAULT_CLIENT = 'clients.base.mqtt.BaseMQTTClient'
+DEFAULT_WRITER = 'clients.base.writers.BaseCSVWriter'
+DEFAULT_PARSER = 'clients.base.parsers.BaseParser'
+
+
+def load_registry(path):
+    """
+    Load a registry from a JSON or YAML file
+
+    Args:
+        path(str)
+    Returns:
+        dict: application name -> settings
+    """
+    with open(path) as filehandle:
+        if os.path.splitext(path)[1].lower() in ('.yml', '.yaml'):
+            # PyYAML is only needed for YAML registries
+            import yaml
+            data = yaml.safe_load(filehandle)
+        else:
+            data = json.load(filehandle)
+    return (data or {}).get('applications') or {}
+
+
+def build_client_class(name, settings):
+    """
+    Create a MQTT client class for an application
+
+    Args:
+        name(str): TTI application id
+        settings(dict): registry entry
+    Returns:
+        class
+    """
+    username = settings.get('username') or '{}@{}'.format(
+        name, settings.get('tenant', DEFAULT_TENANT))
+    attributes = {
+        'host': settings.get('host', DEFAULT_HOST),
+        'username': username,
+        'topic': settings.get('topic') or 'v3/{}/devices/+/up'.format(
+            username),
+        'pw_env_var': settings.get('pw_env_var', 'MQTT_PW')}
+    base = import_string(settings.get('client', DEFAULT_CLIENT))
+    return type(class_name(name, 'Client'), (base,), attributes)
+
+
+def build_writer_class(name, settings):
+    """
+    Create a writer class for an application
+
+    Args:
+        name(str): TTI application id
+        settings(dict): registry entry
+    Returns:
+        class
+    """
+    attributes = dict(settings.get('options') or {})
+    attributes['parser_class'] = import_string(
+        settings.get('parser', DEFAULT_PARSER))
+    if settings.get('sensor_fields'):
+        attributes['parser_class'] = type(
+            class_name(name, 'Parser'), (attributes['parser_class'],),
+            {'sensor_fields': tuple(settings['sensor_fields'])})
+    if settings.get('output'):
+        attributes['template'] = os.path.expandvars(
+            os.path.expanduser(settings['output']))
+    if settings.get('header'):
+        attributes['header'] = tuple(settings['header'])
+    base = import_string(settings.get('writer', DEFAULT_WRITER))
+    return type(class_name(name, 'Writer'), (base,), attributes)
+
+
+def class_name(name, suffix):
+    """
+    A readable class name for an application id, e.g. SciChiClimateClient
+    """
+    return ''.join(
+        part.capitalize() for part in name.replace('_', '-').split('-')
+    ) + suffix
+
+
+def create_multiplexer(applications, only=None):
+    """
+    Create a multiplexer serving the enabled applications of a registry
+
+    Args:
+        applications(dict): application name -> settings
+        only(list): restrict to these applications (even if disabled)
+    Returns:
+        Multiplexer
+    """
+    multiplexer = Multiplexer()
+    for name, settings in applications.items():
+        settings = settings or {}
+        if only:
+            if name not in only:
+                continue
+        elif not settings.get('enabled', True):
+            continue
+        multiplexer.add(
+            client=build_client_class(name, settings),
+            writer=build_writer_class(name, settings),
+            method=settings.get('method'))
+    return multiplexer
@@ -0,0 +1,179 @@
+"""
+Rotation of output files by size or time
+"""
+# standard library
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import gzip
+import os
+import re
+import shutil
+
+
+PERIOD_PATTERNS = {
+    None: '%Y_%m_%d',
+    'daily': '%Y_%m_%d',
+    'hourly': '%Y_%m_%d_%H'}
+# a single background thread compresses rotated files so that ingest is
+# never blocked
+COMPRESSOR = ThreadPoolExecutor(max_workers=1)
+
+
+class RotationManager():
+    """
+    Find names for rotated files and decide when to rotate by time.
+
+    Rotated files are named <name>_<period>_<index><ext>, e.g.
+    data_2021_03_18_0.csv. The next free index is found with a single
+    directory scan and then kept in memory.
+    """
+
+    def __init__(self, every=None, compress=False):
+        """
+        Args:
+            every(str): None (size-based only), 'hourly' or 'daily'
+            compress(boolean): gzip rotated files in the background
+        """
+        if every not in PERIOD_PATTERNS:
+            raise ValueError('Unknown rotation period {}'.format(every))
+        self.every = every
+        self.compress = compress
+        self.pattern = PERIOD_PATTERNS[every]
+        self.current_period = None
+        # (path, period) -> next index
+        self.indices = {}
+
+    def get_period(self, time=None):
+        """
+        Returns the period a timestamp falls into (UTC)
+
+        Args:
+            time(datetime): defaults to now
+        Returns:
+            str
+        """
+        return (time or datetime.utcnow()).strftime(self.pattern)
+
+    def is_due(self, path):
+        """
+        Check whether the file belongs to an earlier period than now. The
+        period of a file found at startup is taken from its modification
+        time.
+
+        Args:
+            path(str): current output file
+        Returns:
+            boolean
+        """
+        if self.every is None:
+            return False
+        now = self.get_period()
+        if self.current_period is None:
+            if os.path.isfile(path):
+                self.current_period = self.get_period(
+                    datetime.utcfromtimestamp(os.path.getmtime(path)))
+            else:
+                self.current_period = now
+        return self.current_period != now
+
+    def scan_index(self, path, period):
+        """
+        Find the next free index for a period with a single directory scan
+
+        Args:
+            path(str): current output file
+            period(str)
+        Returns:
+            int
+        """
+        directory, filename = os.path.split(path)
+        part, ext = os.path.splitext(filename)
+        regex = re.compile(r'^{}_{}_(\d+){}(\.gz)?$'.format(
+            re.escape(part), re.escape(period), re.escape(ext)))
+        indices = [-1]
+        for item in os.listdir(directory or '.'):
+            match = regex.match(item)
+            if match:
+                indices.append(int(match.group(1)))
+        return max(indices) + 1
+
+    def get_naming_period(self):
+        """
+        Time-based rotation names files by the period they cover, size-based
+        rotation by the current date.
+
+        Returns:
+            str
+        """
+        if self.every and self.current_period:
+            return self.current_period
+        return self.get_period()
+
+    def format_path(self, path, period, index):
+        """
+        Returns the name of a rotated file
+        """
+        part, ext = os.path.splitext(path)
+        return '{}_{}_{}{}'.format(part, period, index, ext)
+
+    def get_rotation_path(self, path, period=None):
+        """
+        Returns a free name for the rotated file. The directory is only
+        scanned again if someone else took the name in the meantime.
+
+        Args:
+            path(str): current output file
+            period(str): defaults to the naming period
+        Returns:
+            str
+        """
+        period = period or self.get_naming_period()
+        key = (path, period)
+        index = self.indices.get(key)
+        if index is None or self.is_taken(
+                self.format_path(path, period, index)):
+            index = self.scan_index(path, period)
+        self.indices[key] = index
+        return self.format_path(path, period, index)
+
+    def is_taken(self, path):
+        """
+        Check whether a rotated file (compressed or not) exists
+        """
+        return os.path.isfile(path) or os.path.isfile(path + '.gz')
+
+    def rotate(self, path):
+        """
+        Move path to its rotation path and start a new period
+
+        Args:
+            path(str): current output file
+        Returns:
+            str: the rotated path or None if there was nothing to rotate
+        """
+        new_path = None
+        if os.path.isfile(path):
+            period = self.get_naming_period()
+            new_path = self.get_rotation_path(path, period)
+            shutil.move(path, new_path)
+            self.indices[(path, period)] += 1
+            if self.compress:
+                COMPRESSOR.submit(compress_file, new_path)
+        if self.every:
+            self.current_period = self.get_period()
+        return new_path
+
+
+def compress_file(path):
+    """
+    Gzip a file and remove the original
+
+    Args:
+        path(str)
+    Returns:
+        str: path of the compressed file
+    """
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+    return path + '.gz'
@@ -0,0 +1,180 @@
+# pylint:disable=E0401,W0603
+"""
+A shared, connection-pooled HTTP session so that connections (and TLS
+handshakes) are reused across requests to AGO and the TTI storage API.
+
+Use the module level functions get and post as drop-in replacements for
+requests.get and requests.post.
+"""
+# standard library
+from collections import defaultdict
+import os
+import threading
+from urllib.parse import urlparse
+# third party
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+# project
+from clients.base import metrics
+
+
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 30))
+RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# host -> {'requests': int, 'connections': int}
+STATS = defaultdict(lambda: {'requests': 0, 'connections': 0})
+STATS_LOCK = threading.Lock()
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+def count(host, key):
+    """
+    Increment a per host counter
+
+    Args:
+        host(str)
+        key(str): 'requests' or 'connections'
+    Returns:
+        None
+    """
+    with STATS_LOCK:
+        STATS[host][key] += 1
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    """
+    A connection pool counting requests and newly opened connections
+    """
+
+    def _new_conn(self):
+        count(self.host, 'connections')
+        return super()._new_conn()
+
+    def urlopen(self, method, url, *args, **kwargs):
+        count(self.host, 'requests')
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """
+    A TLS connection pool counting requests and newly opened connections
+    """
+
+    def _new_conn(self):
+        count(self.host, 'connections')
+        return super()._new_conn()
+
+    def urlopen(self, method, url, *args, **kwargs):
+        count(self.host, 'requests')
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    An adapter with a default timeout and counting connection pools,
+    request durations are recorded in metrics.HTTP_SECONDS
+    """
+
+    def __init__(self, timeout=TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        with metrics.HTTP_SECONDS.time(
+                request.method, urlparse(request.url).hostname):
+            return super().send(request, **kwargs)
+
+
+def create_session(
+        pool_size=POOL_SIZE, timeout=TIMEOUT, retries=RETRIES,
+        backoff_factor=BACKOFF_FACTOR):
+    """
+    Create a session with keep-alive connection pools. Failed connections
+    are always retried, failed responses only for idempotent methods so that
+    features are not added twice.
+
+    Args:
+        pool_size(int): Connections kept open per host
+        timeout(float): Default timeout in seconds
+        retries(int): Number of retries
+        backoff_factor(float): Exponential backoff between retries
+    Returns:
+        requests.Session
+    """
+    retry = Retry(
+        total=retries, backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS, raise_on_status=False)
+    adapter = PooledAdapter(
+        timeout=timeout, pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Return the session shared by the process
+
+    Returns:
+        requests.Session
+    """
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = create_session()
+        return SESSION
+
+
+def configure(**kwargs):
+    """
+    Replace the shared session, takes the arguments of create_session
+    """
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is not None:
+            SESSION.close()
+        SESSION = create_session(**kwargs)
+
+
+def get(url, **kwargs):
+    """
+    Like requests.get but using the shared session
+    """
+    return get_session().get(url, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    """
+    Like requests.post but using the shared session
+    """
+    return get_session().post(url, data=data, **kwargs)
+
+
+def connection_stats():
+    """
+    Report requests, opened connections and reused connections per host
+
+    Returns:
+        dict
+    """
+    with STATS_LOCK:
+        return {
+            host: dict(
+                item, reused=max(item['requests'] - item['connections'], 0))
+            for host, item in STATS.items()}
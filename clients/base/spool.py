@@ -0,0 +1,106 @@
+"""
+Keep records that could not be delivered on disk until they can be
+replayed, e.g. while ArcGIS online is unreachable.
+
+Every batch is stored as a JSON file in the spool directory. Files are
+named by creation time so that batches are replayed in order, and they
+are written atomically so that a crash never leaves a partial batch.
+"""
+# standard library
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class Spool():
+    """
+    A directory of undelivered batches of records
+    """
+    suffix = '.json'
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory(str): created if it does not exist
+        """
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.get_files())
+
+    def get_files(self):
+        """
+        Spooled batches, oldest first
+
+        Returns:
+            list of str: paths
+        """
+        return [
+            os.path.join(self.directory, name)
+            for name in sorted(os.listdir(self.directory))
+            if name.endswith(self.suffix)]
+
+    def put(self, records):
+        """
+        Store a batch of records
+
+        Args:
+            records(list): JSON serializable records
+        Returns:
+            str: path of the batch or None if records is empty
+        """
+        if not records:
+            return None
+        with self.lock:
+            name = '{:020d}-{:06d}{}'.format(
+                time.time_ns(), next(self.counter) % 1000000, self.suffix)
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w') as filehandle:
+                json.dump(records, filehandle)
+                filehandle.flush()
+                os.fsync(filehandle.fileno())
+            path = os.path.join(self.directory, name)
+            os.replace(tmp, path)
+        return path
+
+    def read(self, path):
+        """
+        Load a batch, unreadable batches are returned empty
+
+        Args:
+            path(str)
+        Returns:
+            list
+        """
+        try:
+            with open(path) as filehandle:
+                return json.load(filehandle)
+        except (OSError, ValueError):
+            return []
+
+    def replay(self, send, limit=None):
+        """
+        Pass spooled batches to send, oldest first. A batch is removed once
+        send returns True, replaying stops at the first batch that fails so
+        that the order of records is kept.
+
+        Args:
+            send(func): called with a list of records, returns a boolean
+            limit(int): maximum number of batches, all if None
+        Returns:
+            int: number of delivered batches
+        """
+        delivered = 0
+        for path in self.get_files()[0:limit]:
+            records = self.read(path)
+            if records and not send(records):
+                break
+            os.remove(path)
+            delivered += 1
+        return delivered
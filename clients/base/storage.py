@@ -3,71 +3,396 @@
 Read data from storage API with utmost compatibility to the mqtt client
 """
 # standard library
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 import os
-from types import SimpleNamespace
+import tempfile
+import time as timer
+import traceback
 # third party
 import requests
+# project
+from clients.base import sessions
+
+
+def get_record_id(dic):
+    """
+    A unique id of an uplink derived from the correlation ids TTI provides
+
+    Args:
+        dic(dict): A record
+    Returns:
+        str
+    """
+    ids = dic.get('correlation_ids') or []
+    for item in ids:
+        if item.startswith('as:up:'):
+            return item
+    return ' '.join(ids) or None
+
+
+def get_received_at(dic):
+    """
+    Args:
+        dic(dict): A record
+    Returns:
+        str: Time the uplink was received, '' if unknown
+    """
+    return dic.get('received_at') or dic.get(
+        'uplink_message', {}).get('received_at') or ''
+
+
+class DecodedMessage():
+    """
+    A message carrying an already decoded record. Parsers use .dic directly,
+    .payload is only encoded on demand for compatibility.
+    """
+    __slots__ = ('dic',)
+
+    def __init__(self, dic):
+        self.dic = dic
+
+    @property
+    def payload(self):
+        """
+        The record as JSON encoded bytes like the payload of MQTT messages
+        """
+        return json.dumps(self.dic).encode('utf-8')
 
 
 class StorageReader():
     """
     Read historic data from ThingsIndustries storage integration
+
+    Pages are fetched by time window. With workers > 1 several windows are
+    fetched in parallel while pages are still processed in order. Set
+    target_records to adapt the window size to the data density so that a
+    window holds about target_records records.
+
+    With streaming = True responses are read line by line and records are
+    decoded only once; windows are then fetched one after another and
+    yielded in pages of at most page_size records so that memory use does
+    not depend on the size of a window.
+
+    Set checkpoint_path to resume where the last run stopped. After each
+    processed page (and sync_callback) the time of the last record and the
+    ids of the records received in the same second are stored. The next run starts at that
+    second and skips the records it has already processed.
     """
     url = None
     pw_env_var = 'MQTT_PW'
     start = datetime(2021, 3, 18)
+    workers = 1
+    window = timedelta(days=1)
+    target_records = None
+    min_window = timedelta(hours=1)
+    max_window = timedelta(days=7)
+    # retries of a failed window and backoff factor in seconds
+    max_retries = 3
+    backoff_factor = 2
+    streaming = False
+    page_size = 1000
+    checkpoint_path = None
 
-    def __init__(self, password=None, callback=None):
+    def __init__(
+            self, password=None, callback=None, batch_callback=None,
+            sync_callback=None
+    ):
+        """
+        Args:
+            password(str): API key, optional can be taken from ENV
+            callback(func): Called with every record
+            batch_callback(func): Called with a list of records per page,
+                used instead of callback if provided
+            sync_callback(func): Called before a checkpoint is saved to
+                store processed records durably (e.g. the flush method of
+                a writer), raises if they have not been stored
+        """
         self.password = password or os.environ.get(self.pw_env_var)
         self.callback = callback
+        self.batch_callback = batch_callback
+        self.sync_callback = sync_callback
+        self.checkpoint = self.load_checkpoint()
+        if self.checkpoint:
+            self.start = datetime.fromisoformat(
+                self.checkpoint['received_at'][0:19])
 
-    def reformat(self, line):
+    def load_checkpoint(self):
         """
-        This becomes necessary for compatibility
+        Load the state of the last run
+
+        Returns:
+            dict or None
         """
+        if not self.checkpoint_path:
+            return None
         try:
-            dic = json.loads(line)
-        except json.decoder.JSONDecodeError:
+            with open(self.checkpoint_path) as filehandle:
+                checkpoint = json.load(filehandle)
+            checkpoint['correlation_ids'] = set(checkpoint['correlation_ids'])
+            datetime.fromisoformat(checkpoint['received_at'][0:19])
+            return checkpoint
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save_checkpoint(self, page):
+        """
+        Store the time of the last record in a page and the ids of all
+        records received within the same second
+
+        Args:
+            page(list): Processed records
+        Returns:
+            None
+        """
+        if not self.checkpoint_path or not page:
+            return
+        received = [
+            (get_received_at(item.dic), get_record_id(item.dic))
+            for item in page]
+        last = max(item[0] for item in received)
+        if not last:
+            return
+        ids = {
+            item[1] for item in received
+            if item[0][0:19] == last[0:19] and item[1]}
+        if self.checkpoint and (
+                self.checkpoint['received_at'][0:19] == last[0:19]):
+            ids |= self.checkpoint['correlation_ids']
+        self.checkpoint = {'received_at': last, 'correlation_ids': ids}
+        directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as filehandle:
+            json.dump({
+                'received_at': last, 'correlation_ids': sorted(ids)},
+                filehandle)
+        os.replace(tmp, self.checkpoint_path)
+
+    def skip_processed(self, page):
+        """
+        Remove records that have been processed before the checkpoint
+
+        Args:
+            page(list)
+        Returns:
+            list
+        """
+        if not self.checkpoint:
+            return page
+        second = self.checkpoint['received_at'][0:19]
+        ids = self.checkpoint['correlation_ids']
+        return [
+            item for item in page
+            if get_received_at(item.dic)[0:19] > second or (
+                get_received_at(item.dic)[0:19] == second and
+                get_record_id(item.dic) not in ids)]
+
+    def decode(self, line):
+        """
+        Decode a line of the streamed response
+
+        Args:
+            line(bytes)
+        Returns:
+            dict or None
+        """
+        try:
+            return json.loads(line).get('result') or None
+        except (ValueError, AttributeError):
             return None
-        part = dic.get('result')
-        if part:
-            return json.dumps(part)
-        return None
 
     def record_generator(self):
         """
-        Generate records to be processed. For simplicity we are doing this
-        synchronlously and paginate by day
+        Generate records to be processed one by one
         """
-        headers = {'Authorization': 'Bearer {}'.format(self.password)}
+        for page in self.page_generator():
+            yield from page
+
+    def page_generator(self):
+        """
+        Generate pages of records to be processed in chronological order.
+        Up to self.workers windows are fetched ahead in a thread pool.
+        """
+        if self.streaming:
+            yield from self.stream_generator()
+            return
+        now = datetime.utcnow()
         time = self.start
-        while time < datetime.utcnow():
-            print('Loading new page')
-            after = time.strftime('%Y-%m-%dT%H:%M:%SZ')
-            time = time + timedelta(days=1)
-            before = time.strftime('%Y-%m-%dT%H:%M:%SZ')
-            res = requests.get(
-                self.url, headers=headers, params={'after': after, 'before': before})
-            if res.status_code == 200:
-                for line in res.text.split('\n'):
-                    line = self.reformat(line)
-                    if line:
-                        yield SimpleNamespace(payload=line.encode('utf-8'))
-            else:
-                print(res.status_code, res.text)
+        window = self.window
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or time < now:
+                while len(pending) < self.workers and time < now:
+                    before = time + window
+                    pending.append((time, before, executor.submit(
+                        self.fetch_page, time, before)))
+                    time = before
+                after, before, future = pending.popleft()
+                page = future.result()
+                if page is None:
+                    for item in pending:
+                        item[2].cancel()
+                    break
+                window = self.adapt_window(window, len(page), before - after)
+                yield page
+
+    def stream_generator(self):
+        """
+        Generate pages of records window by window from streamed responses
+        """
+        now = datetime.utcnow()
+        time = self.start
+        window = self.window
+        while time < now:
+            before = time + window
+            records = yield from self.stream_window(time, before)
+            if records is None:
                 break
+            window = self.adapt_window(window, records, before - time)
+            time = before
 
+    def stream_window(self, after, before):
+        """
+        Generate pages of decoded records for a time window while reading
+        the response. If the connection fails the window is requested again
+        and records that have already been yielded are skipped.
+
+        Args:
+            after(datetime)
+            before(datetime)
+        Returns:
+            int: number of records or None if the window failed
+        """
+        headers = {'Authorization': 'Bearer {}'.format(self.password)}
+        params = {
+            'after': after.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'before': before.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        done = 0
+        for attempt in range(0, self.max_retries + 1):
+            if attempt:
+                timer.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            print('Streaming new page', params['after'])
+            try:
+                # closing the response releases the connection to the pool,
+                # also on errors or when the generator is closed early
+                with sessions.get(
+                        self.url, headers=headers, params=params,
+                        stream=True) as res:
+                    if res.status_code != 200:
+                        print(res.status_code, res.text)
+                        continue
+                    count = 0
+                    page = []
+                    for line in res.iter_lines():
+                        record = self.decode(line)
+                        if record is None:
+                            continue
+                        count += 1
+                        if count <= done:
+                            continue
+                        page.append(DecodedMessage(record))
+                        if len(page) >= self.page_size:
+                            yield page
+                            done += len(page)
+                            page = []
+                    if page:
+                        yield page
+                        done += len(page)
+                    return done
+            except requests.RequestException as err:
+                print(err)
+        return None
+
+    def adapt_window(self, window, records, duration):
+        """
+        Size the next window so that it holds about self.target_records
+
+        Args:
+            window(timedelta): current window size
+            records(int): records in the last window
+            duration(timedelta): size of the last window
+        Returns:
+            timedelta
+        """
+        if not self.target_records:
+            return window
+        if records:
+            window = duration * (self.target_records / records)
+        else:
+            window = window * 2
+        return max(self.min_window, min(self.max_window, window))
+
+    def fetch_page(self, after, before):
+        """
+        Fetch all records in a time window, retry with exponential backoff
+        if the request fails.
+
+        Args:
+            after(datetime)
+            before(datetime)
+        Returns:
+            list or None if the window could not be fetched
+        """
+        headers = {'Authorization': 'Bearer {}'.format(self.password)}
+        params = {
+            'after': after.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'before': before.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        for attempt in range(0, self.max_retries + 1):
+            if attempt:
+                timer.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            print('Loading new page', params['after'])
+            try:
+                res = sessions.get(self.url, headers=headers, params=params)
+            except requests.RequestException as err:
+                print(err)
+                continue
+            if res.status_code == 200:
+                return self.parse_page(res)
+            print(res.status_code, res.text)
+        return None
+
+    def parse_page(self, res):
+        """
+        Convert a response into a page of message objects
+
+        Args:
+            res(requests.Response)
+        Returns:
+            list
+        """
+        page = []
+        for line in res.text.split('\n'):
+            record = self.decode(line)
+            if record:
+                page.append(DecodedMessage(record))
+        return page
 
     def run(self):
         """
         Process data from storage API. Naming is for compatibility with
         MQTT client
         """
-        for item in self.record_generator():
+        for page in self.page_generator():
+            page = self.skip_processed(page)
+            item = None
             try:
-                self.callback(item)
+                if self.batch_callback:
+                    self.batch_callback(page)
+                else:
+                    for item in page:
+                        self.callback(item)
             except:
-                print(item)
+                traceback.print_exc()
+                print(item.payload if item else 'Failed to process page')
                 break
+            if self.sync_callback is not None:
+                try:
+                    self.sync_callback()
+                except Exception:
+                    traceback.print_exc()
+                    print('Failed to store page, no checkpoint saved')
+                    break
+            self.save_checkpoint(page)
@@ -3,28 +3,260 @@
 Base classes to write data.
 """
 # standard library
-from datetime import datetime
+import atexit
+import json
 import os
-import shutil
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+# third party
+import requests
 # project
-from clients.base import parsers, ago
+from clients.base import parsers, ago, metrics, rotation, spool
+
+
+def exit_on_sigterm():
+    """
+    Turn SIGTERM (sent by supervisor) into a regular interpreter exit so
+    that handlers registered with atexit run and buffers are flushed.
+    Signal handlers can only be installed from the main thread.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) in (signal.SIG_DFL, None):
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def parse(parser, msg):
+    """
+    Parse a message recording the duration and failures per parser class
+
+    Args:
+        parser(parsers.BaseParser)
+        msg: Message object
+    Returns:
+        dict
+    """
+    name = type(parser).__name__
+    start = time.perf_counter()
+    try:
+        return parser.parse(msg)
+    except Exception:
+        metrics.PARSE_FAILURES.inc(name)
+        raise
+    finally:
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - start, name)
 
 
 class BaseAGOWriter():
     """
     Write data to ESRI ArcGIS online.
+
+    By default every message is posted on its own. Set batch_size to a value
+    larger than 1 to buffer records and post them with a single addFeatures
+    request once batch_size records are queued or the oldest queued record
+    is older than max_batch_age seconds.
+
+    Messages without a position (no lon/lat after parsing) are skipped.
+
+    Set spool_path to a directory to keep records on disk that could not
+    be posted because AGO was unreachable. Spooled records are posted
+    again after the next successful request, at most replay_batches
+    batches at a time. Without a spool such records are dropped after
+    max_attempts unless drop_undelivered is False, then they stay in the
+    buffer until AGO is reachable again (see .sync).
     """
     parser_class = parsers.BaseParser
     url = 'https://services.arcgis.com/F7DSX1DSNSiWmOqh/arcgis/rest/services/'
     feature_service = url + 'lora_tracking_1/FeatureServer/'
+    batch_size = 1
+    max_batch_age = 60
+    # how often a record is posted before it is dropped or spooled
+    max_attempts = 3
+    spool_path = None
+    replay_batches = 10
+    drop_undelivered = True
+
+    def __init__(self):
+        self.parser = self.parser_class()
+        self.service = ago.FeatureService(self.feature_service)
+        # queued records as [record, attempts] pairs
+        self.buffer = []
+        self.buffer_started = None
+        # per-record results of the last addFeatures request
+        self.results = []
+        self.lock = threading.RLock()
+        self.timer = None
+        self.spool = spool.Spool(self.spool_path) if self.spool_path else None
+        # records dropped without being posted or spooled since the last
+        # .sync
+        self.lost = 0
+        if self.batch_size > 1:
+            atexit.register(self.flush)
+            exit_on_sigterm()
 
     def add_to_ago(self, msg):
         """
         Add a feature to AGO derrived from msg.
         """
-        feature_service = ago.FeatureService(self.feature_service)
         record = self.serialize(msg)
-        feature_service.post_records([record])
+        if record is None:
+            return
+        with self.lock:
+            if not self.buffer:
+                self.buffer_started = time.monotonic()
+            self.buffer.append([record, 0])
+            if self.batch_due():
+                self.flush()
+            else:
+                self.start_timer()
+
+    def batch_due(self):
+        """
+        Check whether the buffer has reached its size or age limit
+
+        Returns:
+            boolean
+        """
+        if len(self.buffer) >= self.batch_size:
+            return True
+        return (
+            self.buffer_started is not None and
+            time.monotonic() - self.buffer_started >= self.max_batch_age)
+
+    def start_timer(self):
+        """
+        Make sure a buffer is flushed after max_batch_age even if no further
+        message arrives.
+        """
+        if self.timer is None:
+            self.timer = threading.Timer(
+                self.max_batch_age, self.flush_in_background)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_in_background(self):
+        """
+        Flush from the timer thread, errors are printed since nobody else
+        would see them
+        """
+        try:
+            self.flush()
+        except Exception:
+            traceback.print_exc()
+
+    def flush(self):
+        """
+        Post all buffered records in a single request. Records AGO reports
+        as failed are put back into the buffer until max_attempts is reached,
+        an unreachable AGO fails all records. Records that still could not
+        be posted because the request failed as a whole are spooled if a
+        spool is configured, kept in the buffer if drop_undelivered is
+        False and dropped otherwise.
+
+        Returns:
+            list: per-record results as reported by AGO
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.buffer:
+                return []
+            queued, self.buffer = self.buffer, []
+            self.buffer_started = None
+            try:
+                res = self.service.post_records([item[0] for item in queued])
+            except requests.RequestException as err:
+                print('Posting to AGO failed', err)
+                res = None
+            except Exception:
+                # keep the records for the next flush
+                self.buffer = queued + self.buffer
+                self.buffer_started = time.monotonic()
+                raise
+            results = (res or {}).get('addResults')
+            request_failed = results is None or len(results) != len(queued)
+            if request_failed:
+                results = [{'success': False}] * len(queued)
+            self.results = results
+            failed = []
+            exhausted = []
+            for item, result in zip(queued, results):
+                item[1] += 1
+                if result.get('success'):
+                    continue
+                if item[1] < self.max_attempts:
+                    failed.append(item)
+                elif request_failed:
+                    exhausted.append(item)
+            if exhausted and self.spool is not None:
+                self.spool.put([item[0] for item in exhausted])
+            elif exhausted and not self.drop_undelivered:
+                failed = exhausted + failed
+            elif exhausted:
+                self.lost += len(exhausted)
+            if failed:
+                self.buffer = failed
+                self.buffer_started = time.monotonic()
+                self.start_timer()
+            if not request_failed:
+                self.replay()
+            return results
+
+    def sync(self):
+        """
+        Flush and make sure all records reached AGO or the spool, used as
+        sync_callback of a persistent MQTT session. From the first call on
+        records AGO could not be reached for are kept in the buffer
+        (drop_undelivered is turned off), so sync fails and their messages
+        stay unacknowledged until AGO is reachable again. The session's
+        max_inflight limits how many records pile up meanwhile.
+
+        Raises:
+            IOError: records are still buffered or have been dropped since
+                the last call
+        """
+        with self.lock:
+            self.drop_undelivered = False
+            self.flush()
+            lost, self.lost = self.lost, 0
+            if self.buffer or lost:
+                raise IOError(
+                    '{} records buffered, {} records dropped'.format(
+                        len(self.buffer), lost))
+
+    def replay(self):
+        """
+        Post spooled records, AGO is expected to be reachable
+
+        Returns:
+            int: number of delivered batches
+        """
+        if self.spool is None:
+            return 0
+        return self.spool.replay(self.post_spooled, limit=self.replay_batches)
+
+    def post_spooled(self, records):
+        """
+        Post a spooled batch. Records AGO rejects individually are dropped
+        since posting them again would fail as well.
+
+        Args:
+            records(list)
+        Returns:
+            boolean: False if the request failed as a whole
+        """
+        try:
+            res = self.service.post_records(records)
+        except requests.RequestException as err:
+            print('Replaying to AGO failed', err)
+            return False
+        results = (res or {}).get('addResults')
+        return results is not None and len(results) == len(records)
 
     def serialize(self, msg):
         """
@@ -36,9 +268,14 @@ class BaseAGOWriter():
         Args:
             msg(dict): MQTT message
         Returns:
-            str: HTTP body confirming with AGO API
+            str: HTTP body confirming with AGO API, None if the message
+                has no position
         """
-        parsed = self.parser_class().parse(msg)
+        parsed = parse(self.parser, msg)
+        lon = parsed.pop('lon', None)
+        lat = parsed.pop('lat', None)
+        if lon is None or lat is None:
+            return None
         # some remapping to be compatible wih older layer
         parsed['received_t'] = parsed.pop('received_at')[0:19].replace('T', ' ')
         # this remapping is pretty pointless, maybe we could adjust the feature
@@ -48,8 +285,8 @@ class BaseAGOWriter():
         parsed['gateway'] = parsed.pop('gw_id')
         ret =  {
             'geometry': {
-                'x': parsed.pop('lon'),
-                'y': parsed.pop('lat'),
+                'x': lon,
+                'y': lat,
                 'spatialReference': {'wkid': 4326}},
             'attributes': parsed}
         # print(ret)
@@ -59,6 +296,13 @@ class BaseAGOWriter():
 class BaseCSVWriter():
     """
     Writes data to CSV
+
+    By default the file is opened and closed for every message. Set
+    persistent to True to keep the file open and write buffered lines once
+    flush_bytes are pending or flush_interval seconds have passed.
+    fsync_policy controls durability in persistent mode: 'never' leaves
+    it to the OS, 'flush' syncs on every flush, 'always' flushes and syncs
+    every line.
     """
     header = []
     template = ''
@@ -67,10 +311,43 @@ class BaseCSVWriter():
     # set this to True for debugging
     print_message = False
     append = True
+    persistent = False
+    flush_interval = 5
+    flush_bytes = 64 * 1024
+    fsync_policy = 'flush'
+    # rotate by time as well: None, 'hourly' or 'daily'
+    rotate_every = None
+    # gzip rotated files in a background thread
+    compress_rotated = False
 
     def __init__(self):
         print('Write to', self.get_path())
+        self.parser = self.parser_class()
         self.write_mode = 'a' if self.append else 'w'
+        self.filehandle = None
+        self.pending = []
+        self.pending_bytes = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.RLock()
+        self.timer = None
+        # lines in the current file including pending lines, None until
+        # the first rotation check
+        self.line_count = None
+        self.rotation = rotation.RotationManager(
+            every=self.rotate_every, compress=self.compress_rotated)
+        if self.buffered():
+            exit_on_sigterm()
+        if self.buffered() or self.max_lines > 0:
+            atexit.register(self.close)
+
+    def buffered(self):
+        """
+        Whether data is buffered in memory and has to be flushed at exit
+
+        Returns:
+            boolean
+        """
+        return self.persistent
 
     def filter(self, dic):
         """
@@ -98,24 +375,227 @@ class BaseCSVWriter():
         """
         if self.print_message:
             print(msg.payload)
-        dic = self.parser_class().parse(msg)
+        dic = parse(self.parser, msg)
         # print(dic)
         if not self.filter(dic):
             return
-        dic = self.additional_transformations(dic)
-        csv_line = self.create_csv_line(dic)
-        # we need this to enable multiple csv for the same
-        # reason file generation is in the storage process
-        path = self.get_path()
-        if self.max_lines > 0:
-            self.check_lines()
+        self.store([self.additional_transformations(dic)])
+
+    def add_many_to_csv(self, messages):
+        """
+        Adds a batch of messages (e.g. a page from the storage API) to the
+        CSV file with a single write per file (see .write_lines). Rows are
+        the same as if every message was added with .add_to_csv.
+
+        Args:
+            messages(list): Messages the parser can digest
+        Returns:
+            None
+        """
+        self.store([
+            self.additional_transformations(dic)
+            for dic in self.parser.parse_rows(messages) if self.filter(dic)])
+
+    def add_block(self, block):
+        """
+        Adds a block of parsed data in columnar format (see
+        parsers.BaseParser.parse_many) to the CSV file. Columns are padded
+        with None for rows without the field, None values are left out so
+        that these are written as empty cells.
+
+        Args:
+            block(dict): A list of values for each field
+        Returns:
+            None
+        """
+        rows = [
+            {key: value for key, value in dic.items() if value is not None}
+            for dic in parsers.from_columns(block)]
+        self.store([
+            self.additional_transformations(dic)
+            for dic in rows if self.filter(dic)])
+
+    def store(self, rows):
+        """
+        Write rows recording their number and the write duration
+
+        Args:
+            rows(list of dict)
+        Returns:
+            None
+        """
+        name = type(self).__name__
+        with metrics.WRITE_SECONDS.time(name):
+            self.write_rows(rows)
+        metrics.ROWS_WRITTEN.inc(name, amount=len(rows))
+
+    def write_rows(self, rows):
+        """
+        Write filtered and transformed rows
+
+        Args:
+            rows(list of dict)
+        Returns:
+            None
+        """
+        self.write_lines([self.create_csv_line(dic) for dic in rows])
+
+    def write_lines(self, lines):
+        """
+        Write CSV lines, rotating files when necessary
+
+        Args:
+            lines(list of str): CSV lines
+        Returns:
+            None
+        """
+        while lines:
+            # we need this to enable multiple csv for the same
+            # reason file generation is in the storage process
+            path = self.get_path()
+            chunk = lines
+            if self.max_lines > 0 or self.rotate_every:
+                self.check_lines()
+            if self.max_lines > 0:
+                chunk = lines[:self.max_lines + 1 - self.line_count]
+            lines = lines[len(chunk):]
+            if self.persistent:
+                for csv_line in chunk:
+                    self.write_buffered(path, csv_line)
+                continue
+            if not os.path.isfile(path) or self.write_mode == 'w':
+                self.create_csv(path, self.header)
+                self.write_mode = 'a'
+            if len(chunk) == 1:
+                print('Add line to', path)
+            else:
+                print('Add {} lines to'.format(len(chunk)), path)
+            with open(path, self.write_mode) as filehandle:
+                filehandle.write(''.join(chunk))
+            self.increment_line_count(len(chunk))
+
+    def write_buffered(self, path, csv_line):
+        """
+        Queue a line for the persistent file handle and flush if due
+
+        Args:
+            path(str): destination path
+            csv_line(str): the line
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.filehandle is None or self.filehandle.name != path:
+                self.open_file(path)
+            self.pending_bytes += len(csv_line)
+            self.increment_line_count()
+            self.add_to_buffer(
+                self.pending, [csv_line], full=(
+                    self.fsync_policy == 'always' or
+                    self.pending_bytes >= self.flush_bytes))
+
+    def add_to_buffer(self, buffer, items, size=None, full=False):
+        """
+        Add items to a buffer and flush once it holds size items, full is
+        set or its oldest item is flush_interval seconds old. Otherwise a
+        timer makes sure the buffer is flushed if nothing else is written.
+        .flush has to call .stop_timer.
+
+        Args:
+            buffer(list): e.g. self.pending
+            items(list)
+            size(int): number of items to flush at
+            full(boolean): flush now
+        Returns:
+            None
+        """
+        with self.lock:
+            if not buffer:
+                # age of the oldest buffered item
+                self.last_flush = time.monotonic()
+            buffer.extend(items)
+            if (
+                    full or (size is not None and len(buffer) >= size) or
+                    time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def stop_timer(self):
+        """
+        Cancel a pending timed flush, called by .flush
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.last_flush = time.monotonic()
+
+    def open_file(self, path):
+        """
+        Open the persistent file handle, create the file if necessary
+
+        Args:
+            path(str): destination path
+        Returns:
+            None
+        """
+        self.close()
         if not os.path.isfile(path) or self.write_mode == 'w':
             self.create_csv(path, self.header)
             self.write_mode = 'a'
-        print('Add line to', path)
-        with open(path, self.write_mode) as filehandle:
-            filehandle.write(csv_line)
-        return
+        self.filehandle = open(path, 'a')
+
+    def reopen_if_moved(self):
+        """
+        Reopen the persistent file handle if the file has been moved or
+        deleted by someone else (e.g. logrotate).
+        """
+        path = self.filehandle.name
+        try:
+            moved = (
+                os.stat(path).st_ino != os.fstat(self.filehandle.fileno()).st_ino)
+        except FileNotFoundError:
+            moved = True
+        if moved:
+            self.filehandle.close()
+            self.filehandle = None
+            self.open_file(path)
+            self.line_count = len(self.pending)
+
+    def flush(self):
+        """
+        Write pending lines through the persistent file handle
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.stop_timer()
+            if not self.pending or self.filehandle is None:
+                return
+            self.reopen_if_moved()
+            self.filehandle.write(''.join(self.pending))
+            self.filehandle.flush()
+            if self.fsync_policy != 'never':
+                os.fsync(self.filehandle.fileno())
+            self.pending = []
+            self.pending_bytes = 0
+
+    def close(self):
+        """
+        Flush pending lines, close the persistent file handle and save the
+        line count index, called at exit
+        """
+        with self.lock:
+            if self.filehandle is not None:
+                self.flush()
+                self.filehandle.close()
+                self.filehandle = None
+            if self.max_lines > 0:
+                self.save_line_index()
 
     def create_csv_line(self, dic):
         """
@@ -148,6 +628,7 @@ class BaseCSVWriter():
         os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, 'w') as filehandle:
             filehandle.write(','.join(header) + '\n')
+        self.line_count = 0
 
     def get_rotation_path(self):
         """
@@ -158,17 +639,54 @@ class BaseCSVWriter():
         Returns:
             str
         """
-        # somewhat ugly: TODO: clean-up
+        return self.rotation.get_rotation_path(self.get_path())
+
+    def increment_line_count(self, number=1):
+        """
+        Keep track of written lines if the count is known
+        """
+        if self.line_count is not None:
+            self.line_count += number
+
+    def get_line_index_path(self):
+        """
+        Returns the path of the hidden sidecar file storing the line count
+        """
+        head, tail = os.path.split(self.get_path())
+        return os.path.join(head, '.{}.lines'.format(tail))
+
+    def save_line_index(self):
+        """
+        Store line count and file size so that the next process does not
+        need to count lines
+        """
+        path = self.get_path()
+        if self.line_count is None or not os.path.isfile(path):
+            return
+        with open(self.get_line_index_path(), 'w') as filehandle:
+            json.dump({
+                'size': os.path.getsize(path), 'lines': self.line_count},
+                filehandle)
+
+    def load_line_count(self):
+        """
+        Get the line count from the sidecar file if it matches the current
+        file size and count lines otherwise.
+
+        Returns:
+            int
+        """
         path = self.get_path()
-        part, ext = os.path.splitext(path)
-        date = datetime.strftime(datetime.utcnow(), '%Y_%m_%d')
-        new_name = '{}_{}_0{}'.format(part, date, ext)
-        counter = 0
-        while os.path.isfile(new_name):
-            counter += 1
-            part, ext = os.path.splitext(new_name)
-            new_name = '{}_{}{}'.format(part[:-2], counter, ext)
-        return new_name
+        if not os.path.isfile(path):
+            return 0
+        try:
+            with open(self.get_line_index_path()) as filehandle:
+                index = json.load(filehandle)
+            if index['size'] == os.path.getsize(path):
+                return index['lines']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return self.count_lines()
 
     def count_lines(self):
         """
@@ -180,11 +698,690 @@ class BaseCSVWriter():
 
     def check_lines(self):
         """
-        Check and move file if self.max_lines is reached
+        Check and move file if self.max_lines is reached or a new rotation
+        period has started
 
         Returns:
             None
         """
+        if self.line_count is None:
+            self.line_count = self.load_line_count() + len(self.pending)
         path = self.get_path()
-        if os.path.isfile(path) and self.max_lines < self.count_lines():
-            shutil.move(self.get_path(), self.get_rotation_path())
+        if (
+                0 < self.max_lines < self.line_count or
+                self.rotation.is_due(path)):
+            self.close()
+            self.rotation.rotate(path)
+            index_path = self.get_line_index_path()
+            if os.path.isfile(index_path):
+                os.remove(index_path)
+            self.line_count = 0
+
+
+def parse_timestamp(value):
+    """
+    Convert an ISO-8601 timestamp into a naive datetime, None if it can
+    not be parsed
+
+    Args:
+        value(str)
+    Returns:
+        datetime or None
+    """
+    try:
+        return parsers.parse_utc(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_number(value, number_type):
+    """
+    Convert a value into int or float, None if it can not be converted
+
+    Args:
+        value
+        number_type(type): int or float
+    Returns:
+        number or None
+    """
+    try:
+        return number_type(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class BaseColumnarWriter(BaseCSVWriter):
+    """
+    Writes typed and compressed Parquet or Arrow IPC files instead of CSV,
+    requires pyarrow.
+
+    Rows are selected by header (all fields if empty), filter and
+    additional_transformations like CSV lines and buffered in memory. Once
+    row_group_size rows are buffered or flush_interval seconds have passed
+    every partition gets a new file
+
+        <template>/app_id=<app>/dev_id=<device>/date=<YYYY-mm-dd>/<time>.parquet
+
+    template being a directory. The files of a partition are merged into
+    one once there are compact_files of them and when the day is over, so
+    that frequent flushes of sparse uplinks do not leave a file per row.
+    Column types are inferred from the values (float, int, bool or
+    string), timestamp_fields are stored as timestamps and types
+    overrides the type of a field with 'float', 'int', 'bool', 'string'
+    or 'timestamp'. Columns without values are stored as null columns.
+    Once inferred, the type of a column is kept for later files and only
+    widened (int to float, anything else to string). Use .read to load the
+    data, it unifies the types of all files.
+    """
+    # 'parquet' or 'arrow'
+    file_format = 'parquet'
+    compression = 'zstd'
+    row_group_size = 10000
+    flush_interval = 60
+    partition_fields = ('app_id', 'dev_id')
+    # UTC time deciding the day partition of a row
+    partition_time_field = 'received_utc'
+    timestamp_fields = (
+        'received_at', 'received_utc', 'received_local', 'device_time')
+    types = {}
+    compact_files = 20
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        # field -> type of the files written so far
+        self.column_types = {}
+        # partition -> files written since it was compacted
+        self.file_counts = {}
+        # partition without date -> day written last
+        self.days = {}
+
+    def buffered(self):
+        """
+        Rows are always buffered
+        """
+        return True
+
+    def write_rows(self, rows):
+        """
+        Buffer rows and write them once row_group_size rows are buffered
+        or flush_interval has passed
+
+        Args:
+            rows(list of dict)
+        Returns:
+            None
+        """
+        if not rows:
+            return
+        print('Add {} rows to'.format(len(rows)), self.get_path())
+        self.add_to_buffer(self.rows, rows, size=self.row_group_size)
+
+    def flush(self):
+        """
+        Write buffered rows, one file per partition
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.stop_timer()
+            rows, self.rows = self.rows, []
+            partitions = {}
+            for row in rows:
+                partitions.setdefault(self.get_partition(row), []).append(row)
+            for partition, items in partitions.items():
+                self.write_partition(partition, items)
+                self.file_counts[partition] = (
+                    self.file_counts.get(partition, 0) + 1)
+                if self.file_counts[partition] >= self.compact_files:
+                    self.compact(partition)
+                key, day = partition[:-1], partition[-1][1]
+                if self.days.get(key) != day:
+                    self.days[key] = day
+                    self.compact_days(key, day)
+
+    def close(self):
+        """
+        Write buffered rows, called at exit
+        """
+        self.flush()
+
+    def get_partition(self, row):
+        """
+        Args:
+            row(dict)
+        Returns:
+            tuple: (name, value) pairs
+        """
+        ret = [
+            (field, str(row.get(field) or 'unknown').replace(os.sep, '_'))
+            for field in self.partition_fields]
+        day = str(row.get(self.partition_time_field) or '')[0:10]
+        ret.append(('date', day or 'unknown'))
+        return tuple(ret)
+
+    def get_partition_path(self, partition):
+        """
+        Returns the directory of a partition
+        """
+        return os.path.join(self.get_path(), *[
+            '{}={}'.format(name, value) for name, value in partition])
+
+    def get_fields(self, rows):
+        """
+        Fields stored in the files, partition fields are part of the path
+
+        Args:
+            rows(list of dict)
+        Returns:
+            list
+        """
+        fields = list(self.header) or list(
+            dict.fromkeys(key for row in rows for key in row))
+        return [
+            field for field in fields if field not in self.partition_fields]
+
+    def get_column_type(self, field, values):
+        """
+        The type of a column, see class documentation
+
+        Args:
+            field(str)
+            values(list)
+        Returns:
+            str
+        """
+        if field in self.types:
+            return self.types[field]
+        if field in self.timestamp_fields:
+            return 'timestamp'
+        kinds = {type(value) for value in values if value is not None}
+        if not kinds:
+            return 'null'
+        if kinds == {bool}:
+            return 'bool'
+        if kinds <= {int}:
+            return 'int'
+        if kinds <= {int, float}:
+            return 'float'
+        return 'string'
+
+    def merge_column_type(self, field, column_type):
+        """
+        Reconcile the type of a column with the type of the files written
+        before and remember it
+
+        Args:
+            field(str)
+            column_type(str): the type inferred for the current rows
+        Returns:
+            str
+        """
+        previous = self.column_types.get(field)
+        if previous is None or previous == column_type:
+            merged = column_type
+        elif column_type == 'null':
+            merged = previous
+        elif previous == 'null':
+            merged = column_type
+        elif {previous, column_type} == {'int', 'float'}:
+            merged = 'float'
+        else:
+            merged = 'string'
+        self.column_types[field] = merged
+        return merged
+
+    def convert_column(self, column_type, values):
+        """
+        Convert values to the type of their column, values that can not be
+        converted become None
+
+        Args:
+            column_type(str)
+            values(list)
+        Returns:
+            list
+        """
+        if column_type == 'timestamp':
+            return [parse_timestamp(value) for value in values]
+        if column_type in ('int', 'float'):
+            number_type = int if column_type == 'int' else float
+            return [parse_number(value, number_type) for value in values]
+        if column_type == 'bool':
+            return [None if value is None else bool(value) for value in values]
+        if column_type == 'null':
+            return [None] * len(values)
+        return [None if value is None else str(value) for value in values]
+
+    def to_table(self, rows):
+        """
+        Convert rows into a typed table
+
+        Args:
+            rows(list of dict)
+        Returns:
+            pyarrow.Table
+        """
+        # pyarrow is only needed for columnar output
+        import pyarrow
+        arrow_types = {
+            'float': pyarrow.float64(), 'int': pyarrow.int64(),
+            'bool': pyarrow.bool_(), 'string': pyarrow.string(),
+            'timestamp': pyarrow.timestamp('us'), 'null': pyarrow.null()}
+        columns = {}
+        for field in self.get_fields(rows):
+            values = [row.get(field) for row in rows]
+            column_type = self.merge_column_type(
+                field, self.get_column_type(field, values))
+            columns[field] = pyarrow.array(
+                self.convert_column(column_type, values),
+                type=arrow_types[column_type])
+        return pyarrow.table(columns)
+
+    def write_partition(self, partition, rows):
+        """
+        Write rows into a new file of a partition
+
+        Args:
+            partition(tuple)
+            rows(list of dict)
+        Returns:
+            str: path of the file
+        """
+        directory = self.get_partition_path(partition)
+        path = self.write_file(
+            self.to_table(rows), directory,
+            '{}.{}'.format(time.time_ns(), self.file_format))
+        print('Write {} rows to'.format(len(rows)), path)
+        return path
+
+    def write_file(self, table, directory, name):
+        """
+        Write a table into a file. The file is written under a hidden name
+        first so that readers never see partial files.
+
+        Args:
+            table(pyarrow.Table)
+            directory(str)
+            name(str): file name
+        Returns:
+            str: path of the file
+        """
+        import pyarrow.ipc
+        import pyarrow.parquet
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, '.' + name)
+        if self.file_format == 'parquet':
+            pyarrow.parquet.write_table(
+                table, tmp, compression=self.compression,
+                row_group_size=self.row_group_size)
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+            with pyarrow.ipc.new_file(
+                    tmp, table.schema, options=options) as writer:
+                writer.write_table(table)
+        path = os.path.join(directory, name)
+        os.replace(tmp, path)
+        return path
+
+    def list_files(self, directory):
+        """
+        Returns the paths of the files in a partition directory in the
+        order they were written
+        """
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        paths = [
+            os.path.join(directory, name) for name in names
+            if name.endswith('.' + self.file_format) and
+            get_file_range(name) is not None]
+        return sorted(paths, key=get_file_range)
+
+    def compact(self, partition):
+        """
+        Merge the files of a partition into a single file named after the
+        range of files it replaces (<first time>-<last time>). The merged
+        file is written before the others are removed, .read skips files
+        in the range of a merged file in case that is interrupted.
+
+        Args:
+            partition(tuple)
+        Returns:
+            str: path of the merged file or None if there was nothing to do
+        """
+        import pyarrow
+        import pyarrow.dataset
+        directory = self.get_partition_path(partition)
+        paths = self.list_files(directory)
+        files = skip_compacted(paths)
+        self.file_counts[partition] = len(files)
+        if len(files) < 2:
+            # left over if compacting was interrupted
+            for item in paths:
+                if item not in files:
+                    os.remove(item)
+            return None
+        file_format = 'parquet' if self.file_format == 'parquet' else 'ipc'
+        dataset = pyarrow.dataset.dataset(files, format=file_format)
+        schema = pyarrow.unify_schemas(
+            [fragment.physical_schema for fragment in dataset.get_fragments()],
+            promote_options='permissive')
+        table = pyarrow.dataset.dataset(
+            files, format=file_format, schema=schema).to_table()
+        ranges = [get_file_range(path) for path in files]
+        path = self.write_file(table, directory, '{}-{}.{}'.format(
+            min(item[0] for item in ranges), max(item[1] for item in ranges),
+            self.file_format))
+        for item in paths:
+            os.remove(item)
+        self.file_counts[partition] = 1
+        print('Compact {} files into'.format(len(paths)), path)
+        return path
+
+    def compact_days(self, key, day):
+        """
+        Compact the partitions of a device for the days before day
+
+        Args:
+            key(tuple): partition without date
+            day(str)
+        Returns:
+            None
+        """
+        if day == 'unknown':
+            return
+        try:
+            names = os.listdir(self.get_partition_path(key))
+        except FileNotFoundError:
+            return
+        for name in names:
+            # 'unknown' sorts after all dates
+            if name.startswith('date=') and name[5:] < day:
+                self.compact(key + (('date', name[5:]),))
+
+    def read(self, columns=None, **partitions):
+        """
+        Read written data, only files of matching partitions are read, e.g.
+
+            writer.read(dev_id='cv50-1', date=('2021-03-01', '2021-03-31'))
+
+        Args:
+            columns(list): fields to read, all if None
+            partitions: partition values, (first, last) for a range
+        Returns:
+            pyarrow.Table
+        """
+        import pyarrow
+        import pyarrow.dataset
+        names = list(self.partition_fields) + ['date']
+        partitioning = pyarrow.dataset.partitioning(
+            pyarrow.schema([(name, pyarrow.string()) for name in names]),
+            flavor='hive')
+        file_format = 'parquet' if self.file_format == 'parquet' else 'ipc'
+        dataset = pyarrow.dataset.dataset(
+            self.get_path(), format=file_format, partitioning=partitioning)
+        expression = None
+        for name, value in partitions.items():
+            field = pyarrow.dataset.field(name)
+            if isinstance(value, tuple):
+                condition = (field >= value[0]) & (field <= value[1])
+            else:
+                condition = field == value
+            expression = condition if expression is None else (
+                expression & condition)
+        fragments = {
+            fragment.path: fragment
+            for fragment in dataset.get_fragments(filter=expression)}
+        paths = skip_compacted(list(fragments))
+        if paths:
+            # files may differ in types, e.g. a null column in an early file
+            dataset = pyarrow.dataset.FileSystemDataset(
+                [fragments[path] for path in paths], pyarrow.unify_schemas(
+                    [fragments[path].physical_schema for path in paths] +
+                    [partitioning.schema], promote_options='permissive'),
+                dataset.format, filesystem=dataset.filesystem)
+        return dataset.to_table(columns=columns, filter=expression)
+
+
+def get_file_range(path):
+    """
+    The write times of the rows in a columnar file, taken from its name
+
+    Args:
+        path(str)
+    Returns:
+        tuple: (first, last) or None for files not written by
+            BaseColumnarWriter
+    """
+    name = os.path.basename(path).split('.')[0]
+    try:
+        items = [int(item) for item in name.split('-')]
+    except ValueError:
+        return None
+    if len(items) > 2:
+        return None
+    return items[0], items[-1]
+
+
+def skip_compacted(paths):
+    """
+    Leave out files whose rows are also in a merged file of the same
+    directory (see BaseColumnarWriter.compact)
+
+    Args:
+        paths(list)
+    Returns:
+        list
+    """
+    merged = {}
+    for path in paths:
+        item = get_file_range(path)
+        if item and item[0] != item[1]:
+            merged.setdefault(os.path.dirname(path), []).append((item, path))
+    ret = []
+    for path in paths:
+        item = get_file_range(path)
+        if not item or not any(
+                first <= item[0] and item[1] <= last and other != path
+                for (first, last), other in merged.get(
+                    os.path.dirname(path), [])):
+            ret.append(path)
+    return ret
+
+
+def quote(name):
+    """
+    Quote an SQL identifier such as a column name
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class BaseSQLiteWriter(BaseCSVWriter):
+    """
+    Writes data into a SQLite database (template being its path) to query
+    data by device and time without scanning files.
+
+    Rows are selected like CSV lines and inserted in batches, a
+    transaction per batch_size rows or flush_interval seconds. Columns are
+    taken from the header, with an empty header columns are added as
+    fields appear. A row is identified by dev_id and received_utc,
+    duplicates (e.g. redelivered messages) are ignored. The database runs
+    in WAL mode so that readers do not block the writer.
+    """
+    table = 'readings'
+    batch_size = 1000
+    flush_interval = 5
+    # SQLite synchronous setting, NORMAL is safe against crashes in WAL mode
+    synchronous = 'NORMAL'
+    key_fields = ('dev_id', 'received_utc')
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.columns = []
+        self.connection = self.connect()
+
+    def buffered(self):
+        """
+        Rows are always buffered
+        """
+        return True
+
+    def connect(self):
+        """
+        Open the database and create table and indexes if necessary
+
+        Returns:
+            sqlite3.Connection
+        """
+        path = self.get_path()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous={}'.format(self.synchronous))
+        fields = list(self.key_fields) + [
+            field for field in self.header if field not in self.key_fields]
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+                quote(self.table), ', '.join(quote(item) for item in fields)))
+            connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                    quote(self.table + '_key'), quote(self.table),
+                    ', '.join(quote(item) for item in self.key_fields)))
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                    quote(self.table + '_time'), quote(self.table),
+                    quote(self.key_fields[1])))
+        self.columns = [
+            item['name'] for item in connection.execute(
+                'PRAGMA table_info({})'.format(quote(self.table)))]
+        return connection
+
+    def add_columns(self, fields):
+        """
+        Add columns for fields the table does not have yet
+
+        Args:
+            fields(iterable)
+        Returns:
+            None
+        """
+        for field in fields:
+            if field not in self.columns:
+                self.connection.execute('ALTER TABLE {} ADD COLUMN {}'.format(
+                    quote(self.table), quote(field)))
+                self.columns.append(field)
+
+    def write_rows(self, rows):
+        """
+        Buffer rows and insert them once batch_size rows are buffered or
+        flush_interval has passed
+
+        Args:
+            rows(list of dict)
+        Returns:
+            None
+        """
+        if not rows:
+            return
+        self.add_to_buffer(self.rows, rows, size=self.batch_size)
+
+    def flush(self):
+        """
+        Insert buffered rows in a single transaction
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.stop_timer()
+            if not self.rows or self.connection is None:
+                return
+            rows, self.rows = self.rows, []
+            fields = list(self.header) or list(
+                dict.fromkeys(key for row in rows for key in row))
+            fields += [item for item in self.key_fields if item not in fields]
+            with self.connection:
+                self.add_columns(fields)
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO {} ({}) VALUES ({})'.format(
+                        quote(self.table),
+                        ', '.join(quote(item) for item in fields),
+                        ', '.join('?' * len(fields))),
+                    [
+                        [self.to_sql(row.get(field)) for field in fields]
+                        for row in rows])
+            print('Add {} rows to'.format(len(rows)), self.get_path())
+
+    def to_sql(self, value):
+        """
+        Convert a value into a type SQLite can store
+        """
+        if value is None or isinstance(value, (int, float, str, bytes)):
+            return value
+        return str(value)
+
+    def close(self):
+        """
+        Insert buffered rows and close the database, called at exit
+        """
+        with self.lock:
+            self.flush()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def query(self, dev_id=None, start=None, end=None, columns=None,
+              limit=None, descending=False):
+        """
+        Query rows by device and time
+
+        Args:
+            dev_id(str): device id, all devices if None
+            start(str): first received_utc (ISO-8601), inclusive
+            end(str): last received_utc (ISO-8601), exclusive
+            columns(list): columns to return, all if None
+            limit(int): maximum number of rows
+            descending(boolean): newest rows first
+        Returns:
+            list of dict
+        """
+        device, received = (quote(item) for item in self.key_fields)
+        conditions = []
+        params = []
+        if dev_id is not None:
+            conditions.append(device + ' = ?')
+            params.append(dev_id)
+        if start is not None:
+            conditions.append(received + ' >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append(received + ' < ?')
+            params.append(end)
+        sql = 'SELECT {} FROM {}'.format(
+            ', '.join(quote(item) for item in columns) if columns else '*',
+            quote(self.table))
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY {}{}'.format(received, ' DESC' if descending else '')
+        if limit:
+            sql += ' LIMIT {:d}'.format(limit)
+        with self.lock:
+            self.flush()
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def latest(self, dev_id):
+        """
+        The last reading of a device
+
+        Args:
+            dev_id(str)
+        Returns:
+            dict or None
+        """
+        rows = self.query(dev_id=dev_id, limit=1, descending=True)
+        return rows[0] if rows else None
@@ -4,10 +4,7 @@ Listen to the laird-rs-191@tnc application
 """
 
 # standard library
-from base64 import b64decode
 import os
-# third party
-from cayennelpp import LppFrame, lpp_type
 # project
 from clients.base import mqtt, parsers, writers
 
@@ -19,32 +16,11 @@ OUTPUT_TEMPLATE = os.path.join(os.path.expanduser("~"),
     'lora_data', os.path.splitext(os.path.split(__file__)[1])[0] + '.csv')
 
 
-class RS191_Parser(parsers.BaseParser):
+class RS191_Parser(parsers.CayenneLPPParser):
     """
-    A parser for the TBS12S/CV50 setup (micro weather station)
+    A parser for Laird RS191 sensors (Cayenne LPP)
     """
 
-    def get_sensor_data(self, dic):
-        """
-        Parses RS191 Cayenne messages.
-        Args:
-            dic(dict): A device data dictionary
-        Returns:
-            dict
-        """
-        ret = {}
-        frame = LppFrame()
-        decoded = frame.from_bytes(b64decode(dic.get('payload')))
-        for item in decoded:
-            type_name = item.type.name
-            field_name = '_'.join(
-            type_name.split(' ') + [str(item.channel)])
-            # use single value for now until we encounter tuples with more
-            # than one value
-            value = item.value[0]
-            ret.update({field_name: value})
-        return ret
-
 
 class RS191_CSV_Writer(writers.BaseCSVWriter):
     """
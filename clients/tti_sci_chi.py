@@ -8,13 +8,13 @@ import os
 from clients.base import mqtt, parsers, writers
 
 
-CV50_PS_MAPPING = [
+CV50_PS_MAPPING = (
     'solar_flux_density', 'precipitation', 'lightening_strike_count',
     'strike_distance', 'wind_speed', 'wind_direction', 'max_wind_speed',
     'air_temp', 'vapor_pressure', 'barometric_pressure', 'rel_humidity',
     'humidity_sensor_temp', 'tilt_north_south', 'tilt_west_east',
     'compass_heading', 'north_wind_speed', 'east_wind_speed',
-    'wind_speed_max']
+    'wind_speed_max')
 CSV_HEADER = (
     'received_at', 'device_time', 'app_id', 'dev_id', 'prefix',
     'sensor_id', 'sub_sensor_id', 'nb_values', 'solar_flux_density',
@@ -33,21 +33,7 @@ class TBS12S_CV50_Parser(parsers.TBS12SParser):
     """
     A parser for the TBS12S/CV50 setup (micro weather station)
     """
-
-    def get_sensor_data(self, dic):
-        """
-        Parses CV50 SDI 12 messages (preformatted by TBS12S)
-
-        Args:
-            dic(dict): A device data dictionary
-        Returns:
-            dict
-        """
-        ret = {}
-        parts = dic.get('measurements', '').split(' ')
-        for idx, itm in enumerate(CV50_PS_MAPPING):
-            ret[itm] = float(parts[idx])
-        return ret
+    sensor_fields = CV50_PS_MAPPING
 
 
 class TBS12S_CV50_CSV_Writer(writers.BaseCSVWriter):
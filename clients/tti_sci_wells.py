@@ -7,7 +7,7 @@ import os
 from clients.base import mqtt, parsers, writers
 
 
-CV50_PS_MAPPING = ['w_pressure', 'w_temperature', 'w_level']
+CV50_PS_MAPPING = ('w_pressure', 'w_temperature', 'w_level')
 CSV_HEADER = (
     'label', 'received_utc', 'received_local', 'app_id', 'dev_id', 'prefix',
     'sensor_id', 'sub_sensor_id', 'nb_values', 'w_pressure',
@@ -24,21 +24,7 @@ class TBS12SInSituParser(parsers.TBS12SParser):
     """
     A parser for the TBS12S/InSitu pressuere inducer setup
     """
-
-    def get_sensor_data(self, dic):
-        """
-        Parses InSitu SDI 12 messages (preformatted by TBS12S)
-
-        Args:
-            dic(dict): A device data dictionary
-        Returns:
-            dict
-        """
-        ret = {}
-        parts = dic.get('measurements', '').split(' ')
-        for idx, itm in enumerate(CV50_PS_MAPPING):
-            ret[itm] = float(parts[idx])
-        return ret
+    sensor_fields = CV50_PS_MAPPING
 
 
 class TBS12SinSituCSVWriter(writers.BaseCSVWriter):
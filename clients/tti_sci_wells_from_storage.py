@@ -10,6 +10,9 @@ from clients.tti_sci_wells import TBS12SinSituCSVWriter
 
 OUTPUT_TEMPLATE = os.path.join(os.path.expanduser("~"),
     'lora_data', os.path.splitext(os.path.split(__file__)[1])[0] + '.csv')
+CHECKPOINT = os.path.join(os.path.expanduser("~"),
+    'lora_data', '.' + os.path.splitext(os.path.split(__file__)[1])[0] +
+    '.checkpoint')
 
 
 class MyStorageReader(storage.StorageReader):
@@ -19,16 +22,25 @@ class MyStorageReader(storage.StorageReader):
     url = (
         'https://tnc.nam1.cloud.thethings.industries/'
         'api/v3/as/applications/sci-wells/packages/storage/uplink_message')
+    workers = 4
+    checkpoint_path = CHECKPOINT
 
 
 class TBS12SinSituFromStorageWriter(TBS12SinSituCSVWriter):
     """
-    Make sure we overwrite and don't append
+    Make sure we overwrite and don't append (unless resuming from a
+    checkpoint)
     """
     append = False
     template = OUTPUT_TEMPLATE
 
 
 if __name__ == '__main__':
+    reader = MyStorageReader()
     writer = TBS12SinSituFromStorageWriter()
-    MyStorageReader(callback=writer.add_to_csv).run()
+    if reader.checkpoint:
+        writer.write_mode = 'a'
+    reader.batch_callback = writer.add_many_to_csv
+    # rows must be written before a checkpoint marks them as processed
+    reader.sync_callback = writer.flush
+    reader.run()
@@ -2,11 +2,20 @@
 Listen to the tektelic asset-tracker application,
 and send coordinates to Arcgis Online
 """
+import os
 from clients.base import mqtt, parsers, writers
 
 
+# records kept while AGO is unreachable
+SPOOL = os.path.join(os.path.expanduser('~'), 'lora_data', '.tektelic_spool')
+
+
 class Tektelic_AGO_Writer(writers.BaseAGOWriter):
     parser_class = parsers.TektelicTrackerParser
+    spool_path = SPOOL
+    # one addFeatures request per batch instead of per position
+    batch_size = 50
+    max_batch_age = 10
 
 
 class Tektelic_Client(mqtt.BaseMQTTClient):
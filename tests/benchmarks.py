@@ -0,0 +1,296 @@
+# pylint:disable=C0115,C0116
+"""
+Micro-benchmarks, run with
+
+    python -m tests.benchmarks
+"""
+# standard library
+import base64
+import csv
+from datetime import datetime, timedelta
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+# project
+from clients.base import parsers, writers
+from clients import (
+    tti_rs191, tti_sci_chi, tti_sci_wells, tti_staten_pressure)
+
+
+EXAMPLE_DIRECTORY = os.path.dirname(__file__)
+# LPP payload of a RS191 uplink
+LPP_PAYLOAD = 'AWcAcAJorQMCASY='
+# battery voltage, GNSS position and acceleration of a Tektelic tracker, the
+# GNSS item is the example of the Cayenne LPP GPS type
+TEKTELIC_PAYLOAD = bytes.fromhex(
+    '00ff016a' '008806765ff2960a0003e8' '0071fff4000503e8')
+
+
+def load_message(filename='tti_sci_chi_example_payload.txt'):
+    """
+    Load an example message the way the MQTT client delivers it
+    """
+    with open(os.path.join(EXAMPLE_DIRECTORY, filename), 'rb') as filehandle:
+        return SimpleNamespace(payload=filehandle.read())
+
+
+def load_lpp_message():
+    """
+    The TBS12S example message with a Cayenne LPP payload
+    """
+    msg = load_message()
+    return SimpleNamespace(payload=msg.payload.replace(
+        b'"frm_payload":"UFMw', b'"frm_payload":"' + LPP_PAYLOAD.encode(
+            'utf-8') + b'","unused":"UFMw'))
+
+
+def load_tektelic_message():
+    """
+    The TBS12S example message with a Tektelic tracker payload (battery,
+    GNSS position, acceleration)
+    """
+    payload = base64.b64encode(TEKTELIC_PAYLOAD)
+    msg = load_message()
+    return SimpleNamespace(payload=msg.payload.replace(
+        b'"frm_payload":"UFMw', b'"frm_payload":"' + payload +
+        b'","unused":"UFMw'))
+
+
+def get_parser_messages():
+    """
+    Pairs of shipped parser classes and a message they can digest
+    """
+    tbs12s = load_message()
+    oyster = load_message('oyster_example_payload.txt')
+    lpp = load_lpp_message()
+    tektelic = load_tektelic_message()
+    return [
+        (parsers.BaseParser, tbs12s),
+        (parsers.TBS12SParser, tbs12s),
+        (tti_sci_chi.TBS12S_CV50_Parser, tbs12s),
+        (tti_sci_wells.TBS12SInSituParser, tbs12s),
+        (parsers.TektelicTrackerParser, tektelic),
+        (parsers.FeatherTrackerParser, oyster),
+        (tti_rs191.RS191_Parser, lpp),
+        (tti_staten_pressure.Analog_Pressure_Parser, lpp)]
+
+
+def bench_parsers(number=5000):
+    """
+    Messages per second through .parse for each shipped parser
+    """
+    for parser_class, msg in get_parser_messages():
+        parser = parser_class()
+        start = time.perf_counter()
+        for _ in range(0, number):
+            parser.parse(msg)
+        duration = time.perf_counter() - start
+        sys.stdout.write('{:<24} {:>9.0f} messages/s\n'.format(
+            parser_class.__name__, number / duration))
+
+
+def bench_parse_many(size=1000, number=5):
+    """
+    Messages per second through .parse and .parse_many for storage sized
+    pages
+    """
+    page = [load_message()] * size
+    for parser_class in (
+            tti_sci_wells.TBS12SInSituParser, tti_sci_chi.TBS12S_CV50_Parser):
+        parser = parser_class()
+        for label, parse_page in (
+                ('parse', lambda: [parser.parse(msg) for msg in page]),
+                ('parse_many', lambda: parser.parse_many(page))):
+            start = time.perf_counter()
+            for _ in range(0, number):
+                parse_page()
+            duration = time.perf_counter() - start
+            sys.stdout.write('{:<10} {:<24} {:>9.0f} messages/s\n'.format(
+                label, parser_class.__name__, size * number / duration))
+
+
+def bench_timestamps(number=50000):
+    """
+    Conversions per second of TTI timestamps into local time
+    """
+    timestring = '2021-01-04T23:46:05.124510287Z'
+    start = time.perf_counter()
+    for _ in range(0, number):
+        parsers.get_local_time(timestring)
+    duration = time.perf_counter() - start
+    sys.stdout.write('get_local_time {:>9.0f} conversions/s\n'.format(
+        number / duration))
+
+
+def bench_lpp(number=50000):
+    """
+    Cayenne LPP payloads per second decoded by the struct based decoder and
+    by pycayennelpp
+    """
+    # third party
+    from cayennelpp import LppFrame
+
+    payload = base64.b64decode(LPP_PAYLOAD)
+    for label, decode in (
+            ('lpp_to_dict', parsers.lpp_to_dict),
+            ('LppFrame', LppFrame.from_bytes)):
+        start = time.perf_counter()
+        for _ in range(0, number):
+            decode(payload)
+        duration = time.perf_counter() - start
+        sys.stdout.write('{:<14} {:>9.0f} payloads/s\n'.format(
+            label, number / duration))
+
+
+def bench_csv_ingest(total=60000, step=10000):
+    """
+    Time per message while a CSV with max_lines grows, this should stay
+    flat with file size.
+    """
+    msg = load_message()
+    directory = tempfile.mkdtemp()
+    try:
+        with mock.patch.multiple(writers.BaseCSVWriter,
+                template=os.path.join(directory, 'bench.csv'),
+                header=['received_at', 'dev_id', 'rssi'],
+                max_lines=total + 1), mock.patch('builtins.print'):
+            writer = writers.BaseCSVWriter()
+            for lines in range(0, total, step):
+                start = time.perf_counter()
+                for _ in range(0, step):
+                    writer.add_to_csv(msg)
+                duration = time.perf_counter() - start
+                sys.stdout.write(
+                    'csv ingest at {:>6} lines: {:.1f} us/message\n'.format(
+                        lines, duration / step * 1e6))
+            writer.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def get_month_of_rows(interval=timedelta(minutes=1)):
+    """
+    A month of parsed CV50 rows of a single device
+    """
+    row = tti_sci_chi.TBS12S_CV50_Parser().parse(load_message())
+    time = datetime(2021, 3, 1)
+    rows = []
+    while time < datetime(2021, 4, 1):
+        timestring = time.isoformat() + '.000000000Z'
+        rows.append(dict(row, received_at=timestring, received_utc=timestring))
+        time += interval
+    return rows
+
+
+def bench_columnar_read():
+    """
+    Time to load a month of CV50 data from CSV and Parquet. Rows are
+    written like live uplinks, the Parquet writer flushes after every row
+    as its timer would for a device sending every ten minutes.
+    """
+    if not importlib.util.find_spec('pyarrow'):
+        sys.stdout.write('columnar read: requires pyarrow\n')
+        return
+    # leave out the import time
+    importlib.import_module('pyarrow.dataset')
+    rows = get_month_of_rows(timedelta(minutes=10))
+    directory = tempfile.mkdtemp()
+    try:
+        with mock.patch('builtins.print'):
+            csv_writer = type('Writer', (writers.BaseCSVWriter,), {
+                'template': os.path.join(directory, 'month.csv'),
+                'header': tti_sci_chi.CSV_HEADER})()
+            csv_writer.write_rows(rows)
+            writer = type('Writer', (writers.BaseColumnarWriter,), {
+                'template': os.path.join(directory, 'parquet'),
+                'header': tti_sci_chi.CSV_HEADER})()
+            start = time.perf_counter()
+            for row in rows:
+                writer.write_rows([row])
+                writer.flush()
+            duration = time.perf_counter() - start
+        files = sum(
+            len(names) for _, _, names in os.walk(writer.get_path()))
+        sys.stdout.write(
+            'parquet write {} rows: {:>7.1f} ms, {} files\n'.format(
+                len(rows), duration * 1000, files))
+        start = time.perf_counter()
+        with open(csv_writer.get_path()) as filehandle:
+            values = [
+                float(item['air_temp']) for item in csv.DictReader(filehandle)]
+        duration = time.perf_counter() - start
+        sys.stdout.write('csv read     {} rows: {:>7.1f} ms\n'.format(
+            len(values), duration * 1000))
+        start = time.perf_counter()
+        table = writer.read(
+            columns=['received_at', 'air_temp'], dev_id=rows[0]['dev_id'],
+            date=('2021-03-01', '2021-03-31'))
+        duration = time.perf_counter() - start
+        sys.stdout.write('parquet read {} rows: {:>7.1f} ms\n'.format(
+            table.num_rows, duration * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_sqlite(devices=10):
+    """
+    Insert throughput and range query latency of the SQLite writer
+    compared to a persistent CSV writer
+    """
+    rows = [
+        dict(row, dev_id='dev-{}'.format(idx))
+        for row in get_month_of_rows(timedelta(minutes=10))
+        for idx in range(0, devices)]
+    directory = tempfile.mkdtemp()
+    attributes = {'header': tti_sci_chi.CSV_HEADER, 'persistent': True}
+    try:
+        with mock.patch('builtins.print'):
+            for writer_class, name, label in (
+                    (writers.BaseCSVWriter, 'month.csv', 'CSV'),
+                    (writers.BaseSQLiteWriter, 'month.sqlite', 'SQLite')):
+                writer = type('Writer', (writer_class,), dict(
+                    attributes, template=os.path.join(directory, name)))()
+                start = time.perf_counter()
+                for row in rows:
+                    writer.write_rows([row])
+                writer.flush()
+                duration = time.perf_counter() - start
+                sys.stdout.write('{:<6} insert {:>9.0f} rows/s\n'.format(
+                    label, len(rows) / duration))
+                writer.close()
+        start = time.perf_counter()
+        with open(os.path.join(directory, 'month.csv')) as filehandle:
+            selected = [
+                item for item in csv.DictReader(filehandle)
+                if item['dev_id'] == 'dev-3' and
+                '2021-03-10' <= item['received_at'] < '2021-03-11']
+        duration = time.perf_counter() - start
+        sys.stdout.write('CSV    query  {:>4} rows: {:>7.1f} ms\n'.format(
+            len(selected), duration * 1000))
+        with mock.patch('builtins.print'):
+            writer = type('Writer', (writers.BaseSQLiteWriter,), dict(
+                attributes, template=os.path.join(directory, 'month.sqlite')))()
+        start = time.perf_counter()
+        selected = writer.query(
+            dev_id='dev-3', start='2021-03-10', end='2021-03-11')
+        duration = time.perf_counter() - start
+        sys.stdout.write('SQLite query  {:>4} rows: {:>7.1f} ms\n'.format(
+            len(selected), duration * 1000))
+        writer.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    bench_parsers()
+    bench_parse_many()
+    bench_timestamps()
+    bench_lpp()
+    bench_csv_ingest()
+    bench_columnar_read()
+    bench_sqlite()
@@ -0,0 +1,293 @@
+# pylint:disable=C0115,C0116
+"""
+A minimal MQTT 3.1.1 broker standing in for mosquitto/TTI in tests.
+
+Supports CONNECT, SUBSCRIBE (with + and # wildcards and $share groups),
+PUBLISH with QoS 0 and 1, PINGREQ and DISCONNECT.
+"""
+# standard library
+import itertools
+import socket
+import socketserver
+import struct
+import threading
+
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def encode_length(length):
+    ret = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        ret.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(ret)
+
+
+def encode_string(text):
+    data = text.encode('utf-8')
+    return struct.pack('!H', len(data)) + data
+
+
+def packet(packet_type, body=b'', flags=0):
+    return bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body
+
+
+def topic_matches(topic_filter, topic):
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for idx, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if idx >= len(topic_parts):
+            return False
+        if part not in ('+', topic_parts[idx]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class Reader():
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, number):
+        ret = self.data[self.pos:self.pos + number]
+        self.pos += number
+        return ret
+
+    def short(self):
+        return struct.unpack('!H', self.read(2))[0]
+
+    def string(self):
+        return self.read(self.short()).decode('utf-8')
+
+    def rest(self):
+        return self.read(len(self.data) - self.pos)
+
+
+class Session():
+    """
+    State of a client id, kept across connections for clean_session=False
+    """
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.subscriptions = {}
+        self.connection = None
+        # packet id -> (topic, payload) of unacknowledged QoS 1 messages
+        self.inflight = {}
+        self.packet_ids = itertools.count(1)
+
+
+class Handler(socketserver.BaseRequestHandler):
+
+    def read_exactly(self, number):
+        data = b''
+        while len(data) < number:
+            chunk = self.request.recv(number - len(data))
+            if not chunk:
+                raise ConnectionError('closed')
+            data += chunk
+        return data
+
+    def read_packet(self):
+        first = self.read_exactly(1)[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = self.read_exactly(1)[0]
+            length += (byte & 0x7f) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return first >> 4, first & 0x0f, self.read_exactly(length)
+
+    def send(self, data):
+        with self.lock:
+            self.request.sendall(data)
+
+    def handle(self):
+        self.lock = threading.Lock()
+        self.session = None
+        broker = self.server.broker
+        try:
+            while True:
+                packet_type, flags, body = self.read_packet()
+                if packet_type == CONNECT:
+                    self.on_connect(Reader(body))
+                elif packet_type == SUBSCRIBE:
+                    self.on_subscribe(Reader(body))
+                elif packet_type == UNSUBSCRIBE:
+                    reader = Reader(body)
+                    packet_id = reader.short()
+                    while reader.pos < len(body):
+                        self.session.subscriptions.pop(reader.string(), None)
+                    self.send(packet(UNSUBACK, struct.pack('!H', packet_id)))
+                elif packet_type == PUBLISH:
+                    self.on_publish(flags, Reader(body))
+                elif packet_type == PUBACK:
+                    packet_id = Reader(body).short()
+                    self.session.inflight.pop(packet_id, None)
+                    broker.acks.append((self.session.client_id, packet_id))
+                elif packet_type == PINGREQ:
+                    self.send(packet(PINGRESP))
+                elif packet_type == DISCONNECT:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker.disconnected(self)
+
+    def on_connect(self, reader):
+        broker = self.server.broker
+        reader.string()
+        reader.read(1)
+        connect_flags = reader.read(1)[0]
+        reader.short()
+        client_id = reader.string()
+        if connect_flags & 0x04:
+            reader.string()
+            reader.read(reader.short())
+        clean = bool(connect_flags & 0x02)
+        if not client_id:
+            client_id = 'auto-{}'.format(next(broker.client_ids))
+        self.session, present = broker.get_session(client_id, clean)
+        self.session.connection = self
+        self.send(packet(CONNACK, bytes([int(present), 0])))
+        broker.connects.append(client_id)
+        # redeliver unacknowledged messages of a persistent session
+        for packet_id, (topic, payload) in list(self.session.inflight.items()):
+            self.deliver(topic, payload, 1, packet_id=packet_id, dup=True)
+
+    def on_subscribe(self, reader):
+        packet_id = reader.short()
+        granted = []
+        while reader.pos < len(reader.data):
+            topic_filter = reader.string()
+            qos = min(reader.read(1)[0], 1)
+            self.session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+        self.send(packet(SUBACK, struct.pack('!H', packet_id) + bytes(granted)))
+        self.server.broker.subscribed.set()
+
+    def on_publish(self, flags, reader):
+        qos = (flags >> 1) & 0x03
+        topic = reader.string()
+        if qos:
+            packet_id = reader.short()
+            self.send(packet(PUBACK, struct.pack('!H', packet_id)))
+        self.server.broker.publish(topic, reader.rest(), qos)
+
+    def deliver(self, topic, payload, qos, packet_id=None, dup=False):
+        body = encode_string(topic)
+        if qos:
+            if packet_id is None:
+                packet_id = next(self.session.packet_ids)
+                self.session.inflight[packet_id] = (topic, payload)
+            body += struct.pack('!H', packet_id)
+        flags = qos << 1 | (0x08 if dup else 0)
+        self.send(packet(PUBLISH, body + payload, flags))
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeBroker():
+    """
+    Run a broker on a free local port in a background thread
+    """
+
+    def __init__(self, port=0):
+        self.server = Server(('127.0.0.1', port), Handler)
+        self.server.broker = self
+        self.port = self.server.server_address[1]
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.client_ids = itertools.count(1)
+        self.connects = []
+        self.acks = []
+        self.subscribed = threading.Event()
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.kick()
+
+    def kick(self):
+        """
+        Drop all client connections, e.g. to simulate a broker restart
+        """
+        with self.lock:
+            connections = [
+                item.connection for item in self.sessions.values()
+                if item.connection]
+        for connection in connections:
+            try:
+                connection.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def get_session(self, client_id, clean):
+        with self.lock:
+            session = self.sessions.get(client_id)
+            if session and not clean:
+                return session, True
+            session = Session(client_id)
+            self.sessions[client_id] = session
+            return session, False
+
+    def disconnected(self, handler):
+        with self.lock:
+            if handler.session and handler.session.connection is handler:
+                handler.session.connection = None
+
+    def connected_sessions(self):
+        with self.lock:
+            return [
+                item for item in self.sessions.values() if item.connection]
+
+    def publish(self, topic, payload, qos=0):
+        """
+        Deliver a message to all matching subscriptions. Members of a
+        $share group receive messages in turns.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        targets = []
+        shared = {}
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            for topic_filter, sub_qos in list(session.subscriptions.items()):
+                if topic_filter.startswith('$share/'):
+                    _, group, real_filter = topic_filter.split('/', 2)
+                    if topic_matches(real_filter, topic):
+                        shared.setdefault(group, []).append((session, sub_qos))
+                elif topic_matches(topic_filter, topic):
+                    targets.append((session, sub_qos))
+        for group, members in shared.items():
+            members.sort(key=lambda item: item[0].client_id)
+            turn = self.groups.get(group, 0)
+            self.groups[group] = turn + 1
+            targets.append(members[turn % len(members)])
+        for session, sub_qos in targets:
+            delivered_qos = min(qos, sub_qos)
+            if session.connection:
+                session.connection.deliver(topic, payload, delivered_qos)
+            elif delivered_qos:
+                # queue for a persistent session that is offline
+                session.inflight[next(session.packet_ids)] = (topic, payload)
@@ -0,0 +1,80 @@
+# pylint:disable=C0115,C0116
+"""
+Test AGO classes
+"""
+# standard library
+import os
+from types import SimpleNamespace
+from unittest import mock
+# project
+from clients.base import ago
+# tests
+from tests.shared import PayloadTestCase, TEST_DIRECTORY
+
+
+class TestTokenStore(PayloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        ago.TokenStore.tokens.clear()
+
+    def test_memory(self):
+        store = ago.TokenStore('test')
+        self.assertIsNone(store.retrieve_token())
+        store.store_token('abc', None, 7200)
+        self.assertEqual(store.retrieve_token(), 'abc')
+        # shared by instances
+        self.assertEqual(ago.TokenStore('test').retrieve_token(), 'abc')
+        self.assertIsNone(ago.TokenStore('other').retrieve_token())
+        store.invalidate()
+        self.assertIsNone(store.retrieve_token())
+
+    def test_refresh_margin(self):
+        store = ago.TokenStore('test')
+        store.store_token('abc', None, store.refresh_margin - 1)
+        self.assertIsNone(store.retrieve_token())
+
+    def test_file(self):
+        path = os.path.join(TEST_DIRECTORY, 'tokens.json')
+        ago.TokenStore('test', path=path).store_token('abc', None, 7200)
+        ago.TokenStore.tokens.clear()
+        self.assertEqual(
+            ago.TokenStore('test', path=path).retrieve_token(), 'abc')
+        ago.TokenStore('test', path=path).invalidate()
+        ago.TokenStore.tokens.clear()
+        self.assertIsNone(ago.TokenStore('test', path=path).retrieve_token())
+
+
+@mock.patch('clients.base.ago.ArcgisAuth.renew_access_token')
+class TestArcgisAuth(PayloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        ago.TokenStore.tokens.clear()
+
+    def test_token_reuse(self, renew):
+        renew.return_value = {'access_token': 'abc', 'expires_in': 7200}
+        for _ in range(0, 3):
+            request = ago.ArcgisAuth()(SimpleNamespace(url='http://test'))
+            self.assertEqual(request.url, 'http://test?token=abc')
+        self.assertEqual(renew.call_count, 1)
+
+    @mock.patch('clients.base.sessions.post')
+    def test_invalid_token_retry(self, post, renew):
+        renew.side_effect = [
+            {'access_token': 'old', 'expires_in': 7200},
+            {'access_token': 'new', 'expires_in': 7200}]
+        responses = {
+            'old': b'{"error": {"code": 498}}',
+            'new': b'{"addResults": [{"success": true}]}'}
+
+        def fake_post(url, data=None, auth=None):
+            request = auth(SimpleNamespace(url=url))
+            return SimpleNamespace(
+                content=responses[request.url.split('token=')[1]])
+
+        post.side_effect = fake_post
+        res = ago.FeatureService('http://test').post_records([{}])
+        self.assertEqual(res, {'addResults': [{'success': True}]})
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(ago.TokenStore('ago').retrieve_token(), 'new')
@@ -0,0 +1,137 @@
+# pylint:disable=C0115,C0116
+"""
+Test metrics
+"""
+# standard library
+import os
+import socket
+from types import SimpleNamespace
+from unittest import mock
+import urllib.request
+# project
+from clients.base import ago, metrics, mqtt, writers
+# tests
+from tests.shared import PayloadTestCase, TEST_DIRECTORY
+
+
+class TestMetrics(PayloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.REGISTRY.clear()
+
+    def test_counter(self):
+        counter = metrics.Counter('test_total', 'A test', ('topic',))
+        counter.inc('a')
+        counter.inc('a', amount=2)
+        counter.inc('b"\n')
+        self.assertEqual(counter.get('a'), 3)
+        self.assertEqual(counter.render(), [
+            'test_total{topic="a"} 3', 'test_total{topic="b\\"\\n"} 1'])
+
+    def test_histogram(self):
+        histogram = metrics.Histogram(
+            'test_seconds', 'A test', ('parser',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'P')
+        histogram.observe(0.5, 'P')
+        histogram.observe(5, 'P')
+        self.assertEqual(histogram.get('P'), 3)
+        self.assertEqual(histogram.render(), [
+            'test_seconds_bucket{parser="P",le="0.1"} 1',
+            'test_seconds_bucket{parser="P",le="1"} 2',
+            'test_seconds_bucket{parser="P",le="+Inf"} 3',
+            'test_seconds_sum{parser="P"} 5.55',
+            'test_seconds_count{parser="P"} 3'])
+        with histogram.time('Q'):
+            pass
+        self.assertEqual(histogram.get('Q'), 1)
+
+    def test_gauge(self):
+        gauge = metrics.Gauge('test_depth', 'A test', ('topic',))
+        values = [3, 4]
+        gauge.track(lambda: values[0], 'a')
+        gauge.track(lambda: values[1], 'a')
+        self.assertEqual(gauge.get('a'), 7)
+        values[0] = 0
+        self.assertEqual(gauge.render(), ['test_depth{topic="a"} 4'])
+        # tracking does not keep objects alive
+        owner = type('Owner', (), {'get': lambda self: 5})()
+        gauge.track(owner.get, 'b')
+        self.assertEqual(gauge.get('b'), 5)
+        del owner
+        self.assertEqual(gauge.get('b'), 0)
+
+    def test_exporters(self):
+        metrics.ROWS_WRITTEN.inc('Writer', amount=5)
+        server = metrics.serve(0)
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(
+                    server.server_port)) as res:
+                body = res.read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('# TYPE tti_rows_written_total counter\n', body)
+        self.assertIn('tti_rows_written_total{writer="Writer"} 5\n', body)
+        path = os.path.join(TEST_DIRECTORY, 'metrics.prom')
+        metrics.REGISTRY.dump(path)
+        with open(path) as filehandle:
+            self.assertEqual(filehandle.read(), body)
+
+    @mock.patch.dict('clients.base.metrics.EXPORTERS', clear=True)
+    def test_partition_ports(self):
+        busy = socket.socket()
+        busy.bind(('127.0.0.1', 0))
+        busy.listen()
+        port = busy.getsockname()[1]
+        try:
+            with mock.patch.dict('os.environ', {'METRICS_PORT': str(port)}), \
+                    mock.patch('clients.base.metrics.serve') as serve:
+                metrics.start_exporters(partition=2)
+            serve.assert_called_once_with(port + 2)
+            metrics.EXPORTERS.clear()
+            # the port of partition 0 is taken
+            with mock.patch.dict('os.environ', {'METRICS_PORT': str(port)}):
+                metrics.start_exporters(partition=0)
+            self.assertIsNone(metrics.EXPORTERS['server'])
+        finally:
+            busy.close()
+
+    @mock.patch('clients.base.writers.BaseCSVWriter.template',
+        new=os.path.join(TEST_DIRECTORY, 'test.csv'))
+    def test_pipeline(self):
+        with mock.patch('clients.base.mqtt.mqtt.Client'):
+            client = type('Client', (mqtt.BaseMQTTClient,), {
+                'topic': 'v3/app@tnc/devices/+/up'})(callback=mock.Mock())
+        client.on_message(None, None, SimpleNamespace(
+            topic='v3/app@tnc/devices/dev-1/up'))
+        self.assertEqual(metrics.MESSAGES_RECEIVED.get(
+            'v3/app@tnc/devices/+/up', 'dev-1'), 1)
+        self.assertEqual(
+            metrics.QUEUE_DEPTH.get('v3/app@tnc/devices/+/up'), 0)
+        client.dropped = 2
+        self.assertIn(
+            'tti_messages_dropped{topic="v3/app@tnc/devices/+/up"} 2\n',
+            metrics.REGISTRY.render())
+        writer = writers.BaseCSVWriter()
+        writer.add_to_csv(self.example_message)
+        self.assertEqual(metrics.ROWS_WRITTEN.get('BaseCSVWriter'), 1)
+        self.assertEqual(metrics.WRITE_SECONDS.get('BaseCSVWriter'), 1)
+        self.assertEqual(metrics.PARSE_SECONDS.get('BaseParser'), 1)
+        with self.assertRaises(ValueError):
+            writer.add_to_csv(SimpleNamespace(payload=b'no json'))
+        self.assertEqual(metrics.PARSE_FAILURES.get('BaseParser'), 1)
+
+    @mock.patch('clients.base.ago.FeatureService.post')
+    def test_ago_outcomes(self, post):
+        service = ago.FeatureService('http://test')
+        for content in (
+                b'{"addResults": [{"success": true}]}',
+                b'{"addResults": [{"success": false}]}',
+                b'{"error": {"code": 498}}', b'error'):
+            post.return_value = SimpleNamespace(content=content)
+            service.post_records([{}])
+        self.assertEqual(
+            [metrics.AGO_REQUESTS.get(item) for item in (
+                'success', 'partial', 'invalid_token', 'failed')],
+            [1, 1, 1, 1])
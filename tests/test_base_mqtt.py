@@ -0,0 +1,311 @@
+# pylint:disable=C0115,C0116
+"""
+Test the MQTT client
+"""
+# standard library
+import os
+import socket
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock, TestCase
+# project
+from clients.base import mqtt, parsers, writers
+# tests
+from tests.broker import FakeBroker
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError('timeout')
+        time.sleep(0.01)
+
+
+@mock.patch('clients.base.mqtt.mqtt.Client')
+class TestBaseMQTTClient(TestCase):
+
+    def test_direct_processing(self, client):
+        processed = []
+        mqtt_client = mqtt.BaseMQTTClient(callback=processed.append)
+        mqtt_client.on_message(None, None, 'msg')
+        self.assertEqual(processed, ['msg'])
+        client.assert_called_once_with(mqtt.mqtt.CallbackAPIVersion.VERSION2)
+
+    @mock.patch.multiple('clients.base.mqtt.BaseMQTTClient',
+        workers=2, queue_size=10)
+    def test_workers(self, client):
+        processed = []
+        lock = threading.Lock()
+
+        def callback(msg):
+            with lock:
+                processed.append(msg)
+
+        mqtt_client = mqtt.BaseMQTTClient(callback=callback)
+        mqtt_client.start_workers()
+        for idx in range(0, 5):
+            mqtt_client.on_message(None, None, idx)
+        mqtt_client.stop_workers()
+        self.assertEqual(sorted(processed), [0, 1, 2, 3, 4])
+        self.assertEqual(mqtt_client.queue_depth(), 0)
+
+    @mock.patch.multiple('clients.base.mqtt.BaseMQTTClient',
+        workers=1, queue_size=2)
+    def test_drop_oldest(self, client):
+        mqtt_client = mqtt.BaseMQTTClient()
+        for idx in range(0, 5):
+            mqtt_client.on_message(None, None, idx)
+        self.assertEqual(mqtt_client.queue_depth(), 2)
+        self.assertEqual(mqtt_client.dropped, 3)
+        self.assertEqual(list(mqtt_client.queue.queue), [3, 4])
+
+    @mock.patch.multiple('clients.base.mqtt.BaseMQTTClient',
+        workers=1, queue_size=2, backpressure='drop_newest')
+    def test_drop_newest(self, client):
+        mqtt_client = mqtt.BaseMQTTClient()
+        for idx in range(0, 5):
+            mqtt_client.on_message(None, None, idx)
+        self.assertEqual(list(mqtt_client.queue.queue), [0, 1])
+
+    @mock.patch('clients.base.mqtt.BaseMQTTClient.workers', new=1)
+    def test_worker_survives_errors(self, client):
+        processed = []
+
+        def callback(msg):
+            if msg == 'bad':
+                raise ValueError(msg)
+            processed.append(msg)
+
+        mqtt_client = mqtt.BaseMQTTClient(callback=callback)
+        mqtt_client.start_workers()
+        with mock.patch('traceback.print_exc'):
+            mqtt_client.on_message(None, None, 'bad')
+            mqtt_client.on_message(None, None, 'good')
+            mqtt_client.stop_workers()
+        self.assertEqual(processed, ['good'])
+
+
+    @mock.patch('clients.base.mqtt.BaseMQTTClient.persistent_session',
+        new=True)
+    @mock.patch('clients.base.writers.BaseAGOWriter.parser_class',
+        new=parsers.FeatherTrackerParser)
+    @mock.patch('clients.base.ago.FeatureService.post_records')
+    def test_no_ack_before_sync(self, post_records, client):
+        post_records.return_value = {'error': {'code': 500}}
+        writer = type('Writer', (writers.BaseAGOWriter,), {
+            'batch_size': 10, 'max_attempts': 1})()
+        mqtt_client = mqtt.BaseMQTTClient(
+            callback=writer.add_to_ago, sync_callback=writer.sync)
+        with open(os.path.join(os.path.dirname(__file__),
+                'oyster_example_payload.txt'), 'rb') as filehandle:
+            msg = SimpleNamespace(
+                mid=1, qos=1, topic='v3/app/devices/dev-1/up',
+                payload=filehandle.read())
+        mqtt_client.on_message(None, None, msg)
+        with mock.patch('traceback.print_exc'):
+            self.assertEqual(mqtt_client.commit(force=True), 0)
+            self.assertEqual(mqtt_client.commit(force=True), 0)
+        mqtt_client.client.ack.assert_not_called()
+        self.assertEqual(mqtt_client.processed, [msg])
+        # kept instead of dropped after max_attempts
+        self.assertEqual(writer.lost, 0)
+        self.assertEqual(len(writer.buffer), 1)
+        post_records.return_value = {'addResults': [{'success': True}]}
+        self.assertEqual(mqtt_client.commit(force=True), 1)
+        mqtt_client.client.ack.assert_called_once_with(1, 1)
+        self.assertEqual(writer.buffer, [])
+
+
+class TestPartitions(TestCase):
+
+    def setUp(self):
+        self.broker = FakeBroker().start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.client.loop_stop()
+            client.client.disconnect()
+        self.broker.stop()
+
+    def start_clients(self, number, **attributes):
+        client_class = type('Client', (mqtt.BaseMQTTClient,), dict(
+            host='127.0.0.1', port=self.broker.port, username='test@tnc',
+            topic='v3/test@tnc/devices/+/up', partitions=number,
+            **attributes))
+        received = [[] for _ in range(0, number)]
+        for idx in range(0, number):
+            client = type(
+                'PartitionClient', (client_class,), {'partition': idx})(
+                callback=received[idx].append)
+            self.clients.append(client)
+            client.client.loop_start()
+        wait_for(lambda: len(self.broker.connected_sessions()) == number and
+            all(item.subscriptions for item in self.broker.connected_sessions()))
+        return received
+
+    def publish(self, number):
+        for idx in range(0, number):
+            self.broker.publish(
+                'v3/test@tnc/devices/dev-{}/up'.format(idx % 10), b'{}')
+
+    def test_client_side_partitions(self):
+        received = self.start_clients(3)
+        self.publish(100)
+        wait_for(lambda: sum(len(item) for item in received) == 100)
+        devices = [{msg.topic for msg in item} for item in received]
+        for idx, item in enumerate(devices):
+            for other in devices[idx + 1:]:
+                self.assertFalse(item & other)
+        self.assertEqual(len(set().union(*devices)), 10)
+
+    def test_shared_subscription(self):
+        received = self.start_clients(2, shared_subscription=True)
+        self.assertTrue(all(
+            topic.startswith('$share/test-tnc/')
+            for item in self.broker.connected_sessions()
+            for topic in item.subscriptions))
+        self.publish(10)
+        wait_for(lambda: sum(len(item) for item in received) == 10)
+        self.assertEqual([len(item) for item in received], [5, 5])
+
+
+class TestReconnect(TestCase):
+
+    def setUp(self):
+        self.received = []
+        self.client_class = type('Client', (mqtt.BaseMQTTClient,), dict(
+            host='127.0.0.1', username='test@tnc',
+            topic='v3/test@tnc/devices/+/up', reconnect_min_delay=0.05,
+            reconnect_max_delay=0.2))
+        self.broker = None
+        self.client = None
+        self.thread = None
+
+    def tearDown(self):
+        if self.client:
+            self.client.stop()
+            self.thread.join()
+        if self.broker:
+            self.broker.stop()
+
+    def run_client(self, port):
+        self.client = type('PortClient', (self.client_class,), {'port': port})(
+            callback=self.received.append)
+        self.thread = threading.Thread(target=self.client.run, daemon=True)
+        self.thread.start()
+
+    def wait_for_subscription(self, connects):
+        wait_for(lambda: len(self.broker.connects) == connects and any(
+            item.subscriptions for item in self.broker.connected_sessions()))
+
+    def test_reconnect_delay(self):
+        client = type('Client', (self.client_class,), {
+            'reconnect_min_delay': 1, 'reconnect_max_delay': 10})
+        with mock.patch('clients.base.mqtt.mqtt.Client'):
+            client = client()
+        delays = []
+        with mock.patch('random.uniform', side_effect=lambda low, high: high):
+            for attempts in range(0, 6):
+                client.reconnect_attempts = attempts
+                delays.append(client.get_reconnect_delay())
+        self.assertEqual(delays, [1, 2, 4, 8, 10, 10])
+
+    def test_resubscribe(self):
+        self.broker = FakeBroker().start()
+        self.run_client(self.broker.port)
+        self.wait_for_subscription(1)
+        self.broker.kick()
+        self.wait_for_subscription(2)
+        self.broker.publish('v3/test@tnc/devices/dev-1/up', b'{}')
+        wait_for(lambda: len(self.received) == 1)
+
+    def test_broker_down_at_start(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.run_client(port)
+        wait_for(lambda: self.client.reconnect_attempts >= 2)
+        self.broker = FakeBroker(port=port).start()
+        self.wait_for_subscription(1)
+        self.assertEqual(self.client.reconnect_attempts, 0)
+
+
+class TestPersistentSession(TestCase):
+
+    def setUp(self):
+        self.broker = FakeBroker().start()
+        self.client_class = type('Client', (mqtt.BaseMQTTClient,), dict(
+            host='127.0.0.1', port=self.broker.port, username='test@tnc',
+            topic='v3/test@tnc/devices/+/up', persistent_session=True,
+            commit_interval=0))
+        self.clients = []
+        self.threads = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.stop()
+        for thread in self.threads:
+            thread.join()
+        self.broker.stop()
+
+    def run_client(self, client_class=None, **kwargs):
+        client = (client_class or self.client_class)(**kwargs)
+        self.clients.append(client)
+        self.threads.append(threading.Thread(target=client.run, daemon=True))
+        self.threads[-1].start()
+        wait_for(lambda: any(
+            item.subscriptions for item in self.broker.connected_sessions()))
+        return client
+
+    def publish(self, number):
+        for idx in range(0, number):
+            self.broker.publish(
+                'v3/test@tnc/devices/dev-{}/up'.format(idx), b'{}', qos=1)
+
+    def test_ack_after_sync(self):
+        events = []
+        self.run_client(
+            callback=lambda msg: events.append('processed'),
+            sync_callback=lambda: events.append(
+                'sync {}'.format(len(self.broker.acks))))
+        self.publish(3)
+        wait_for(lambda: len(self.broker.acks) == 3)
+        self.assertEqual(self.broker.sessions['test-tnc-0'].inflight, {})
+        # nothing is acknowledged before it has been synced
+        self.assertEqual(events[0:2], ['processed', 'sync 0'])
+        self.assertEqual(self.broker.sessions['test-tnc-0'].subscriptions[
+            'v3/test@tnc/devices/+/up'], 1)
+
+    def test_redelivery(self):
+        crashed = self.client_class()
+        crashed.client.loop_start()
+        wait_for(lambda: any(
+            item.subscriptions for item in self.broker.connected_sessions()))
+        self.publish(1)
+        wait_for(lambda: crashed.inflight)
+        # a crash before the message has been acknowledged
+        crashed.client.loop_stop()
+        crashed.client.socket().close()
+        received = []
+        self.run_client(callback=received.append)
+        wait_for(lambda: len(self.broker.acks) == 1)
+        self.assertEqual(len(received), 1)
+        self.assertTrue(received[0].dup)
+
+    def test_max_inflight(self):
+        release = threading.Event()
+        client = self.run_client(
+            client_class=type('Client', (self.client_class,), {
+                'workers': 1, 'max_inflight': 2}),
+            callback=lambda msg: release.wait(5))
+        self.publish(5)
+        wait_for(lambda: len(client.inflight) == 2)
+        time.sleep(0.2)
+        self.assertEqual(len(client.inflight), 2)
+        self.assertEqual(client.queue_depth(), 1)
+        release.set()
+        wait_for(lambda: len(self.broker.acks) == 5)
@@ -0,0 +1,75 @@
+# pylint:disable=C0115,C0116
+"""
+Test running several applications in one process
+"""
+# standard library
+import os
+import socket
+from unittest import mock
+# project
+from clients.base import multiplex, parsers, writers
+# tests
+from tests.shared import PayloadTestCase, TEST_DIRECTORY
+
+
+APPLICATIONS = [
+    {'client': 'clients.base.mqtt.BaseMQTTClient',
+     'writer': 'clients.base.writers.BaseCSVWriter'},
+    {'client': 'clients.base.mqtt.BaseMQTTClient',
+     'writer': 'clients.base.writers.BaseCSVWriter',
+     'pw_env_var': 'TEST_MQTT_PW'},
+    {'client': 'clients.base.mqtt.BaseMQTTClient',
+     'writer': 'clients.base.writers.BaseAGOWriter',
+     'parser': 'clients.base.parsers.TBS12SParser'}]
+
+
+@mock.patch('clients.base.writers.BaseCSVWriter.template',
+    new=os.path.join(TEST_DIRECTORY, 'test.csv'))
+@mock.patch('clients.base.mqtt.mqtt.Client')
+class TestMultiplexer(PayloadTestCase):
+
+    def get_multiplexer(self):
+        with mock.patch.dict(os.environ, {'TEST_MQTT_PW': 'secret'}):
+            return multiplex.Multiplexer(APPLICATIONS)
+
+    def test_setup(self, client):
+        mux = self.get_multiplexer()
+        self.assertEqual(len(mux.clients), 3)
+        # parsers are shared
+        self.assertIs(mux.writers[0].parser, mux.writers[1].parser)
+        self.assertIsInstance(mux.writers[2].parser, parsers.TBS12SParser)
+        self.assertEqual(
+            mux.clients[0].process_callback, mux.writers[0].add_to_csv)
+        self.assertEqual(
+            mux.clients[2].process_callback, mux.writers[2].add_to_ago)
+        client.return_value.username_pw_set.assert_any_call(
+            '', password='secret')
+
+    def test_loop_once(self, client):
+        mux = self.get_multiplexer()
+        ours, theirs = socket.socketpair()
+        try:
+            mqtt_clients = [mock.Mock() for _ in mux.clients]
+            for item, mqtt_client in zip(mux.clients, mqtt_clients):
+                item.client = mqtt_client
+                mqtt_client.want_write.return_value = False
+            mqtt_clients[0].socket.return_value = ours
+            mqtt_clients[1].socket.return_value = None
+            mqtt_clients[2].socket.return_value = None
+            theirs.send(b'x')
+            mux.loop_once(timeout=0)
+            mqtt_clients[0].loop_read.assert_called_once()
+            mqtt_clients[1].reconnect.assert_called_once()
+            for mqtt_client in mqtt_clients:
+                mqtt_client.loop_misc.assert_called_once()
+            # reconnects are throttled
+            mux.loop_once(timeout=0)
+            mqtt_clients[1].reconnect.assert_called_once()
+        finally:
+            ours.close()
+            theirs.close()
+
+    def test_import_string(self, client):
+        self.assertIs(
+            multiplex.import_string('clients.base.writers.BaseCSVWriter'),
+            writers.BaseCSVWriter)
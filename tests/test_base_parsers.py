@@ -3,13 +3,71 @@
 Test base parsers
 """
 # standard library
-from unittest import TestCase
+import base64
+from datetime import datetime, timedelta
+import io
+import os
+import signal
+import time
+from unittest import mock, TestCase
+# third party
+import pytz
 # project
-from clients.base import parsers
+from clients.base import parsers, storage
 # tests
 from tests.shared import PayloadTestCase
 
 
+# battery voltage, GNSS position and acceleration of a Tektelic tracker, the
+# GNSS item is the example of the Cayenne LPP GPS type
+TEKTELIC_PAYLOAD = bytes.fromhex(
+    '00ff016a' '008806765ff2960a0003e8' '0071fff4000503e8')
+
+
+def reference_local_time(timestring):
+    time = datetime.strptime(timestring.split('.')[0], parsers.TIME_PATTERN)
+    time = time.replace(tzinfo=pytz.UTC).astimezone(parsers.LOCAL_TZ)
+    return time.strftime(parsers.TIME_PATTERN)
+
+
+class TestTimeConversion(TestCase):
+
+    def test_get_local_time(self):
+        # step through both DST transitions of 2021
+        for start in [datetime(2021, 3, 13), datetime(2021, 11, 6)]:
+            for minutes in range(0, 3 * 24 * 60, 17):
+                timestring = (start + timedelta(minutes=minutes)).strftime(
+                    parsers.TIME_PATTERN) + '.124510287Z'
+                self.assertEqual(
+                    parsers.get_local_time(timestring),
+                    reference_local_time(timestring))
+        self.assertEqual(parsers.get_local_time(''), '')
+        self.assertEqual(parsers.get_local_time(None), '')
+
+    def test_parse_utc(self):
+        self.assertEqual(
+            parsers.parse_utc('2021-01-04T23:46:05.124510287Z'),
+            datetime(2021, 1, 4, 23, 46, 5, 124510))
+        self.assertEqual(
+            parsers.parse_utc('2021-01-04T23:46:05.1Z'),
+            datetime(2021, 1, 4, 23, 46, 5, 100000))
+        self.assertEqual(
+            parsers.parse_utc('2021-01-04T23:46:05Z'),
+            datetime(2021, 1, 4, 23, 46, 5))
+        with self.assertRaises(ValueError):
+            parsers.parse_utc('2021-13-04T23:46:05Z')
+
+    def test_convert_device_time(self):
+        self.assertEqual(
+            parsers.convert_device_time('00:01:01:02:30:00'),
+            '2000-01-01 02:30:00')
+        self.assertEqual(
+            parsers.convert_device_time('99:12:31:23:59:00'),
+            '1999-12-31 23:59:00')
+        with self.assertRaises(ValueError):
+            parsers.convert_device_time('21:13:01:02:30:00')
+
+
 class TestBaseParser(PayloadTestCase):
 
     def test_bytes_to_dict(self):
@@ -32,6 +90,34 @@ class TestBaseParser(PayloadTestCase):
             'dev_id': 'tbs-12s-aa0120', 'app_id': 'sci-chi-climate'})
 
 
+    def test_parse_many(self):
+        parser = parsers.TBS12SParser()
+        res = parser.parse_many([self.example_message] * 3)
+        expected = parser.parse(self.example_message)
+        self.assertEqual(set(res), set(expected))
+        for key, value in expected.items():
+            self.assertEqual(res[key], [value] * 3)
+        self.assertEqual(
+            parsers.from_columns(res), [expected] * 3)
+
+    def test_decoded_message(self):
+        parser = parsers.BaseParser()
+        dic = parser.bytes_to_dict(self.example_message.payload)
+        with mock.patch.object(parser, 'bytes_to_dict') as bytes_to_dict:
+            res = parser.parse(storage.DecodedMessage(dic))
+            bytes_to_dict.assert_not_called()
+        self.assertEqual(res, parser.parse(self.example_message))
+
+    def test_columns(self):
+        rows = [{'a': 1}, {'b': 2, 'a': 3}]
+        columns = parsers.to_columns(rows)
+        self.assertEqual(columns, {'a': [1, 3], 'b': [None, 2]})
+        self.assertEqual(
+            parsers.from_columns(columns), [{'a': 1, 'b': None}, {'a': 3, 'b': 2}])
+        self.assertEqual(
+            parsers.from_columns({'a': [None]}), [{'a': None}])
+
+
 class TestTBS12SParser(PayloadTestCase):
 
     def test_get_device_data(self):
@@ -65,6 +151,122 @@ class TestTBS12SParser(PayloadTestCase):
         self.assertEqual(parser.get_device_data(b''), {})
 
 
+class TestSDI12Schema(TestCase):
+    fields = ('w_pressure', 'w_temperature', 'w_level')
+
+    def test_decode(self):
+        decode = parsers.compile_sdi12_schema(self.fields)
+        self.assertIs(decode, parsers.compile_sdi12_schema(self.fields))
+        self.assertEqual(decode('+1.5 -0.25 +3 +4'), {
+            'w_pressure': 1.5, 'w_temperature': -0.25, 'w_level': 3.0})
+        with self.assertRaises(ValueError):
+            decode('+1.5 -0.25')
+
+    def test_parse_many(self):
+        parser = type('Parser', (parsers.TBS12SParser,), {
+            'sensor_fields': self.fields})()
+        dics = [
+            {'measurements': '+1.5 -0.25 +3'}, {'measurements': '+2 +0 -1'}]
+        self.assertEqual(
+            parser.get_sensor_data_many(dics),
+            [parser.get_sensor_data(dic) for dic in dics])
+        self.assertEqual(
+            parsers.TBS12SParser().get_sensor_data_many(dics), [{}, {}])
+
+
+class TestCayenneLPP(TestCase):
+
+    def test_decode_lpp(self):
+        payload = base64.b64decode('AWcAcAJorQMCASY=')
+        self.assertEqual(parsers.decode_lpp(payload), [
+            (1, 103, (11.2,)), (2, 104, (86.5,)), (3, 2, (2.94,))])
+        self.assertEqual(parsers.lpp_to_dict(payload), {
+            'Temperature_1': 11.2, 'Humidity_2': 86.5, 'Analog_Input_3': 2.94})
+        # location with signed 3 byte values
+        self.assertEqual(
+            parsers.decode_lpp(bytes.fromhex('0188f9e3c9001e7effffce')),
+            [(1, 136, (-40.0439, 0.7806, -0.5))])
+
+    def test_invalid_payload(self):
+        for payload in (b'\x01', b'\x01\x67\x00', b'\x01\xff\x00\x00'):
+            with self.assertRaises(ValueError):
+                parsers.lpp_to_dict(payload)
+            with self.assertRaises(ValueError):
+                parsers.decode_lpp(payload)
+
+    def test_parser(self):
+        parser = parsers.CayenneLPPParser()
+        dic = {'device': base64.b64decode('AWcAcAJorQMCASY=')}
+        self.assertEqual(parser.get_sensor_data(dic)['Temperature_1'], 11.2)
+        self.assertEqual(
+            parser.get_sensor_data_many([dic, dic]),
+            [parser.get_sensor_data(dic)] * 2)
+
+
+class TestProfiling(PayloadTestCase):
+
+    def tearDown(self):
+        super().tearDown()
+        parsers.disable_profiling()
+
+    def test_stages(self):
+        parser = parsers.TBS12SParser()
+        expected = parser.parse(self.example_message)
+        profiler = parsers.enable_profiling(signum=None)
+        for _ in range(0, 3):
+            self.assertEqual(parser.parse(self.example_message), expected)
+        self.assertEqual(
+            sorted(stage for name, stage in profiler.timings), sorted(
+                parsers.StageProfiler.stages + ('parse',)))
+        self.assertEqual(profiler.timings[('TBS12SParser', 'parse')][0], 3)
+        summary = profiler.summary()
+        self.assertIn('TBS12SParser', summary)
+        self.assertNotIn('cumulative', summary)
+
+    def test_overridden_stage(self):
+        parser_class = type('Parser', (parsers.TBS12SParser,), {
+            'parse_device': lambda self, dic: dict(
+                self.get_device_data(b'PB00:01:01:02:30:00 2.66'),
+                dev_id='dev')})
+        profiler = parsers.enable_profiling(signum=None)
+        ret = parser_class().parse(self.example_message)
+        self.assertEqual(ret['battery_voltage'], 2.66)
+        self.assertEqual(ret['dev_id'], 'dev')
+        self.assertEqual(
+            sorted(stage for name, stage in profiler.timings), [
+                'get_device_data', 'message_to_dict', 'parse',
+                'sensor_condition'])
+
+    def test_dump_while_recording(self):
+        profiler = parsers.enable_profiling(signum=None)
+        parsers.BaseParser().parse(self.example_message)
+        with mock.patch('sys.stdout', new=io.StringIO()) as stdout:
+            with profiler.lock:
+                # a signal arriving while the lock is held
+                thread = profiler.dump_in_background()
+            thread.join(5)
+        self.assertIn('BaseParser', stdout.getvalue())
+
+    def test_cprofile(self):
+        profiler = parsers.enable_profiling(cprofile=True, signum=None)
+        parsers.BaseParser().parse(self.example_message)
+        self.assertIn('get_lorawan_metadata', profiler.summary())
+
+    def test_signal(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            parsers.enable_profiling()
+            parsers.BaseParser().parse(self.example_message)
+            with mock.patch('sys.stdout', new=io.StringIO()) as stdout:
+                os.kill(os.getpid(), signal.SIGUSR1)
+                end = time.monotonic() + 5
+                while 'BaseParser' not in stdout.getvalue():
+                    self.assertLess(time.monotonic(), end)
+                    time.sleep(0.01)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+
 class TestTektelicParser(TestCase):
 
     def test_convert_bytestring_to_hexrepresentation(self):
@@ -76,7 +278,30 @@ class TestTektelicParser(TestCase):
             '10 11 12')
 
     def test_parse_device_message(self):
-        test_message = ''
+        parser = parsers.TektelicTrackerParser()
+        ret = parser.get_device_data(TEKTELIC_PAYLOAD)
+        self.assertEqual(ret, {
+            'battery_voltage': 3.62, 'lat': 42.3519, 'lon': -87.9094,
+            'altitude': 10.0, 'acceleration_x': -0.012,
+            'acceleration_y': 0.005, 'acceleration_z': 1.0,
+            'device': TEKTELIC_PAYLOAD.hex(' ')})
+        # the GNSS item decodes like a Cayenne LPP GPS item
+        self.assertEqual(
+            parsers.decode_lpp(TEKTELIC_PAYLOAD[4:15]),
+            [(0, 136, (ret['lat'], ret['lon'], ret['altitude']))])
+
+    def test_unknown_items(self):
+        parser = parsers.TektelicTrackerParser()
+        # an unknown item after battery and position, truncated items
+        for payload, expected in (
+                (TEKTELIC_PAYLOAD[0:15] + b'\x07\x07\x00\x00', 4),
+                (b'\x00\x88\x00', 0), (b'\x00', 0)):
+            ret = parser.get_device_data(payload)
+            self.assertEqual(ret.pop('device'), payload.hex(' '))
+            self.assertEqual(len(ret), expected)
+        self.assertEqual(
+            parsers.decode_tektelic(TEKTELIC_PAYLOAD[0:15] + b'\x07\x07'),
+            parsers.decode_tektelic(TEKTELIC_PAYLOAD[0:15]))
 
 
 class TestFeatherTrackerParser(PayloadTestCase):
@@ -91,7 +316,8 @@ class TestFeatherTrackerParser(PayloadTestCase):
         time = '2021-02-25T23:33:39.307001320Z'
         parser = parsers.FeatherTrackerParser()
         res = parser.get_time(time)
-        print(res)
+        self.assertEqual(res, '2021-02-25 15:33:39')
+        self.assertIsNone(parser.get_time(None))
 
     #def test_get_device_data(self):
     #    payload = b'-122.27557, 37.84182,2021-02-05 21:03:20\x00\x00'
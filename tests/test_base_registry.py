@@ -0,0 +1,90 @@
+# pylint:disable=C0115,C0116
+"""
+Test the application registry
+"""
+# standard library
+import json
+import importlib.util
+import os
+from unittest import mock, skipUnless
+# project
+from clients.base import parsers, registry, writers
+from clients import __main__ as entry_point
+# tests
+from tests.shared import PayloadTestCase, TEST_DIRECTORY
+
+
+APPLICATIONS = {
+    'sci-chi-climate': {
+        'parser': 'clients.base.parsers.TBS12SParser',
+        'header': ['received_at', 'dev_id'],
+        'output': os.path.join(TEST_DIRECTORY, 'sci_chi.csv'),
+        'options': {'max_lines': 100}},
+    'disabled-app': {
+        'enabled': False,
+        'parser': 'clients.does_not_exist.Parser'}}
+
+
+@mock.patch('clients.base.mqtt.mqtt.Client')
+class TestRegistry(PayloadTestCase):
+
+    def test_load_json(self, client):
+        path = os.path.join(TEST_DIRECTORY, 'registry.json')
+        with open(path, 'w') as filehandle:
+            json.dump({'applications': APPLICATIONS}, filehandle)
+        self.assertEqual(registry.load_registry(path), APPLICATIONS)
+
+    @skipUnless(importlib.util.find_spec('yaml'), 'requires PyYAML')
+    def test_load_yaml(self, client):
+        path = os.path.join(TEST_DIRECTORY, 'registry.yaml')
+        with open(path, 'w') as filehandle:
+            filehandle.write(
+                'applications:\n  sci-chi-climate:\n'
+                '    parser: clients.base.parsers.TBS12SParser\n')
+        self.assertEqual(registry.load_registry(path), {
+            'sci-chi-climate': {'parser': 'clients.base.parsers.TBS12SParser'}})
+
+    def test_build_classes(self, client):
+        settings = APPLICATIONS['sci-chi-climate']
+        client_class = registry.build_client_class('sci-chi-climate', settings)
+        self.assertEqual(client_class.__name__, 'SciChiClimateClient')
+        self.assertEqual(client_class.username, 'sci-chi-climate@tnc')
+        self.assertEqual(
+            client_class.topic, 'v3/sci-chi-climate@tnc/devices/+/up')
+        self.assertEqual(client_class.host, registry.DEFAULT_HOST)
+        writer_class = registry.build_writer_class('sci-chi-climate', settings)
+        self.assertTrue(issubclass(writer_class, writers.BaseCSVWriter))
+        self.assertIs(writer_class.parser_class, parsers.TBS12SParser)
+        self.assertEqual(writer_class.header, ('received_at', 'dev_id'))
+        self.assertEqual(writer_class.max_lines, 100)
+
+    def test_sensor_fields(self, client):
+        writer_class = registry.build_writer_class('sci-wells', {
+            'parser': 'clients.base.parsers.TBS12SParser',
+            'sensor_fields': ['air_temp', 'rel_humidity']})
+        parser = writer_class.parser_class()
+        self.assertIsInstance(parser, parsers.TBS12SParser)
+        self.assertEqual(parser.get_sensor_data({'measurements': '+1.5 -2'}),
+            {'air_temp': 1.5, 'rel_humidity': -2.0})
+
+    def test_create_multiplexer(self, client):
+        # the disabled application is never imported
+        mux = registry.create_multiplexer(APPLICATIONS)
+        self.assertEqual(len(mux.clients), 1)
+        mux.clients[0].on_message(None, None, self.example_message)
+        with open(APPLICATIONS['sci-chi-climate']['output']) as filehandle:
+            self.assertEqual(filehandle.read(), (
+                'received_at,dev_id\n'
+                '2021-01-04T23:46:05.124510287Z,tbs-12s-aa0120\n'))
+
+    def test_only(self, client):
+        mux = registry.create_multiplexer(APPLICATIONS, only=['other'])
+        self.assertEqual(mux.clients, [])
+
+    @mock.patch('clients.base.multiplex.Multiplexer.run')
+    def test_main(self, run, client):
+        path = os.path.join(TEST_DIRECTORY, 'registry.json')
+        with open(path, 'w') as filehandle:
+            json.dump({'applications': APPLICATIONS}, filehandle)
+        entry_point.main([path, 'sci-chi-climate'])
+        run.assert_called_once()
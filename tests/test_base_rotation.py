@@ -0,0 +1,76 @@
+# pylint:disable=C0115,C0116
+"""
+Test file rotation
+"""
+# standard library
+from datetime import datetime, timedelta
+import gzip
+import os
+# project
+from clients.base import rotation
+# tests
+from tests.shared import PayloadTestCase, TEST_DIRECTORY
+
+
+class TestRotationManager(PayloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(TEST_DIRECTORY, 'test.csv')
+        self.today = datetime.strftime(datetime.utcnow(), '%Y_%m_%d')
+
+    def touch(self, path):
+        open(path, 'w').close()
+
+    def test_more_than_ten_rotations(self):
+        manager = rotation.RotationManager()
+        for idx in range(0, 12):
+            self.touch(self.path)
+            self.assertEqual(manager.rotate(self.path), os.path.join(
+                TEST_DIRECTORY, 'test_{}_{}.csv'.format(self.today, idx)))
+        self.assertEqual(len(os.listdir(TEST_DIRECTORY)), 12)
+
+    def test_scan_index(self):
+        for idx in [0, 1, 11]:
+            self.touch(os.path.join(
+                TEST_DIRECTORY, 'test_{}_{}.csv'.format(self.today, idx)))
+        self.touch(os.path.join(TEST_DIRECTORY, 'other_{}_20.csv'.format(
+            self.today)))
+        manager = rotation.RotationManager()
+        self.assertEqual(manager.get_rotation_path(self.path), os.path.join(
+            TEST_DIRECTORY, 'test_{}_12.csv'.format(self.today)))
+
+    def test_time_based(self):
+        manager = rotation.RotationManager(every='hourly')
+        self.assertFalse(manager.is_due(self.path))
+        self.touch(self.path)
+        last_hour = datetime.utcnow() - timedelta(hours=1)
+        manager.current_period = manager.get_period(last_hour)
+        self.assertTrue(manager.is_due(self.path))
+        self.assertEqual(manager.rotate(self.path), os.path.join(
+            TEST_DIRECTORY, 'test_{}_0.csv'.format(
+                last_hour.strftime('%Y_%m_%d_%H'))))
+        self.assertFalse(manager.is_due(self.path))
+
+    def test_existing_file_period(self):
+        self.touch(self.path)
+        yesterday = datetime.now() - timedelta(days=1)
+        os.utime(self.path, (yesterday.timestamp(), yesterday.timestamp()))
+        self.assertTrue(rotation.RotationManager(every='daily').is_due(
+            self.path))
+
+    def test_compress(self):
+        manager = rotation.RotationManager(compress=True)
+        with open(self.path, 'w') as filehandle:
+            filehandle.write('a,b\n')
+        new_path = manager.rotate(self.path)
+        rotation.COMPRESSOR.submit(lambda: None).result()
+        self.assertFalse(os.path.isfile(new_path))
+        with gzip.open(new_path + '.gz', 'rt') as filehandle:
+            self.assertEqual(filehandle.read(), 'a,b\n')
+        # compressed files count for the next index
+        self.assertTrue(manager.get_rotation_path(self.path).endswith('_1.csv'))
+
+    def test_unknown_period(self):
+        with self.assertRaises(ValueError):
+            rotation.RotationManager(every='weekly')
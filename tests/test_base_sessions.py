@@ -0,0 +1,55 @@
+# pylint:disable=C0115,C0116
+"""
+Test the shared HTTP session
+"""
+# standard library
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from unittest import TestCase
+# project
+from clients.base import sessions
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    failures = []
+
+    def do_GET(self):
+        status = 503 if self.failures and self.failures.pop() else 200
+        body = b'{}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessions(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        sessions.configure(backoff_factor=0)
+        sessions.STATS.clear()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        for _ in range(0, 5):
+            self.assertEqual(sessions.get(self.url).status_code, 200)
+        self.assertEqual(sessions.connection_stats()['127.0.0.1'], {
+            'requests': 5, 'connections': 1, 'reused': 4})
+
+    def test_retry(self):
+        Handler.failures[:] = [True, True]
+        self.assertEqual(sessions.get(self.url).status_code, 200)
+        self.assertEqual(
+            sessions.connection_stats()['127.0.0.1']['requests'], 3)
+
+    def test_shared_session(self):
+        self.assertIs(sessions.get_session(), sessions.get_session())
@@ -0,0 +1,43 @@
+# pylint:disable=C0115,C0116
+"""
+Test the spool of undelivered records
+"""
+# standard library
+import os
+# project
+from clients.base import spool
+# tests
+from tests.shared import PayloadTestCase, TEST_DIRECTORY
+
+
+class TestSpool(PayloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spool = spool.Spool(os.path.join(TEST_DIRECTORY, 'spool'))
+
+    def test_put(self):
+        self.assertIsNone(self.spool.put([]))
+        for idx in range(0, 3):
+            self.spool.put([{'idx': idx}])
+        self.assertEqual(len(self.spool), 3)
+        self.assertEqual(
+            [self.spool.read(path) for path in self.spool.get_files()],
+            [[{'idx': 0}], [{'idx': 1}], [{'idx': 2}]])
+
+    def test_replay(self):
+        for idx in range(0, 3):
+            self.spool.put([{'idx': idx}])
+        sent = []
+
+        def send(records):
+            sent.extend(records)
+            return len(sent) < 2
+
+        self.assertEqual(self.spool.replay(send), 1)
+        # the failed batch is kept and replaying stops
+        self.assertEqual(sent, [{'idx': 0}, {'idx': 1}])
+        self.assertEqual(len(self.spool), 2)
+        self.assertEqual(self.spool.replay(lambda records: True, limit=1), 1)
+        self.assertEqual(self.spool.replay(lambda records: True), 1)
+        self.assertEqual(len(self.spool), 0)
@@ -0,0 +1,223 @@
+# pylint:disable=C0115,C0116
+"""
+Test the storage API reader
+"""
+# standard library
+from datetime import datetime, timedelta
+import json
+from types import SimpleNamespace
+import os
+from unittest import mock, TestCase
+# third party
+import requests
+# project
+from clients.base import storage
+# tests
+from tests.shared import PayloadTestCase, TEST_DIRECTORY
+
+
+def make_response(records):
+    return SimpleNamespace(status_code=200, text='\n'.join(
+        json.dumps({'result': record}) for record in records) + '\n')
+
+
+class StreamedResponse():
+    status_code = 200
+
+    def __init__(self, records, fail_after=None):
+        self.records = records
+        self.fail_after = fail_after
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+    def iter_lines(self):
+        for idx, record in enumerate(self.records):
+            if idx == self.fail_after:
+                raise requests.ConnectionError('connection lost')
+            yield json.dumps({'result': record}).encode('utf-8')
+        yield b''
+
+
+@mock.patch('clients.base.sessions.get')
+class TestStorageReader(TestCase):
+
+    def setUp(self):
+        self.reader_class = type('Reader', (storage.StorageReader,), {
+            'url': 'http://test',
+            'start': datetime.utcnow() - timedelta(hours=36)})
+
+    def test_record_generator(self, get):
+        get.return_value = make_response([{'a': 1}, {'a': 2}])
+        res = list(self.reader_class(password='x').record_generator())
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(len(res), 4)
+        self.assertEqual(json.loads(res[0].payload), {'a': 1})
+
+    def test_parallel_order(self, get):
+        def fake_get(url, headers=None, params=None):
+            return make_response([{'after': params['after']}])
+
+        get.side_effect = fake_get
+        reader_class = type('Reader', (self.reader_class,), {
+            'workers': 4,
+            'start': datetime.utcnow() - timedelta(days=9, hours=12)})
+        res = [
+            json.loads(item.payload)['after']
+            for item in reader_class(password='x').record_generator()]
+        self.assertEqual(len(res), 10)
+        self.assertEqual(res, sorted(res))
+
+    def test_retry(self, get):
+        get.side_effect = [
+            SimpleNamespace(status_code=500, text='error'),
+            make_response([{'a': 1}]), make_response([{'a': 2}])]
+        reader_class = type('Reader', (self.reader_class,), {
+            'backoff_factor': 0})
+        res = list(reader_class(password='x').record_generator())
+        self.assertEqual(len(res), 2)
+        self.assertEqual(get.call_count, 3)
+
+    def test_give_up(self, get):
+        get.return_value = SimpleNamespace(status_code=500, text='error')
+        reader_class = type('Reader', (self.reader_class,), {
+            'backoff_factor': 0, 'max_retries': 2})
+        self.assertEqual(list(reader_class(password='x').record_generator()), [])
+        self.assertEqual(get.call_count, 3)
+
+    def test_adapt_window(self, get):
+        reader = type('Reader', (self.reader_class,), {
+            'target_records': 100})(password='x')
+        day = timedelta(days=1)
+        self.assertEqual(reader.adapt_window(day, 50, day), 2 * day)
+        self.assertEqual(reader.adapt_window(day, 400, day), day / 4)
+        self.assertEqual(reader.adapt_window(day, 0, day), 2 * day)
+        self.assertEqual(
+            reader.adapt_window(day, 10 ** 6, day), reader.min_window)
+        self.assertEqual(
+            reader.adapt_window(5 * day, 0, day), reader.max_window)
+
+    def test_batch_callback(self, get):
+        get.return_value = make_response([{'a': 1}, {'a': 2}])
+        pages = []
+        self.reader_class(password='x', batch_callback=pages.append).run()
+        self.assertEqual([len(page) for page in pages], [2, 2])
+
+    def test_streaming(self, get):
+        get.return_value = StreamedResponse([{'a': idx} for idx in range(5)])
+        reader_class = type('Reader', (self.reader_class,), {
+            'streaming': True, 'page_size': 2})
+        pages = list(reader_class(password='x').page_generator())
+        self.assertEqual([len(page) for page in pages], [2, 2, 1, 2, 2, 1])
+        self.assertEqual(pages[0][1].dic, {'a': 1})
+        self.assertEqual(json.loads(pages[0][1].payload), {'a': 1})
+        self.assertTrue(get.call_args[1]['stream'])
+
+    def test_streaming_resume(self, get):
+        records = [{'a': idx} for idx in range(5)]
+        get.side_effect = [
+            StreamedResponse(records, fail_after=3), StreamedResponse(records),
+            StreamedResponse([])]
+        reader_class = type('Reader', (self.reader_class,), {
+            'streaming': True, 'page_size': 2, 'backoff_factor': 0})
+        res = [
+            item.dic['a']
+            for item in reader_class(password='x').record_generator()]
+        self.assertEqual(res, [0, 1, 2, 3, 4])
+
+    def test_streaming_closes_responses(self, get):
+        records = [{'a': idx} for idx in range(5)]
+        responses = [
+            StreamedResponse(records, fail_after=3), StreamedResponse(records)]
+        get.side_effect = responses
+        reader_class = type('Reader', (self.reader_class,), {
+            'streaming': True, 'page_size': 2, 'backoff_factor': 0})
+        pages = reader_class(password='x').page_generator()
+        self.assertEqual(len(next(pages)), 2)
+        self.assertEqual(len(next(pages)), 2)
+        # the first response failed, stop while reading the second
+        pages.close()
+        self.assertEqual([item.closed for item in responses], [True, True])
+
+
+def make_record(received_at, uid):
+    return {
+        'received_at': received_at,
+        'correlation_ids': ['as:up:{}'.format(uid), 'gs:conn:x']}
+
+
+@mock.patch('clients.base.sessions.get')
+class TestCheckpoint(PayloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = datetime.utcnow()
+        self.times = [
+            (now - timedelta(hours=hours)).strftime('%Y-%m-%dT%H:%M:%S')
+            for hours in [30, 20]]
+        self.reader_class = type('Reader', (storage.StorageReader,), {
+            'url': 'http://test', 'start': now - timedelta(days=2),
+            'checkpoint_path': os.path.join(TEST_DIRECTORY, 'checkpoint')})
+
+    def test_resume(self, get):
+        get.return_value = make_response([
+            make_record(self.times[0] + '.1Z', 1),
+            make_record(self.times[1] + '.1Z', 2),
+            make_record(self.times[1] + '.2Z', 3)])
+        processed = []
+        reader = self.reader_class(password='x', callback=processed.append)
+        self.assertIsNone(reader.checkpoint)
+        reader.run()
+        self.assertEqual(reader.checkpoint, {
+            'received_at': self.times[1] + '.2Z',
+            'correlation_ids': {'as:up:2', 'as:up:3'}})
+        # a new run starts at the last second and skips processed records
+        get.return_value = make_response([
+            make_record(self.times[1] + '.1Z', 2),
+            make_record(self.times[1] + '.2Z', 3),
+            make_record(self.times[1] + '.3Z', 4)])
+        processed = []
+        reader = self.reader_class(password='x', callback=processed.append)
+        self.assertEqual(
+            reader.start, datetime.fromisoformat(self.times[1]))
+        reader.run()
+        self.assertEqual(
+            [storage.get_record_id(item.dic) for item in processed],
+            ['as:up:4'])
+
+    def test_sync_before_checkpoint(self, get):
+        get.return_value = make_response([make_record(self.times[0], 1)])
+        events = []
+        path = self.reader_class.checkpoint_path
+        self.reader_class(
+            password='x', batch_callback=lambda page: events.append('page'),
+            sync_callback=lambda: events.append(
+                'sync {}'.format(os.path.isfile(path)))).run()
+        self.assertEqual(events[0:2], ['page', 'sync False'])
+        self.assertTrue(os.path.isfile(path))
+
+    def test_no_checkpoint_on_sync_failure(self, get):
+        get.return_value = make_response([make_record(self.times[0], 1)])
+
+        def fail():
+            raise OSError('disk full')
+
+        with mock.patch('traceback.print_exc'):
+            self.reader_class(
+                password='x', batch_callback=lambda page: None,
+                sync_callback=fail).run()
+        self.assertFalse(os.path.isfile(self.reader_class.checkpoint_path))
+
+    def test_no_checkpoint_on_failure(self, get):
+        get.return_value = make_response([make_record(self.times[0], 1)])
+
+        def fail(page):
+            raise ValueError('failed')
+
+        with mock.patch('traceback.print_exc'):
+            self.reader_class(password='x', batch_callback=fail).run()
+        self.assertFalse(os.path.isfile(self.reader_class.checkpoint_path))
@@ -3,11 +3,22 @@
 Test base writer classes
 """
 # standard library
+import base64
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib.util
+import json
 import os
-from unittest import mock
+import socket
+import threading
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs
+# third party
+import requests
 # project
-from clients.base import writers
+from clients.base import ago, parsers, sessions, writers
+from clients import tti_sci_chi
 # tests
 from tests.shared import PayloadTestCase, TEST_DIRECTORY
 
@@ -59,6 +70,62 @@ class TestBaseCSVWriter(PayloadTestCase):
             sum([1 for item in open(os.path.join(TEST_DIRECTORY, res[-1]))]),
             22)
 
+    def test_parser_reuse(self):
+        writer = writers.BaseCSVWriter()
+        parser = writer.parser
+        with mock.patch.object(
+                parser, 'parse', wraps=parser.parse) as parse:
+            writer.add_to_csv(self.example_message)
+            writer.add_to_csv(self.example_message)
+        self.assertEqual(parse.call_count, 2)
+        self.assertIs(writer.parser, parser)
+
+    @mock.patch.multiple('clients.base.writers.BaseCSVWriter',
+        header=['rssi', 'dev_id'], max_lines=20)
+    def test_add_many_to_csv(self):
+        writer = writers.BaseCSVWriter()
+        writer.add_many_to_csv([self.example_message] * 50)
+        res = sorted(os.listdir(TEST_DIRECTORY))
+        self.assertEqual(len(res), 3)
+        with open(writer.get_path()) as filehandle:
+            self.assertEqual(
+                filehandle.read(),
+                'rssi,dev_id\n' + '-51,tbs-12s-aa0120\n' * 8)
+        with open(os.path.join(TEST_DIRECTORY, res[1])) as filehandle:
+            self.assertEqual(len(filehandle.readlines()), 22)
+
+    @mock.patch('clients.base.writers.BaseCSVWriter.header',
+        new=['rssi', 'empty', 'extra', 'dev_id'])
+    def test_add_many_same_as_add(self):
+        writer = writers.BaseCSVWriter()
+        parse_device = writer.parser.parse_device
+        calls = []
+
+        def fake_parse_device(dic):
+            # every second message has a field the other one lacks
+            calls.append(dic)
+            extra = {} if len(calls) % 2 else {'extra': 1}
+            return dict(parse_device(dic), empty=None, **extra)
+
+        messages = [self.example_message] * 2
+        with mock.patch.object(
+                writer.parser, 'parse_device', side_effect=fake_parse_device):
+            for msg in messages:
+                writer.add_to_csv(msg)
+            writer.add_many_to_csv(messages)
+        with open(writer.get_path()) as filehandle:
+            self.assertEqual(
+                filehandle.read(), 'rssi,empty,extra,dev_id\n' + (
+                    '-51,None,,tbs-12s-aa0120\n'
+                    '-51,None,1,tbs-12s-aa0120\n') * 2)
+
+    @mock.patch('clients.base.writers.BaseCSVWriter.header', new=['a', 'b'])
+    def test_add_block(self):
+        writer = writers.BaseCSVWriter()
+        writer.add_block(parsers.to_columns([{'a': 1}, {'a': 2, 'b': 3}]))
+        with open(writer.get_path()) as filehandle:
+            self.assertEqual(filehandle.read(), 'a,b\n1,\n2,3\n')
+
     @mock.patch('clients.base.writers.BaseCSVWriter.get_path')
     def test_count_lines(self, get_path):
         test_file = os.path.join(TEST_DIRECTORY, 'line_count.txt')
@@ -85,6 +152,26 @@ class TestBaseCSVWriter(PayloadTestCase):
                 TEST_DIRECTORY, 'test_{}_{}.csv'.format(today, item))
             self.assertEqual(writer.get_rotation_path(), expected)
 
+    @mock.patch('clients.base.writers.BaseCSVWriter.max_lines', new=3)
+    def test_line_index(self):
+        writer = writers.BaseCSVWriter()
+        writer.add_to_csv(self.example_message)
+        writer.add_to_csv(self.example_message)
+        self.assertEqual(writer.line_count, 2)
+        writer.close()
+        writer = writers.BaseCSVWriter()
+        with mock.patch(
+                'clients.base.writers.BaseCSVWriter.count_lines') as count:
+            writer.check_lines()
+            count.assert_not_called()
+        self.assertEqual(writer.line_count, 2)
+        # the index is ignored once the file has been changed elsewhere
+        with open(writer.get_path(), 'a') as filehandle:
+            filehandle.write('\n')
+        writer = writers.BaseCSVWriter()
+        writer.check_lines()
+        self.assertEqual(writer.line_count, 3)
+
     @mock.patch('clients.base.writers.BaseCSVWriter.max_lines', new=3)
     @mock.patch('clients.base.writers.BaseCSVWriter.get_path')
     def test_check_lines(self, get_path):
@@ -100,3 +187,473 @@ class TestBaseCSVWriter(PayloadTestCase):
         self.assertEqual(
             os.path.join(TEST_DIRECTORY, os.listdir(TEST_DIRECTORY)[0]),
             os.path.join(TEST_DIRECTORY, 'test_'+ today + '_0.csv'))
+
+
+@mock.patch.multiple('clients.base.writers.BaseCSVWriter',
+    template=os.path.join(TEST_DIRECTORY, 'test.csv'),
+    header=['rssi', 'dev_id'], persistent=True)
+class TestPersistentCSVWriter(PayloadTestCase):
+
+    def read(self, path):
+        with open(path) as filehandle:
+            return filehandle.read()
+
+    def test_buffered(self):
+        writer = writers.BaseCSVWriter()
+        for _ in range(0, 3):
+            writer.add_to_csv(self.example_message)
+        self.assertEqual(len(writer.pending), 3)
+        self.assertEqual(self.read(writer.get_path()), 'rssi,dev_id\n')
+        writer.close()
+        self.assertEqual(
+            self.read(writer.get_path()),
+            'rssi,dev_id\n' + '-51,tbs-12s-aa0120\n' * 3)
+
+    @mock.patch('clients.base.writers.BaseCSVWriter.flush_bytes', new=1)
+    def test_flush_bytes(self):
+        writer = writers.BaseCSVWriter()
+        writer.add_to_csv(self.example_message)
+        self.assertEqual(writer.pending, [])
+        self.assertEqual(
+            self.read(writer.get_path()), 'rssi,dev_id\n-51,tbs-12s-aa0120\n')
+        writer.close()
+
+    def test_reopen_after_move(self):
+        writer = writers.BaseCSVWriter()
+        writer.add_to_csv(self.example_message)
+        writer.flush()
+        os.rename(writer.get_path(), writer.get_path() + '.old')
+        writer.add_to_csv(self.example_message)
+        writer.close()
+        self.assertEqual(
+            self.read(writer.get_path()), 'rssi,dev_id\n-51,tbs-12s-aa0120\n')
+
+    @mock.patch('clients.base.writers.BaseCSVWriter.max_lines', new=20)
+    def test_max_lines(self):
+        writer = writers.BaseCSVWriter()
+        for _ in range(0, 100):
+            writer.add_to_csv(self.example_message)
+        writer.close()
+        res = [
+            item for item in os.listdir(TEST_DIRECTORY)
+            if not item.startswith('.')]
+        self.assertEqual(len(res), 5)
+        self.assertEqual(
+            sum([len(self.read(os.path.join(TEST_DIRECTORY, item)).split('\n'))
+            for item in res]), 100 + 5 * 2)
+
+
+@mock.patch('clients.base.writers.BaseAGOWriter.parser_class',
+    new=parsers.FeatherTrackerParser)
+@mock.patch('clients.base.ago.FeatureService.post_records')
+class TestBaseAGOWriter(PayloadTestCase):
+    example_payload = 'oyster_example_payload.txt'
+
+    def test_unbuffered(self, post_records):
+        post_records.return_value = {'addResults': [{'success': True}]}
+        writer = writers.BaseAGOWriter()
+        writer.add_to_ago(self.example_message)
+        self.assertEqual(post_records.call_count, 1)
+        self.assertEqual(len(post_records.call_args[0][0]), 1)
+        self.assertEqual(writer.buffer, [])
+
+    @mock.patch('clients.base.writers.BaseAGOWriter.batch_size', new=3)
+    def test_buffered(self, post_records):
+        post_records.return_value = {'addResults': [
+            {'success': True}, {'success': False}, {'success': True}]}
+        writer = writers.BaseAGOWriter()
+        for _ in range(0, 2):
+            writer.add_to_ago(self.example_message)
+        post_records.assert_not_called()
+        writer.add_to_ago(self.example_message)
+        self.assertEqual(post_records.call_count, 1)
+        self.assertEqual(len(post_records.call_args[0][0]), 3)
+        self.assertEqual(writer.results[1], {'success': False})
+        # the failed record is re-queued
+        self.assertEqual(len(writer.buffer), 1)
+        self.assertEqual(writer.buffer[0][1], 1)
+        post_records.return_value = {'addResults': [{'success': True}]}
+        self.assertEqual(writer.flush(), [{'success': True}])
+        self.assertEqual(writer.buffer, [])
+
+    @mock.patch.multiple('clients.base.writers.BaseAGOWriter',
+        batch_size=10, max_attempts=2)
+    def test_request_failure(self, post_records):
+        post_records.return_value = {'error': {'code': 500}}
+        writer = writers.BaseAGOWriter()
+        writer.add_to_ago(self.example_message)
+        writer.flush()
+        self.assertEqual(len(writer.buffer), 1)
+        writer.flush()
+        # dropped after max_attempts
+        self.assertEqual(writer.buffer, [])
+
+    @mock.patch.multiple('clients.base.writers.BaseAGOWriter',
+        batch_size=10, max_attempts=1)
+    def test_sync(self, post_records):
+        post_records.return_value = {'error': {'code': 500}}
+        writer = writers.BaseAGOWriter()
+        writer.add_to_ago(self.example_message)
+        writer.flush()
+        self.assertEqual(writer.lost, 1)
+        with self.assertRaises(IOError):
+            writer.sync()
+        # reported once
+        writer.sync()
+        # kept from now on
+        writer.add_to_ago(self.example_message)
+        with self.assertRaises(IOError):
+            writer.sync()
+        self.assertEqual(writer.lost, 0)
+        self.assertEqual(len(writer.buffer), 1)
+        post_records.return_value = {'addResults': [{'success': True}]}
+        writer.sync()
+        self.assertEqual(writer.buffer, [])
+
+    @mock.patch('clients.base.writers.BaseAGOWriter.batch_size', new=10)
+    def test_connection_error(self, post_records):
+        post_records.side_effect = requests.ConnectionError('refused')
+        writer = writers.BaseAGOWriter()
+        writer.add_to_ago(self.example_message)
+        writer.flush()
+        # re-queued instead of lost
+        self.assertEqual(len(writer.buffer), 1)
+        self.assertEqual(writer.buffer[0][1], 1)
+        post_records.side_effect = ValueError('unexpected')
+        with mock.patch('traceback.print_exc') as print_exc:
+            writer.flush_in_background()
+        print_exc.assert_called_once_with()
+        self.assertEqual(len(writer.buffer), 1)
+        # nothing left for the atexit flush
+        writer.buffer = []
+
+    @mock.patch.multiple('clients.base.writers.BaseAGOWriter',
+        batch_size=10, max_batch_age=0)
+    def test_max_batch_age(self, post_records):
+        post_records.return_value = {'addResults': [{'success': True}]}
+        writer = writers.BaseAGOWriter()
+        writer.add_to_ago(self.example_message)
+        self.assertEqual(post_records.call_count, 1)
+
+
+@mock.patch('clients.base.writers.BaseAGOWriter.parser_class',
+    new=parsers.TektelicTrackerParser)
+@mock.patch('clients.base.ago.FeatureService.post_records')
+class TestTektelicAGOWriter(PayloadTestCase):
+    example_payload = 'oyster_example_payload.txt'
+
+    def get_message(self, payload):
+        dic = json.loads(self.example_message.payload)
+        dic['uplink_message']['frm_payload'] = base64.b64encode(
+            payload).decode('utf-8')
+        return SimpleNamespace(payload=json.dumps(dic).encode('utf-8'))
+
+    def test_position(self, post_records):
+        post_records.return_value = {'addResults': [{'success': True}]}
+        writer = writers.BaseAGOWriter()
+        writer.add_to_ago(self.get_message(
+            # followed by an item type the decoder does not know
+            bytes.fromhex('008806765ff2960a0003e8' '0a0b0c')))
+        record = post_records.call_args[0][0][0]
+        self.assertEqual(record['geometry']['x'], -87.9094)
+        self.assertEqual(record['geometry']['y'], 42.3519)
+        self.assertNotIn('lat', record['attributes'])
+
+    def test_no_position(self, post_records):
+        writer = writers.BaseAGOWriter()
+        writer.add_to_ago(self.get_message(b'\x00\xff\x01\x6a'))
+        post_records.assert_not_called()
+
+
+class FakeAGOHandler(BaseHTTPRequestHandler):
+    """
+    Serves tokens and addFeatures, answers 503 while down is set
+    """
+    protocol_version = 'HTTP/1.1'
+    down = threading.Event()
+    features = []
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = parse_qs(self.rfile.read(length).decode('utf-8'))
+        status = 200
+        if self.path.startswith('/token'):
+            body = {'access_token': 'abc', 'expires_in': 7200}
+        elif self.down.is_set():
+            status, body = 503, {'error': {'code': 503}}
+        else:
+            records = json.loads(data['features'][0])
+            self.features.extend(records)
+            body = {'addResults': [{'success': True}] * len(records)}
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@mock.patch('clients.base.writers.BaseAGOWriter.parser_class',
+    new=parsers.FeatherTrackerParser)
+class TestAGOSpool(PayloadTestCase):
+    example_payload = 'oyster_example_payload.txt'
+
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAGOHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        FakeAGOHandler.features.clear()
+        ago.TokenStore.tokens.clear()
+
+    def tearDown(self):
+        FakeAGOHandler.down.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_spool_and_replay(self):
+        writer_class = type('Writer', (writers.BaseAGOWriter,), {
+            'feature_service': self.url + 'feature',
+            'spool_path': os.path.join(TEST_DIRECTORY, 'spool'),
+            'max_attempts': 1})
+        with mock.patch('clients.base.ago.TOKEN_URL', self.url + 'token/'):
+            writer = writer_class()
+            FakeAGOHandler.down.set()
+            writer.add_to_ago(self.example_message)
+            writer.add_to_ago(self.example_message)
+            self.assertEqual(len(writer.spool), 2)
+            self.assertEqual(FakeAGOHandler.features, [])
+            FakeAGOHandler.down.clear()
+            writer.add_to_ago(self.example_message)
+        self.assertEqual(len(writer.spool), 0)
+        self.assertEqual(len(FakeAGOHandler.features), 3)
+
+
+    def test_unreachable(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        refused = 'http://127.0.0.1:{}/'.format(sock.getsockname()[1])
+        sock.close()
+        writer_class = type('Writer', (writers.BaseAGOWriter,), {
+            'feature_service': refused + 'feature',
+            'spool_path': os.path.join(TEST_DIRECTORY, 'spool'),
+            'max_attempts': 1})
+        with mock.patch('clients.base.ago.TOKEN_URL', self.url + 'token/'), \
+                mock.patch('clients.base.sessions.SESSION',
+                    sessions.create_session(retries=0)):
+            writer = writer_class()
+            writer.add_to_ago(self.example_message)
+            self.assertEqual(writer.buffer, [])
+            self.assertEqual(len(writer.spool), 1)
+            # replaying stops at the unreachable service
+            self.assertEqual(writer.replay(), 0)
+            self.assertEqual(len(writer.spool), 1)
+
+
+class TestColumnarWriter(PayloadTestCase):
+
+    def get_writer(self, **attributes):
+        attributes.setdefault('template', os.path.join(TEST_DIRECTORY, 'data'))
+        attributes.setdefault('header', tti_sci_chi.CSV_HEADER)
+        attributes.setdefault('parser_class', tti_sci_chi.TBS12S_CV50_Parser)
+        return type(
+            'Writer', (writers.BaseColumnarWriter,), attributes)()
+
+    def test_column_types(self):
+        writer = self.get_writer(types={'sensor_id': 'int'})
+        self.assertEqual(writer.get_column_type('air_temp', [1, 2.5]), 'float')
+        self.assertEqual(writer.get_column_type('rssi', [-51, None]), 'int')
+        self.assertEqual(writer.get_column_type('valid', [True]), 'bool')
+        self.assertEqual(writer.get_column_type('gw_id', ['a', 1]), 'string')
+        self.assertEqual(writer.get_column_type('x', [None]), 'null')
+        self.assertEqual(writer.get_column_type('device_time', []), 'timestamp')
+        self.assertEqual(writer.get_column_type('sensor_id', ['0']), 'int')
+        self.assertEqual(
+            writer.convert_column('int', ['0', 'x', None]), [0, None, None])
+        self.assertEqual(writer.merge_column_type('rssi', 'null'), 'null')
+        self.assertEqual(writer.merge_column_type('rssi', 'int'), 'int')
+        self.assertEqual(writer.merge_column_type('rssi', 'null'), 'int')
+        self.assertEqual(writer.merge_column_type('rssi', 'float'), 'float')
+        self.assertEqual(writer.merge_column_type('rssi', 'bool'), 'string')
+        self.assertEqual(writer.convert_column('timestamp', [
+            '2021-01-04T23:46:05.124510287Z', '2000-01-01 02:30:00', None]), [
+            datetime(2021, 1, 4, 23, 46, 5, 124510),
+            datetime(2000, 1, 1, 2, 30), None])
+
+    def test_partitions(self):
+        writer = self.get_writer()
+        partition = writer.get_partition(writer.parser.parse(
+            self.example_message))
+        self.assertEqual(partition, (
+            ('app_id', 'sci-chi-climate'), ('dev_id', 'tbs-12s-aa0120'),
+            ('date', '2021-01-04')))
+        self.assertEqual(writer.get_partition_path(partition), os.path.join(
+            TEST_DIRECTORY, 'data', 'app_id=sci-chi-climate',
+            'dev_id=tbs-12s-aa0120', 'date=2021-01-04'))
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_parquet(self):
+        writer = self.get_writer(row_group_size=3)
+        for _ in range(0, 5):
+            writer.add_to_csv(self.example_message)
+        writer.close()
+        directory = writer.get_partition_path(writer.get_partition(
+            writer.parser.parse(self.example_message)))
+        self.assertEqual(len(os.listdir(directory)), 2)
+        table = writer.read()
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(str(table.schema.field('air_temp').type), 'double')
+        self.assertEqual(str(table.schema.field('rssi').type), 'int64')
+        self.assertEqual(
+            str(table.schema.field('received_at').type), 'timestamp[us]')
+        self.assertEqual(table.column('air_temp').to_pylist(), [13.8] * 5)
+        self.assertEqual(
+            table.column('dev_id').to_pylist(), ['tbs-12s-aa0120'] * 5)
+        self.assertEqual(writer.read(
+            columns=['air_temp'], date=('2021-01-01', '2021-01-31')).num_rows, 5)
+        self.assertEqual(writer.read(dev_id='other').num_rows, 0)
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_null_column(self):
+        writer = self.get_writer(
+            header=('app_id', 'dev_id', 'received_utc', 'battery_voltage'))
+        row = {'app_id': 'app', 'dev_id': 'dev', 'received_utc': '2021-01-04'}
+        writer.write_rows([dict(row, battery_voltage=None)])
+        writer.flush()
+        writer.write_rows([dict(row, battery_voltage=3.6)])
+        writer.flush()
+        table = writer.read()
+        self.assertEqual(
+            str(table.schema.field('battery_voltage').type), 'double')
+        self.assertEqual(
+            sorted(table.column('battery_voltage').to_pylist(),
+                key=lambda value: value or 0), [None, 3.6])
+        # a new process reading files of both types
+        table = self.get_writer().read(columns=['battery_voltage'])
+        self.assertEqual(
+            str(table.schema.field('battery_voltage').type), 'double')
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_compact(self):
+        writer = self.get_writer(
+            header=('app_id', 'dev_id', 'received_utc', 'count'),
+            compact_files=3)
+        row = {'app_id': 'app', 'dev_id': 'dev'}
+
+        def write(day, count):
+            writer.write_rows([dict(
+                row, received_utc='2021-01-0{}T00:00:00'.format(day),
+                count=count)])
+            writer.flush()
+            return writer.get_partition_path(writer.get_partition(
+                {'app_id': 'app', 'dev_id': 'dev',
+                'received_utc': '2021-01-0{}'.format(day)}))
+
+        for count in range(0, 4):
+            first_day = write(1, count)
+        # compacted after the third file
+        self.assertEqual(len(os.listdir(first_day)), 2)
+        # the day is over
+        second_day = write(2, 4)
+        self.assertEqual(len(os.listdir(first_day)), 1)
+        self.assertEqual(len(os.listdir(second_day)), 1)
+        self.assertEqual(
+            writer.read(columns=['count']).column('count').to_pylist(),
+            list(range(0, 5)))
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_interrupted_compaction(self):
+        writer = self.get_writer(
+            header=('app_id', 'dev_id', 'received_utc', 'count'))
+        for count in range(0, 3):
+            writer.write_rows([{
+                'app_id': 'app', 'dev_id': 'dev', 'received_utc': '2021-01-01',
+                'count': count}])
+            writer.flush()
+        partition = next(iter(writer.file_counts))
+        with mock.patch('os.remove'):
+            writer.compact(partition)
+        directory = writer.get_partition_path(partition)
+        self.assertEqual(len(os.listdir(directory)), 4)
+        self.assertEqual(writer.read().num_rows, 3)
+        # the merged file replaces the files it covers
+        writer.compact(partition)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertEqual(writer.read().num_rows, 3)
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_arrow(self):
+        writer = self.get_writer(file_format='arrow')
+        writer.add_many_to_csv([self.example_message] * 4)
+        writer.flush()
+        self.assertEqual(writer.read(columns=['air_temp']).num_rows, 4)
+
+
+class TestSQLiteWriter(PayloadTestCase):
+
+    def get_writer(self, **attributes):
+        attributes.setdefault(
+            'template', os.path.join(TEST_DIRECTORY, 'data.sqlite'))
+        attributes.setdefault('parser_class', tti_sci_chi.TBS12S_CV50_Parser)
+        return type('Writer', (writers.BaseSQLiteWriter,), attributes)()
+
+    def get_rows(self, number):
+        row = parsers.TBS12SParser().parse(self.example_message)
+        return [
+            dict(row, dev_id='dev-{}'.format(idx % 2),
+                received_utc='2021-01-04T23:{:02d}:00Z'.format(idx),
+                rssi=idx)
+            for idx in range(0, number)]
+
+    def test_batches(self):
+        writer = self.get_writer(
+            header=['dev_id', 'received_utc', 'rssi'], batch_size=3)
+        writer.write_rows(self.get_rows(2))
+        self.assertEqual(len(writer.rows), 2)
+        writer.write_rows(self.get_rows(4)[2:])
+        self.assertEqual(writer.rows, [])
+        # duplicates are ignored
+        writer.write_rows(self.get_rows(6))
+        writer.close()
+        writer = self.get_writer(header=['dev_id', 'received_utc', 'rssi'])
+        self.assertEqual(
+            [item['rssi'] for item in writer.query()], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(
+            writer.connection.execute('PRAGMA journal_mode').fetchone()[0],
+            'wal')
+        writer.close()
+
+    def test_flush_interval(self):
+        with mock.patch('atexit.register') as register:
+            writer = self.get_writer(
+                header=['dev_id', 'received_utc', 'rssi'],
+                flush_interval=0.05)
+        # exit handling is set up once
+        register.assert_called_once_with(writer.close)
+        with writer.lock:
+            writer.write_rows(self.get_rows(1))
+            self.assertEqual(len(writer.rows), 1)
+            timer = writer.timer
+        timer.join()
+        self.assertEqual(writer.rows, [])
+        self.assertIsNone(writer.timer)
+        writer.close()
+
+    def test_query(self):
+        writer = self.get_writer()
+        writer.write_rows(self.get_rows(10))
+        writer.add_to_csv(self.example_message)
+        self.assertEqual(writer.latest('dev-1')['rssi'], 9)
+        self.assertIsNone(writer.latest('other'))
+        rows = writer.query(
+            dev_id='dev-0', start='2021-01-04T23:02', end='2021-01-04T23:08',
+            columns=['rssi'])
+        self.assertEqual(rows, [{'rssi': 2}, {'rssi': 4}, {'rssi': 6}])
+        # columns are added for all fields of the parser
+        self.assertEqual(
+            writer.latest('tbs-12s-aa0120')['air_temp'], 13.8)
+        self.assertEqual(len(writer.query(limit=5)), 5)
+        writer.close()